@@ -68,4 +68,10 @@ test_connection "MongoDB" ${MONGO_HOST} ${MONGO_PORT}
 echo "Starting charging server"
 
 python3 manage.py migrate
+
+# Load the EU VAT rates used in price calculation, they are refreshed daily afterwards
+python3 manage.py refresh_vat_rates || echo "It has not been possible to load the VAT rates"
+
+# Create the download permissions of the orders made before they were indexed
+python3 manage.py build_entitlements || echo "It has not been possible to create the entitlements"
 gunicorn wsgi:application --workers 1 --forwarded-allow-ips "*" --log-file - --bind 0.0.0.0:8006 --log-level ${LOGLEVEL}
@@ -46,6 +46,61 @@ DATABASES = {
     }
 }
 
+# Options of the process-wide MongoClient used for raw database access
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 100,
+    "minPoolSize": 0,
+    "connectTimeoutMS": 20000,
+    "serverSelectionTimeoutMS": 30000,
+    "socketTimeoutMS": None,
+    "w": 1,
+    "readPreference": "primary",
+}
+
+# Options of the pooled HTTP sessions used to access the TMForum APIs
+HTTP_CLIENT_OPTIONS = {
+    "connect_timeout": 10,
+    "read_timeout": 60,
+    "pool_connections": 10,
+    "pool_maxsize": 10,
+    "write_retries": 2,  # Retries of billing writes, POSTs are only retried on connect timeouts
+}
+
+# In-process cache of compiled price plans (productOfferingPrices)
+PRICE_PLAN_CACHE = {
+    "max_entries": 1000,
+    "max_size": 50 * 1024 * 1024,  # Bytes of price plan JSON
+    "ttl": 300,  # Seconds a plan is used before checking its lastUpdate
+}
+
+# In-process cache of the price components validated when offerings are published
+OFFERING_VALIDATION_CACHE = {
+    "max_entries": 5000,
+}
+
+# In-process cache of the organizations resolved from the authentication headers
+IDENTITY_CACHE = {
+    "max_entries": 10000,
+    "ttl": 60,  # Seconds the stored organization attributes are trusted
+}
+
+# In-process registry of the installed resource plugins
+PLUGIN_REGISTRY = {
+    "check_interval": 10,  # Seconds between checks of the registry version stamp
+}
+
+# Parallel download of the remote resources needed to serve a request (e.g. the
+# components of a bundled price plan)
+CONCURRENT_FETCH = {
+    "max_workers": 8,
+    "deadline": 30,  # Seconds
+}
+
+# Batches of SDR documents loaded in a single request
+SDR_BATCH = {
+    "max_size": 500,  # SDR documents per request
+}
+
 BASEDIR = path.dirname(path.abspath(__file__))
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800
@@ -205,8 +260,78 @@ CRONJOBS = [
     ("0 6 * * *", "django.core.management.call_command", ["resend_cdrs"]),
     ("0 4 * * *", "django.core.management.call_command", ["resend_upgrade"]),
     ("0 3 * * *", "django.core.management.call_command", ["retry_pending_terminations"]),
+    ("0 2 * * *", "django.core.management.call_command", ["refresh_vat_rates"]),
 ]
 
+# Processing of the customer bill webhook queue
+CB_WEBHOOK = {
+    "workers": 3,
+    "batch_size": 20,  # Tasks claimed at once from the queue
+    "min_poll_interval": 0.5,  # Seconds, used when change streams are not available
+    "max_poll_interval": 10,
+    "watch_timeout": 60,  # Seconds between checks of the queue when watching changes
+    "lock_retry_delay": 0.2,  # Seconds before retrying a task whose order is locked by another process
+}
+
+# Delivery of the notification emails stored in the outbox
+EMAIL_OUTBOX = {
+    "batch_size": 50,  # Emails sent with the same SMTP connection before checking for new ones
+    "poll_interval": 5,  # Seconds between checks of the outbox when idle
+    "idle_timeout": 60,  # Seconds an unused SMTP connection is kept open
+    "max_attempts": 8,
+    "retry_backoff": 30,  # Seconds before the first retry, doubled on every attempt
+    "max_backoff": 3600,
+    "claim_timeout": 600,  # Seconds after which an email being sent is considered abandoned
+    "attachment_wait": 10,  # Seconds between checks of the invoices still being generated
+}
+
+# Periodic check of the contracts to be renewed (pending_charges_daemon command)
+PENDING_CHARGES = {
+    "workers": 4,  # Orders processed concurrently
+    "batch_size": 500,  # Orders processed between checkpoints
+}
+
+# Revenue sharing settlement runs
+SETTLEMENT = {
+    "claim_timeout": 3600,  # Seconds after which the CDRs claimed by a settlement run are considered abandoned
+}
+
+# Background generation of PDF invoices
+INVOICE_RENDERER = {
+    "workers": 2,
+    "poll_interval": 5,  # Seconds between checks of the pending invoices when idle
+    "render_timeout": 120,  # Seconds allowed to compile an invoice
+    "max_attempts": 5,
+    "retry_delay": 60,  # Seconds before retrying a failed invoice, multiplied by the attempts
+    "claim_timeout": 600,  # Seconds after which an invoice being compiled is considered abandoned
+}
+
+# Local table of EU VAT rates used when calculating prices
+VAT_RATES = {
+    "reload_interval": 600,  # Seconds between reloads of the in-memory table from the database
+    "max_age": 7 * 24 * 3600,  # Seconds after the last refresh when the rates are considered stale
+}
+
+# Storage of the uploaded digital asset files
+ASSET_UPLOAD = {
+    "max_size": None,  # Bytes, no limit if None
+    "chunk_size": 1024 * 1024,  # Bytes read at once from the uploaded file
+    "multipart_threshold": 8 * 1024 * 1024,  # Bytes, bigger files are uploaded to S3 in parts
+    "multipart_chunksize": 8 * 1024 * 1024,
+    "max_concurrency": 4,  # Parts uploaded to S3 in parallel
+}
+
+# Upgrade of the inventory products when a digital asset is upgraded
+INVENTORY_UPGRADER = {
+    "workers": 8,  # Products patched concurrently
+    "resume_after": 600,  # Seconds without progress after which resend_upgrade resumes an upgrade
+}
+
+# Retrieval of usage documents from the usage API
+USAGE_CLIENT = {
+    "page_size": 100,  # Usage documents requested per page
+}
+
 CLIENTS = {
     "paypal": "wstore.charging_engine.payment_client.paypal_client.PayPalClient",
     "stripe": "wstore.charging_engine.payment_client.stripe_client.StripeClient",
@@ -253,6 +378,44 @@ env_port = environ.get("BAE_CB_MONGO_PORT", None)
 if env_port is not None:
     DATABASES["default"]["CLIENT"]["port"] = int(env_port)
 
+MONGO_CLIENT_OPTIONS["maxPoolSize"] = int(environ.get("BAE_CB_MONGO_MAX_POOL_SIZE", MONGO_CLIENT_OPTIONS["maxPoolSize"]))
+MONGO_CLIENT_OPTIONS["minPoolSize"] = int(environ.get("BAE_CB_MONGO_MIN_POOL_SIZE", MONGO_CLIENT_OPTIONS["minPoolSize"]))
+MONGO_CLIENT_OPTIONS["connectTimeoutMS"] = int(
+    environ.get("BAE_CB_MONGO_CONNECT_TIMEOUT", MONGO_CLIENT_OPTIONS["connectTimeoutMS"])
+)
+MONGO_CLIENT_OPTIONS["serverSelectionTimeoutMS"] = int(
+    environ.get("BAE_CB_MONGO_SERVER_SELECTION_TIMEOUT", MONGO_CLIENT_OPTIONS["serverSelectionTimeoutMS"])
+)
+
+env_socket_timeout = environ.get("BAE_CB_MONGO_SOCKET_TIMEOUT", None)
+if env_socket_timeout is not None:
+    MONGO_CLIENT_OPTIONS["socketTimeoutMS"] = int(env_socket_timeout)
+
+env_write_concern = environ.get("BAE_CB_MONGO_WRITE_CONCERN", None)
+if env_write_concern is not None:
+    MONGO_CLIENT_OPTIONS["w"] = int(env_write_concern) if env_write_concern.isdigit() else env_write_concern
+
+env_read_concern = environ.get("BAE_CB_MONGO_READ_CONCERN", None)
+if env_read_concern is not None:
+    MONGO_CLIENT_OPTIONS["readConcernLevel"] = env_read_concern
+
+MONGO_CLIENT_OPTIONS["readPreference"] = environ.get(
+    "BAE_CB_MONGO_READ_PREFERENCE", MONGO_CLIENT_OPTIONS["readPreference"]
+)
+HTTP_CLIENT_OPTIONS["connect_timeout"] = float(
+    environ.get("BAE_CB_HTTP_CONNECT_TIMEOUT", HTTP_CLIENT_OPTIONS["connect_timeout"])
+)
+HTTP_CLIENT_OPTIONS["read_timeout"] = float(environ.get("BAE_CB_HTTP_READ_TIMEOUT", HTTP_CLIENT_OPTIONS["read_timeout"]))
+HTTP_CLIENT_OPTIONS["pool_maxsize"] = int(environ.get("BAE_CB_HTTP_POOL_SIZE", HTTP_CLIENT_OPTIONS["pool_maxsize"]))
+HTTP_CLIENT_OPTIONS["write_retries"] = int(environ.get("BAE_CB_HTTP_WRITE_RETRIES", HTTP_CLIENT_OPTIONS["write_retries"]))
+PRICE_PLAN_CACHE["max_entries"] = int(environ.get("BAE_CB_PRICE_CACHE_ENTRIES", PRICE_PLAN_CACHE["max_entries"]))
+PRICE_PLAN_CACHE["max_size"] = int(environ.get("BAE_CB_PRICE_CACHE_SIZE", PRICE_PLAN_CACHE["max_size"]))
+PRICE_PLAN_CACHE["ttl"] = int(environ.get("BAE_CB_PRICE_CACHE_TTL", PRICE_PLAN_CACHE["ttl"]))
+CONCURRENT_FETCH["max_workers"] = int(environ.get("BAE_CB_FETCH_WORKERS", CONCURRENT_FETCH["max_workers"]))
+CONCURRENT_FETCH["deadline"] = float(environ.get("BAE_CB_FETCH_DEADLINE", CONCURRENT_FETCH["deadline"]))
+CB_WEBHOOK["workers"] = int(environ.get("BAE_CB_WEBHOOK_WORKERS", CB_WEBHOOK["workers"]))
+SDR_BATCH["max_size"] = int(environ.get("BAE_CB_SDR_BATCH_SIZE", SDR_BATCH["max_size"]))
+INVOICE_RENDERER["workers"] = int(environ.get("BAE_CB_INVOICE_WORKERS", INVOICE_RENDERER["workers"]))
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = int(environ.get("BAE_CB_MAX_UPLOAD_SIZE", DATA_UPLOAD_MAX_MEMORY_SIZE))
 
@@ -31,7 +31,7 @@ class AdminViewTestCase(TestCase):
     tags = ("notifications",)
 
     def setUp(self):
-        views.requests = MagicMock()
+        views.http_client = MagicMock()
         views.build_response = MagicMock()
         self._old_notification_recipient_email = settings.NOTIFICATION_RECIPIENT_EMAIL
         settings.NOTIFICATION_RECIPIENT_EMAIL = None
@@ -69,7 +69,7 @@ class AdminViewTestCase(TestCase):
             }]
         }
 
-        views.requests.get.return_value = response
+        views.http_client.get.return_value = response
         api = views.NotificationCollection(permitted_methods=("POST",))
         api.create(request)
 
@@ -98,7 +98,7 @@ class AdminViewTestCase(TestCase):
         response = MagicMock()
         response.raise_for_status.side_effect = ValueError("Party not found")
 
-        views.requests.get.return_value = response
+        views.http_client.get.return_value = response
 
         api = views.NotificationCollection(permitted_methods=("POST",))
         api.create(request)
@@ -116,7 +116,7 @@ class AdminViewTestCase(TestCase):
         response = MagicMock()
         response.json.return_value = {}
 
-        views.requests.get.return_value = response
+        views.http_client.get.return_value = response
         api = views.NotificationCollection(permitted_methods=("POST",))
         api.create(request)
 
@@ -139,7 +139,7 @@ class AdminViewTestCase(TestCase):
             }]
         }
 
-        views.requests.get.return_value = response
+        views.http_client.get.return_value = response
 
         self._email_instance.send_custom_email.side_effect = Exception("Email service error")
 
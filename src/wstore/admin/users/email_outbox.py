@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import smtplib
+import threading
+from datetime import datetime, timedelta, timezone
+from email import encoders, message_from_string
+from email.mime.base import MIMEBase
+from logging import getLogger
+
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from wstore.charging_engine.invoice_renderer import is_invoice_pending
+from wstore.models import EmailConfig
+from wstore.store_commons.database import get_database_connection
+
+logger = getLogger("wstore.default_logger")
+
+# Emails are not sent inline, they are stored in this collection and delivered
+# by the EmailSender thread of the web server processes
+OUTBOX_COLLECTION = "wstore_email_outbox"
+
+PENDING = "pending"
+SENDING = "sending"
+FAILED = "failed"
+
+_wakeup = threading.Event()
+
+
+class AttachmentNotReady(Exception):
+    pass
+
+
+def _get_options():
+    return getattr(settings, "EMAIL_OUTBOX", {})
+
+
+def enqueue_email(fromaddr, recipients, msg, attachments=None):
+    """
+    Stores an email in the outbox to be delivered by the background sender. The
+    given attachments (PDF invoices, relative to BASEDIR) are read when sending
+    """
+    now = datetime.now(timezone.utc)
+    get_database_connection()[OUTBOX_COLLECTION].insert_one(
+        {
+            "from": fromaddr,
+            "recipients": list(recipients),
+            "message": msg.as_string(),
+            "attachments": list(attachments or []),
+            "state": PENDING,
+            "attempts": 0,
+            "next_attempt": now,
+            "created_at": now,
+        }
+    )
+
+    # Wake up the sender of this process, if any
+    _wakeup.set()
+
+
+class EmailSender(threading.Thread):
+    """
+    Delivers the emails of the outbox in batches, reusing an authenticated SMTP
+    connection while there are messages to be sent. Failed emails are retried
+    with an exponential backoff
+    """
+
+    def __init__(self):
+        super().__init__(name="Email_Sender", daemon=True)
+        self._db = get_database_connection()
+        self._connection = None
+        self._last_used = None
+
+    def _connect(self):
+        config = EmailConfig.objects.first()
+        if config is None:
+            raise smtplib.SMTPException("Missing email configuration")
+
+        logger.debug(f"Opening SMTP connection with {config.smtp_server}, {config.smtp_port}, {config.email_user}")
+
+        server = smtplib.SMTP(config.smtp_server, config.smtp_port)
+        server.starttls()
+        server.login(config.email_user, config.email_password)
+        return server
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = self._connect()
+
+        return self._connection
+
+    def _close_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.quit()
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+
+            self._connection = None
+
+    def _claim_batch(self):
+        outbox = self._db[OUTBOX_COLLECTION]
+        batch = []
+
+        for _ in range(_get_options().get("batch_size", 50)):
+            email = outbox.find_one_and_update(
+                {"state": PENDING, "next_attempt": {"$lte": datetime.now(timezone.utc)}},
+                {"$set": {"state": SENDING, "claimed_at": datetime.now(timezone.utc)}},
+                sort=[("next_attempt", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+
+            if email is None:
+                break
+
+            batch.append(email)
+
+        return batch
+
+    def _get_message(self, email):
+        attachments = email.get("attachments", [])
+        if len(attachments) == 0:
+            return email["message"]
+
+        msg = message_from_string(email["message"])
+        for bill in attachments:
+            path = os.path.join(settings.BASEDIR, bill)
+
+            if not os.path.exists(path):
+                if is_invoice_pending(os.path.basename(bill)):
+                    raise AttachmentNotReady(bill)
+
+                # The invoice could not be generated, the notification is sent anyway
+                logger.error(f"Invoice {bill} is not available, sending the email without it")
+                continue
+
+            with open(path, "rb") as fp:
+                b_msg = MIMEBase("application", "pdf")
+                b_msg.set_payload(fp.read())
+
+            # Encode the payload using Base64
+            encoders.encode_base64(b_msg)
+            b_msg.add_header("Content-Disposition", "attachment", filename=bill.split("/")[-1])
+            msg.attach(b_msg)
+
+        return msg.as_string()
+
+    def _send(self, email):
+        message = self._get_message(email)
+
+        try:
+            self._get_connection().sendmail(email["from"], email["recipients"], message)
+        except smtplib.SMTPServerDisconnected:
+            # The server closed the reused connection, retry with a new one
+            self._connection = None
+            self._get_connection().sendmail(email["from"], email["recipients"], message)
+
+    def _wait_attachments(self, email, bill):
+        # Waiting for the invoices is not a delivery error, so no attempt is consumed
+        delay = _get_options().get("attachment_wait", 10)
+        logger.debug(f"Invoice {bill} is still being generated, delaying email {email['_id']} {delay}s")
+
+        self._db[OUTBOX_COLLECTION].update_one(
+            {"_id": email["_id"]},
+            {"$set": {"state": PENDING, "next_attempt": datetime.now(timezone.utc) + timedelta(seconds=delay)}},
+        )
+
+    def _retry_later(self, email, error):
+        options = _get_options()
+        attempts = email["attempts"] + 1
+
+        update = {"attempts": attempts, "last_error": str(error), "state": PENDING}
+        if attempts >= options.get("max_attempts", 8):
+            logger.error(f"Giving up sending email to {','.join(email['recipients'])}: {error}")
+            update["state"] = FAILED
+        else:
+            backoff = min(options.get("retry_backoff", 30) * 2 ** (attempts - 1), options.get("max_backoff", 3600))
+            update["next_attempt"] = datetime.now(timezone.utc) + timedelta(seconds=backoff)
+            logger.warning(f"Error sending email to {','.join(email['recipients'])}, retrying in {backoff}s: {error}")
+
+        self._db[OUTBOX_COLLECTION].update_one({"_id": email["_id"]}, {"$set": update})
+
+    def process_batch(self):
+        """
+        Sends a batch of pending emails. Returns the number of emails processed
+        """
+        batch = self._claim_batch()
+
+        for email in batch:
+            try:
+                self._send(email)
+            except AttachmentNotReady as e:
+                self._wait_attachments(email, str(e))
+            except (smtplib.SMTPException, OSError) as e:
+                # Connection errors invalidate the connection
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self._close_connection()
+
+                self._retry_later(email, e)
+            else:
+                self._db[OUTBOX_COLLECTION].delete_one({"_id": email["_id"]})
+
+        if len(batch) > 0:
+            self._last_used = datetime.now(timezone.utc)
+
+        return len(batch)
+
+    def recover(self):
+        # Emails claimed long ago were being sent by a process that stopped, so they are
+        # sent again. Other processes may be running senders, so recent ones are kept
+        stale = datetime.now(timezone.utc) - timedelta(seconds=_get_options().get("claim_timeout", 600))
+        recovered = self._db[OUTBOX_COLLECTION].update_many(
+            {"state": SENDING, "claimed_at": {"$lt": stale}}, {"$set": {"state": PENDING}}
+        )
+
+        if recovered.modified_count > 0:
+            logger.info(f"Recovered {recovered.modified_count} emails from the outbox")
+
+    def run(self):
+        options = _get_options()
+
+        while True:
+            try:
+                processed = self.process_batch()
+            except Exception as e:
+                logger.error(f"Error processing the email outbox: {e}")
+                processed = 0
+
+            if processed > 0:
+                continue
+
+            try:
+                self.recover()
+            except Exception as e:
+                logger.error(f"Error recovering the email outbox: {e}")
+
+            # Close the connection if it has not been used recently
+            if self._last_used is not None and datetime.now(timezone.utc) - self._last_used > timedelta(
+                seconds=options.get("idle_timeout", 60)
+            ):
+                self._close_connection()
+                self._last_used = None
+
+            _wakeup.wait(options.get("poll_interval", 5))
+            _wakeup.clear()
@@ -21,10 +21,6 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import os
-import smtplib
-from email import encoders
-from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from urllib.parse import urljoin
@@ -34,6 +30,7 @@ from bson.objectid import ObjectId
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
+from wstore.admin.users.email_outbox import enqueue_email
 from wstore.models import User, EmailConfig
 from wstore.ordering.models import Offering
 
@@ -57,13 +54,13 @@ class NotificationsHandler:
         self._port = config.smtp_port
 
     def _send_email(self, recipient, msg):
-        logger.debug(f"Sending email with {self._server}, {self._port}, {self._mailuser}, {self._fromaddr}, {self._password}")
+        # The email is delivered asynchronously by the outbox sender
+        enqueue_email(self._fromaddr, recipient, msg)
 
-        server = smtplib.SMTP(self._server, self._port)
-        server.starttls()
-        server.login(self._mailuser, self._password)
-
-        server.sendmail(self._fromaddr, recipient, msg.as_string())
+    def _get_recipients(self, org):
+        # Emails of the organization managers, retrieved with a single query
+        emails = {str(user.pk): user.email for user in User.objects.filter(pk__in=org.managers)}
+        return [emails[str(pk)] for pk in org.managers if str(pk) in emails]
 
     def _send_text_email(self, text, recipients, subject):
         logger.debug("Sending email to " + ",".join(recipients) + "with subject " + subject)
@@ -121,19 +118,9 @@ class NotificationsHandler:
         message = MIMEText(text)
         msg.attach(message)
 
-        for bill in bills:
-            path = os.path.join(settings.BASEDIR, bill)
-
-            with open(path, "rb") as fp:
-                b_msg = MIMEBase("application", "pdf")
-                b_msg.set_payload(fp.read())
-
-            # Encode the payload using Base64
-            encoders.encode_base64(b_msg)
-            b_msg.add_header("Content-Disposition", "attachment", filename=bill.split("/")[-1])
-            msg.attach(b_msg)
-
-        self._send_email(recipients, msg)
+        # PDF invoices are attached by the outbox sender, as they may still be
+        # being generated by the invoice renderer
+        enqueue_email(self._fromaddr, recipients, msg, attachments=[bill for bill in bills if bill])
 
     def extract_bills_paths(self, order):
         return [
@@ -144,7 +131,7 @@ class NotificationsHandler:
 
     def send_acquired_notification(self, order):
         org = order.owner_organization
-        recipients = [User.objects.get(pk=pk).email for pk in org.managers]
+        recipients = self._get_recipients(org)
         domain = settings.SITE
 
         order_url = urljoin(domain, "/#/inventory/order")
@@ -165,7 +152,7 @@ class NotificationsHandler:
 
     def send_product_upgraded_notification(self, order, contract, product_name):
         org = order.owner_organization
-        recipients = [User.objects.get(pk=pk).email for pk in org.managers]
+        recipients = self._get_recipients(org)
         domain = settings.SITE
 
         product_url = urljoin(domain, "/#/inventory/product/{}".format(contract.product_id))
@@ -179,7 +166,7 @@ class NotificationsHandler:
         # Get destination email
         offering = Offering.objects.get(pk=ObjectId(contract.offering))
         org = offering.owner_organization
-        recipients = [User.objects.get(pk=pk).email for pk in org.managers]
+        recipients = self._get_recipients(org)
         domain = settings.SITE
 
         url = urljoin(domain, "/#/inventory/order")
@@ -192,7 +179,7 @@ class NotificationsHandler:
 
     def send_payment_required_notification(self, order, contract):
         org = order.owner_organization
-        recipients = [User.objects.get(pk=pk).email for pk in org.managers]
+        recipients = self._get_recipients(org)
 
         domain = settings.SITE
         url = urljoin(domain, "/#/inventory/order/" + order.order_id)
@@ -208,7 +195,7 @@ class NotificationsHandler:
 
     def send_near_expiration_notification(self, order, contract, days):
         org = order.owner_organization
-        recipients = [User.objects.get(pk=pk).email for pk in org.managers]
+        recipients = self._get_recipients(org)
 
         domain = settings.SITE
         url = urljoin(domain, "/#/inventory/order/" + order.order_id)
@@ -225,7 +212,7 @@ class NotificationsHandler:
 
     def send_renovation_notification(self, order, transactions):
         org = order.owner_organization
-        recipients = [User.objects.get(pk=pk).email for pk in org.managers]
+        recipients = self._get_recipients(org)
         domain = settings.SITE
 
         order_url = urljoin(domain, "/#/inventory/order")
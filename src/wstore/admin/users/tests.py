@@ -19,15 +19,24 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import shutil
+import smtplib
+import tempfile
+from datetime import datetime, timezone
+from email import message_from_string
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
 from importlib import reload
 
 from bson import ObjectId
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase
-from mock import MagicMock, call, mock_open
+from django.test.utils import override_settings
+from mock import ANY, MagicMock, call, mock_open
 from parameterized import parameterized
 
-from wstore.admin.users import notification_handler
+from wstore.admin.users import email_outbox, notification_handler
 
 __test__ = False
 
@@ -101,18 +110,21 @@ class NotificationsTestCase(TestCase):
 
         # Mock user
         notification_handler.User = MagicMock()
-        self._user1 = MagicMock()
-        self._user1.email = "user1@email.com"
-        self._user2 = MagicMock()
-        self._user2.email = "user2@email.com"
-        notification_handler.User.objects.get.side_effect = [self._user1, self._user2]
+        self._user1 = MagicMock(pk="11111", email="user1@email.com")
+        self._user2 = MagicMock(pk="22222", email="user2@email.com")
+        self._user3 = MagicMock(pk="33333", email="user1@email.com")
+        self._user4 = MagicMock(pk="44444", email="user2@email.com")
+
+        def filter_users(pk__in):
+            users = [self._user4, self._user3, self._user2, self._user1]
+            return [user for user in users if user.pk in pk__in]
+
+        notification_handler.User.objects.filter.side_effect = filter_users
 
         # Mock email libs
         notification_handler.MIMEMultipart = MagicMock()
         notification_handler.MIMEText = MagicMock()
-        notification_handler.MIMEBase = MagicMock()
-        notification_handler.encoders = MagicMock()
-        notification_handler.smtplib = MagicMock()
+        notification_handler.enqueue_email = MagicMock()
 
         # Mock open method
         self._mock_open = mock_open()
@@ -153,14 +165,14 @@ class NotificationsTestCase(TestCase):
 
     def _validate_user_call(self):
         self.assertEquals(
-            [call(pk="11111"), call(pk="22222")],
-            notification_handler.User.objects.get.call_args_list,
+            [call(pk__in=["11111", "22222"])],
+            notification_handler.User.objects.filter.call_args_list,
         )
 
     def _validate_provider_call(self):
         self.assertEquals(
-            [call(pk="33333"), call(pk="44444")],
-            notification_handler.User.objects.get.call_args_list,
+            [call(pk__in=["33333", "44444"])],
+            notification_handler.User.objects.filter.call_args_list,
         )
 
     def _validate_mime_text_info(self, subject):
@@ -176,30 +188,18 @@ class NotificationsTestCase(TestCase):
     def _validate_email_call(self, mime, emails=None):
         if emails is None:
             emails = ["user1@email.com", "user2@email.com"]
-        notification_handler.smtplib.SMTP.assert_called_once_with("smtp.gmail.com", 587)
-        notification_handler.smtplib.SMTP().starttls.assert_called_once_with()
-        notification_handler.smtplib.SMTP().login.assert_called_once_with("wstore", "passwd")
-        notification_handler.smtplib.SMTP().sendmail.assert_called_once_with(
-            "wstore@email.com", emails, mime().as_string()
-        )
+        notification_handler.enqueue_email.assert_called_once_with("wstore@email.com", emails, mime())
 
     def _validate_multipart_call(self):
-        self._mock_open.assert_called_once_with("/home/test/wstore/media/bills/bill1.pdf", "rb")
-
-        notification_handler.MIMEBase.assert_called_once_with("application", "pdf")
-        notification_handler.MIMEBase().set_payload.assert_called_once_with(self._mock_open().read())
-
-        notification_handler.encoders.encode_base64.assert_called_once_with(notification_handler.MIMEBase())
-        notification_handler.MIMEBase().add_header.assert_called_once_with(
-            "Content-Disposition", "attachment", filename="bill1.pdf"
-        )
-
-        self.assertEquals(
-            [
-                call(notification_handler.MIMEText()),
-                call(notification_handler.MIMEBase()),
-            ],
-            notification_handler.MIMEMultipart().attach.call_args_list,
+        # Invoices are attached by the outbox sender
+        self._mock_open.assert_not_called()
+        notification_handler.MIMEMultipart().attach.assert_called_once_with(notification_handler.MIMEText())
+
+        notification_handler.enqueue_email.assert_called_once_with(
+            "wstore@email.com",
+            ["user1@email.com", "user2@email.com"],
+            notification_handler.MIMEMultipart(),
+            attachments=["media/bills/bill1.pdf"],
         )
 
     def test_acquisition_notification(self):
@@ -231,7 +231,6 @@ class NotificationsTestCase(TestCase):
         notification_handler.MIMEText.assert_called_once_with(text)
 
         self._validate_multipart_call()
-        self._validate_email_call(notification_handler.MIMEMultipart)
 
     def test_renovation_notification(self):
         handler = notification_handler.NotificationsHandler()
@@ -252,7 +251,6 @@ class NotificationsTestCase(TestCase):
         notification_handler.MIMEText.assert_called_once_with(text)
 
         self._validate_multipart_call()
-        self._validate_email_call(notification_handler.MIMEMultipart)
 
     def test_payout_error(self):
         handler = notification_handler.NotificationsHandler()
@@ -357,3 +355,216 @@ class NotificationsTestCase(TestCase):
         )
 
         notification_handler.MIMEText.assert_called_once_with(html, "html")
+
+
+class EmailSenderTestCase(TestCase):
+    tags = ("notifications",)
+
+    def setUp(self):
+        self._config = MagicMock()
+        self._config.smtp_server = "smtp.gmail.com"
+        self._config.smtp_port = 587
+        self._config.email_user = "wstore"
+        self._config.email_password = "passwd"
+
+        email_outbox.EmailConfig = MagicMock()
+        email_outbox.EmailConfig.objects.first.return_value = self._config
+
+        self._outbox = MagicMock()
+        email_outbox.get_database_connection = MagicMock(return_value={"wstore_email_outbox": self._outbox})
+
+        email_outbox.smtplib = MagicMock()
+        email_outbox.smtplib.SMTPException = smtplib.SMTPException
+        email_outbox.smtplib.SMTPServerDisconnected = smtplib.SMTPServerDisconnected
+        email_outbox.smtplib.SMTPRecipientsRefused = smtplib.SMTPRecipientsRefused
+
+        self._emails = [
+            {"_id": "1", "from": "wstore@email.com", "recipients": ["user1@email.com"], "message": "msg1", "attempts": 0},
+            {"_id": "2", "from": "wstore@email.com", "recipients": ["user2@email.com"], "message": "msg2", "attempts": 2},
+        ]
+        self._outbox.find_one_and_update.side_effect = self._emails + [None]
+
+    def tearDown(self):
+        reload(email_outbox)
+
+    def test_enqueue_email(self):
+        msg = MagicMock()
+        msg.as_string.return_value = "message"
+
+        email_outbox.enqueue_email("wstore@email.com", ["user1@email.com"], msg)
+
+        document = self._outbox.insert_one.call_args[0][0]
+        self.assertEquals("wstore@email.com", document["from"])
+        self.assertEquals(["user1@email.com"], document["recipients"])
+        self.assertEquals("message", document["message"])
+        self.assertEquals([], document["attachments"])
+        self.assertEquals(email_outbox.PENDING, document["state"])
+        self.assertEquals(0, document["attempts"])
+        self.assertTrue(email_outbox._wakeup.is_set())
+
+    def test_process_batch_single_connection(self):
+        sender = email_outbox.EmailSender()
+
+        self.assertEquals(2, sender.process_batch())
+
+        email_outbox.smtplib.SMTP.assert_called_once_with("smtp.gmail.com", 587)
+        email_outbox.smtplib.SMTP().starttls.assert_called_once_with()
+        email_outbox.smtplib.SMTP().login.assert_called_once_with("wstore", "passwd")
+        self.assertEquals(
+            [
+                call("wstore@email.com", ["user1@email.com"], "msg1"),
+                call("wstore@email.com", ["user2@email.com"], "msg2"),
+            ],
+            email_outbox.smtplib.SMTP().sendmail.call_args_list,
+        )
+        self.assertEquals([call({"_id": "1"}), call({"_id": "2"})], self._outbox.delete_one.call_args_list)
+
+        # The connection is kept for the next batch
+        email_outbox.smtplib.SMTP().quit.assert_not_called()
+
+    def test_process_batch_reconnect(self):
+        connection = MagicMock()
+        connection.sendmail.side_effect = [smtplib.SMTPServerDisconnected("closed"), None]
+        new_connection = MagicMock()
+        email_outbox.smtplib.SMTP.side_effect = [connection, new_connection]
+
+        self._outbox.find_one_and_update.side_effect = [self._emails[0], None]
+
+        sender = email_outbox.EmailSender()
+        sender.process_batch()
+
+        self.assertEquals(2, email_outbox.smtplib.SMTP.call_count)
+        new_connection.sendmail.assert_called_once_with("wstore@email.com", ["user1@email.com"], "msg1")
+        self._outbox.delete_one.assert_called_once_with({"_id": "1"})
+
+    @parameterized.expand([("retry", 0, 30, email_outbox.PENDING), ("backoff", 2, 120, email_outbox.PENDING), ("give_up", 7, None, email_outbox.FAILED)])
+    def test_process_batch_error(self, name, attempts, backoff, state):
+        self._emails[0]["attempts"] = attempts
+        self._outbox.find_one_and_update.side_effect = [self._emails[0], None]
+        email_outbox.smtplib.SMTP().sendmail.side_effect = smtplib.SMTPDataError(554, "error")
+
+        sender = email_outbox.EmailSender()
+        sender.process_batch()
+
+        self._outbox.delete_one.assert_not_called()
+        email_outbox.smtplib.SMTP().quit.assert_called_once_with()
+
+        query, update = self._outbox.update_one.call_args[0]
+        self.assertEquals({"_id": "1"}, query)
+        self.assertEquals(attempts + 1, update["$set"]["attempts"])
+        self.assertEquals(state, update["$set"]["state"])
+
+        if backoff is not None:
+            delay = (update["$set"]["next_attempt"] - datetime.now(timezone.utc)).total_seconds()
+            self.assertTrue(backoff - 5 < delay <= backoff)
+        else:
+            self.assertFalse("next_attempt" in update["$set"])
+
+    def _mock_invoice_email(self, invoice_pending):
+        self._basedir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._basedir)
+        os.makedirs(os.path.join(self._basedir, "media", "bills"))
+
+        email_outbox.is_invoice_pending = MagicMock(return_value=invoice_pending)
+
+        msg = MIMEMultipart()
+        msg.attach(MIMEText("Your order"))
+        self._emails[0]["message"] = msg.as_string()
+        self._emails[0]["attachments"] = ["media/bills/bill1.pdf"]
+        self._outbox.find_one_and_update.side_effect = [self._emails[0], None]
+
+    def _create_invoice(self):
+        with open(os.path.join(self._basedir, "media", "bills", "bill1.pdf"), "wb") as f:
+            f.write(b"%PDF invoice")
+
+    def _get_sent_message(self):
+        email_outbox.smtplib.SMTP().sendmail.assert_called_once_with("wstore@email.com", ["user1@email.com"], ANY)
+        return message_from_string(email_outbox.smtplib.SMTP().sendmail.call_args[0][2])
+
+    def test_process_batch_invoice_attached(self):
+        self._mock_invoice_email(False)
+        self._create_invoice()
+
+        with override_settings(BASEDIR=self._basedir):
+            email_outbox.EmailSender().process_batch()
+
+        parts = self._get_sent_message().get_payload()
+        self.assertEquals("Your order", parts[0].get_payload())
+        self.assertEquals("bill1.pdf", parts[1].get_filename())
+        self.assertEquals(b"%PDF invoice", parts[1].get_payload(decode=True))
+
+        self._outbox.delete_one.assert_called_once_with({"_id": "1"})
+
+    def test_process_batch_invoice_pending(self):
+        self._mock_invoice_email(True)
+
+        with override_settings(BASEDIR=self._basedir):
+            email_outbox.EmailSender().process_batch()
+
+        email_outbox.is_invoice_pending.assert_called_once_with("bill1.pdf")
+        email_outbox.smtplib.SMTP().sendmail.assert_not_called()
+        self._outbox.delete_one.assert_not_called()
+
+        # The email waits for the invoice without consuming attempts
+        query, update = self._outbox.update_one.call_args[0]
+        self.assertEquals({"_id": "1"}, query)
+        self.assertEquals(email_outbox.PENDING, update["$set"]["state"])
+        self.assertFalse("attempts" in update["$set"])
+
+        delay = (update["$set"]["next_attempt"] - datetime.now(timezone.utc)).total_seconds()
+        self.assertTrue(5 < delay <= 10)
+
+    def test_process_batch_invoice_failed(self):
+        self._mock_invoice_email(False)
+
+        with override_settings(BASEDIR=self._basedir):
+            email_outbox.EmailSender().process_batch()
+
+        # The notification is sent without the invoice that could not be generated
+        parts = self._get_sent_message().get_payload()
+        self.assertEquals(1, len(parts))
+        self.assertEquals("Your order", parts[0].get_payload())
+        self._outbox.delete_one.assert_called_once_with({"_id": "1"})
+
+    def test_acquired_notification_after_invoice(self):
+        # Order charged, with the invoice of the charge still being generated
+        self._mock_invoice_email(True)
+
+        notification_handler.EmailConfig = MagicMock()
+        notification_handler.EmailConfig.objects.first.return_value = MagicMock(email="wstore@email.com")
+        notification_handler.User = MagicMock()
+        notification_handler.User.objects.filter.return_value = [MagicMock(pk="11111", email="user1@email.com")]
+        notification_handler.Offering = MagicMock()
+        notification_handler.Offering.objects.get.return_value = MagicMock(off_id="1")
+        notification_handler.Offering.objects.get.return_value.name = "Offering1"
+        notification_handler.enqueue_email = email_outbox.enqueue_email
+        self.addCleanup(reload, notification_handler)
+
+        contract = MagicMock(offering="61004aba5e05acc115f022f0")
+        contract.charges = [MagicMock(invoice="/charging/media/bills/bill1.pdf")]
+
+        order = MagicMock(pk=ObjectId("61004aba5e05acc115f022f0"))
+        order.owner_organization.managers = ["11111"]
+        order.get_contracts.return_value = [contract]
+
+        notification_handler.NotificationsHandler().send_acquired_notification(order)
+
+        email = self._outbox.insert_one.call_args[0][0]
+        email["_id"] = "1"
+        self.assertEquals(["media/bills/bill1.pdf"], email["attachments"])
+
+        sender = email_outbox.EmailSender()
+        with override_settings(BASEDIR=self._basedir):
+            self._outbox.find_one_and_update.side_effect = [dict(email), None]
+            sender.process_batch()
+
+            email_outbox.smtplib.SMTP().sendmail.assert_not_called()
+
+            # Once the invoice is generated the email is sent with it
+            self._create_invoice()
+            self._outbox.find_one_and_update.side_effect = [dict(email), None]
+            sender.process_batch()
+
+        parts = self._get_sent_message().get_payload()
+        self.assertEquals("Product order accepted", self._get_sent_message()["Subject"])
+        self.assertEquals(b"%PDF invoice", parts[1].get_payload(decode=True))
@@ -21,12 +21,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
-import requests
 
 from logging import getLogger
 
 from django.conf import settings
 
+from wstore.store_commons import http_client
 from wstore.store_commons.database import get_database_connection
 from wstore.store_commons.resource import Resource
 from wstore.store_commons.utils.http import JsonResponse, authentication_required, build_response, supported_request_mime_types
@@ -149,7 +149,7 @@ class NotificationCollection(Resource):
         """
         try:
             party_url = get_service_url('party', f"/organization/{party_id}")
-            response = requests.get(party_url)
+            response = http_client.get(party_url)
             response.raise_for_status()
 
             return response.json()
@@ -1,8 +1,23 @@
 from django.apps import AppConfig
 import logging
+import os
 
 logger = logging.getLogger("wstore.default_logger")
 
+MANAGEMENT_SCRIPTS = ("manage.py", "django-admin", "django-admin.py")
+
+
+def is_server_process(argv):
+    """
+    Checks whether the process is serving requests (gunicorn or runserver), so long-running
+    background workers can be started. Management commands are short-lived and could exit
+    with the work they claimed half done
+    """
+    if len(argv) > 0 and os.path.basename(argv[0]) in MANAGEMENT_SCRIPTS:
+        return argv[1:2] == ["runserver"]
+
+    return True
+
 
 def register_signals():
     from django.contrib.auth.models import User
@@ -59,6 +74,10 @@ class WstoreConfig(AppConfig):
             self._create_indexes()
             self._start_webhook_listener()
 
+            if is_server_process(sys.argv):
+                self._start_email_sender()
+                self._start_invoice_renderer()
+
     def _create_indexes(self):
         """Create MongoDB indexes for performance optimization"""
         try:
@@ -76,6 +95,31 @@ class WstoreConfig(AppConfig):
                 )
                 logger.info("Created customer_bill_idx index on wstore_order")
 
+            # Subscriptions about to be renewed are searched by the pending charges daemon
+            db.wstore_order.create_index(
+                [("contracts.pricing_model.subscription.renovation_date", 1)], name="renovation_date_idx"
+            )
+
+            # Customer bill tasks are claimed in batches and read back by claim token
+            db.wstore_cb_queue.create_index([("in_queue", 1), ("_id", 1)], name="cb_queue_idx")
+            db.wstore_cb_queue.create_index("claim", name="cb_queue_claim_idx")
+
+            # Download permissions are checked by organization and asset, and
+            # updated by order item
+            db.wstore_entitlement.create_index([("organization", 1), ("asset", 1)], name="entitlement_idx")
+            db.wstore_entitlement.create_index(
+                [("order", 1), ("item", 1), ("asset", 1)], name="entitlement_source_idx", unique=True
+            )
+
+            # Pending emails are claimed by state and retry date
+            db.wstore_email_outbox.create_index([("state", 1), ("next_attempt", 1)], name="email_outbox_idx")
+
+            # Pending invoices are claimed by state and retry date
+            db.wstore_invoice_job.create_index([("state", 1), ("next_attempt", 1)], name="invoice_job_idx")
+
+            # Emails with invoices attached check whether they are still pending
+            db.wstore_invoice_job.create_index("name", name="invoice_job_name_idx")
+
         except Exception as e:
             # Don't fail startup if index creation fails
             logger.warning(f"Could not create indexes: {e}")
@@ -94,3 +138,27 @@ class WstoreConfig(AppConfig):
         except Exception as e:
             logger.warning(f"FAILED starting customer bill webhook listener: {e}")
             raise Exception("Webhook startup failure")
+
+    def _start_email_sender(self):
+        """Start the background sender of the email outbox"""
+        try:
+            from wstore.admin.users.email_outbox import EmailSender
+
+            EmailSender().start()
+            logger.info("Email sender started successfully")
+
+        except Exception as e:
+            # Emails are kept in the outbox until a sender is available
+            logger.warning(f"FAILED starting email sender: {e}")
+
+    def _start_invoice_renderer(self):
+        """Start the background workers generating the PDF invoices"""
+        try:
+            from wstore.charging_engine.invoice_renderer import InvoiceRenderer
+
+            InvoiceRenderer().start()
+            logger.info("Invoice renderer started successfully")
+
+        except Exception as e:
+            # Invoices are kept pending until a renderer is available
+            logger.warning(f"FAILED starting invoice renderer: {e}")
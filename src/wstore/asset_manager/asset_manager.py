@@ -19,17 +19,19 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import base64
 import json
 import os
 import threading
 from logging import getLogger
 from urllib.parse import urljoin
 
+from boto3.s3.transfer import TransferConfig
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
 
-from wstore.models import Resource, ResourcePlugin, ResourceVersion
+from wstore.asset_manager.asset_stream import AssetStream, Base64Reader
+from wstore.asset_manager.resource_plugins.plugin_registry import PLUGIN_REGISTRY
+from wstore.models import Resource, ResourceVersion
 from wstore.store_commons.database import DocumentLock
 from wstore.store_commons.errors import ConflictError
 from wstore.store_commons.rollback import downgrade_asset, downgrade_asset_pa, rollback
@@ -50,76 +52,60 @@ class AssetManager:
         )
 
     def _save_resource_file(self, provider, file_, isPublic):
-        logger.debug(f"Saving resource file {file_['name']}")
-        # Load file contents
+        options = getattr(settings, "ASSET_UPLOAD", {})
+
+        # Load file contents, they are read in chunks while being saved
         if isinstance(file_, dict):
             file_name = file_["name"]
-            content = base64.b64decode(file_["data"])
+            content = Base64Reader(file_["data"])
         else:
             file_name = file_.name
             file_.seek(0)
-            content = file_.read()
+            content = file_
+
+        logger.debug(f"Saving resource file {file_name}")
+
         # Check file name
         if not is_valid_file(file_name):
             logger.debug(f"`{file_name}` is not a valid file name")
             raise ValueError("Invalid file name format: Unsupported character")
+
+        stream = AssetStream(content, options.get("chunk_size", 1024 * 1024), max_size=options.get("max_size"))
         if isPublic is True and settings.AWS_ENABLED:
-            return self.__save_resource_aws(file_name, content)
+            result = self.__save_resource_aws(file_name, stream)
         else:
-            return self.__save_resource_local(provider, file_name, content)
-        
+            result = self.__save_resource_local(provider, file_name, stream)
 
-    def __save_resource_aws(self,  file_name, content):
+        logger.debug(f"Saved resource file {file_name}, {stream.size} bytes, sha256 {stream.hexdigest()}")
+        return result
 
-        # Create temp dir for assets if it does not exist
-        provider_dir = os.path.join(settings.MEDIA_ROOT, "assets", "temp")
+    def __save_resource_aws(self, file_name, stream):
+        options = getattr(settings, "ASSET_UPLOAD", {})
 
-        if not os.path.isdir(provider_dir):
-            os.makedirs(provider_dir, exist_ok=True)
-        # Local file path for the asset file 
-        file_path = os.path.join(provider_dir, file_name)
-        logger.debug(f"File path for asset file: {file_path}")
         # Key of s3
         resource_path = os.path.join(settings.MEDIA_DIR, file_name)
 
         if resource_path.startswith("/"):
             resource_path = resource_path[1:]
 
-        # Check if the file already exists
-        if os.path.exists(file_path):
-            logger.error(f"The asset file `{file_name}` already exists")
-            raise ConflictError(f"The provided digital asset file ({file_name}) already exists")
-
-        logger.debug("Paths needed for saving temp resource file OK")
-        
-        # Create file
-        with open(file_path, "wb") as f:
-            f.write(content)
-
-        self.rollback_logger["files"].append(file_path)
-
-        logger.debug("Asset temp file created")
-        # upload the file to S3
+        # upload the file to S3, big files are uploaded in parts sent in parallel
         acl = {'ACL': 'public-read'} if settings.ACL_ENABLED else None
-        self.s3.upload_file(file_path, settings.BUCKET_NAME, resource_path, ExtraArgs=acl)
+        config = TransferConfig(
+            multipart_threshold=options.get("multipart_threshold", 8 * 1024 * 1024),
+            multipart_chunksize=options.get("multipart_chunksize", 8 * 1024 * 1024),
+            max_concurrency=options.get("max_concurrency", 4),
+        )
+        self.s3.upload_fileobj(stream, settings.BUCKET_NAME, resource_path, ExtraArgs=acl, Config=config)
 
         logger.debug(f'The file {file_name} is uploaded to {resource_path} in s3')
 
-        # delete file in local
-        try:
-            logger.debug(f"Deleting file {file_path}")
-            os.remove(file_path)
-            logger.debug(f"Deleting file {file_path}2")
-        except:
-            raise ConflictError(f"The provided digital asset file ({file_name}) cannot be removed")
-        site = settings.SITE
         location = self.s3.get_bucket_location(Bucket=settings.BUCKET_NAME)['LocationConstraint']
         logger.debug(location)
         url = "https://s3-%s.amazonaws.com/%s/%s" % (location, settings.BUCKET_NAME, resource_path)
         logger.debug(url)
         return resource_path, url_fix(url)
 
-    def __save_resource_local(self, provider, file_name, content):
+    def __save_resource_local(self, provider, file_name, stream):
 
         # Create provider dir for assets if it does not exist
         provider_dir = os.path.join(settings.MEDIA_ROOT, "assets", provider)
@@ -145,12 +131,13 @@ class AssetManager:
 
         logger.debug("Paths needed for saving resource file OK")
 
-        # Create file
-        with open(file_path, "wb") as f:
-            f.write(content)
-
+        # Create file, it is removed by the rollback if the upload fails
         self.rollback_logger["files"].append(file_path)
 
+        with open(file_path, "wb") as f:
+            for chunk in stream.chunks():
+                f.write(chunk)
+
         logger.debug("Asset file created")
         site = settings.SITE
         return resource_path, url_fix(urljoin(site, "/charging/" + resource_path))
@@ -185,13 +172,11 @@ class AssetManager:
         if not resource_type:
             return
 
-        plugins = ResourcePlugin.objects.filter(name=resource_type)
-        if not len(plugins):
+        asset_type = PLUGIN_REGISTRY.get_plugin(resource_type)
+        if asset_type is None:
             logger.error(f"The asset type {resource_type} does not exist")
             raise ObjectDoesNotExist(f"The asset type {resource_type} does not exist")
 
-        asset_type = plugins[0]
-
         # Validate content type
         if len(asset_type.media_types) and content_type not in asset_type.media_types:
             logger.error(f"The content type {content_type} is not valid for the specified asset type")
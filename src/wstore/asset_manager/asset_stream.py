@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import base64
+import hashlib
+
+
+class Base64Reader:
+    """
+    File-like object decoding a base64 string as it is read, so the decoded
+    asset is never kept in memory as a whole
+    """
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+        self._pending = ""
+        self._decoded = b""
+
+    def _decode(self, size):
+        # Every 4 encoded characters are decoded to 3 bytes
+        length = (size // 3 + 1) * 4
+
+        encoded = self._pending
+        while len(encoded) < length and self._pos < len(self._data):
+            chunk = self._data[self._pos : self._pos + length - len(encoded)]
+            self._pos += len(chunk)
+            encoded += "".join(chunk.split())
+
+        # Incomplete groups are kept for the next read, unless the data has finished
+        usable = len(encoded)
+        if self._pos < len(self._data):
+            usable -= usable % 4
+
+        self._pending = encoded[usable:]
+        self._decoded += base64.b64decode(encoded[:usable])
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            encoded = self._pending + "".join(self._data[self._pos :].split())
+            data = self._decoded + base64.b64decode(encoded)
+
+            self._pos = len(self._data)
+            self._pending = ""
+            self._decoded = b""
+            return data
+
+        # Exactly size bytes are returned until the end of the data, as
+        # readers like s3transfer take short reads as the end of the file
+        while len(self._decoded) < size and self._pos < len(self._data):
+            self._decode(size - len(self._decoded))
+
+        data = self._decoded[:size]
+        self._decoded = self._decoded[size:]
+        return data
+
+
+class AssetStream:
+    """
+    Wraps the content of an uploaded asset file, computing its size and
+    digest as it is read and enforcing the maximum size allowed
+    """
+
+    def __init__(self, content, chunk_size, max_size=None):
+        self._content = content
+        self._chunk_size = chunk_size
+        self._max_size = max_size
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._content.read(size)
+        self.size += len(data)
+
+        if self._max_size is not None and self.size > self._max_size:
+            raise ValueError(
+                f"The provided digital asset file exceeds the maximum size allowed ({self._max_size} bytes)"
+            )
+
+        self._hash.update(data)
+        return data
+
+    def chunks(self):
+        while True:
+            data = self.read(self._chunk_size)
+            if not data:
+                break
+
+            yield data
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
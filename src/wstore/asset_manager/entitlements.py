@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from logging import getLogger
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from wstore.ordering.models import Offering, Order
+from wstore.store_commons.database import get_database_connection
+
+logger = getLogger("wstore.default_logger")
+
+# Index of the assets each organization can download. Entries are created per
+# order item (contract), so the access is removed when the product is suspended
+# or terminated even if the same offering has been acquired in other orders
+ENTITLEMENT_COLLECTION = "wstore_entitlement"
+
+
+def _get_collection():
+    return get_database_connection()[ENTITLEMENT_COLLECTION]
+
+
+def get_offering_assets(offering_id):
+    """
+    Returns the ids of the assets included in an offering, expanding offering and product bundles
+    """
+    offering = Offering.objects.get(pk=ObjectId(offering_id))
+
+    offering_assets = []
+    if len(offering.bundled_offerings) > 0:
+        for bundled in Offering.objects.filter(pk__in=[ObjectId(off) for off in offering.bundled_offerings]):
+            if bundled.is_digital and bundled.asset is not None:
+                offering_assets.append(bundled.asset)
+
+    elif offering.is_digital and offering.asset is not None:
+        offering_assets.append(offering.asset)
+
+    assets = []
+    for asset in offering_assets:
+        if len(asset.bundled_assets) > 0:
+            assets.extend(ObjectId(bundled_pk) for bundled_pk in asset.bundled_assets)
+        else:
+            assets.append(asset.pk)
+
+    return assets
+
+
+def grant_access(order, contract):
+    """
+    Grants the owner organization of the order access to the assets of the contract offering.
+    Entries of a previous offering of the same contract (upgrades) are removed
+    """
+    source = {"order": order.pk, "item": contract.item_id}
+    assets = get_offering_assets(contract.offering)
+
+    collection = _get_collection()
+    if len(assets) > 0:
+        collection.bulk_write(
+            [
+                UpdateOne(
+                    {**source, "asset": asset},
+                    {"$set": {"organization": order.owner_organization_id, "offering": contract.offering}},
+                    upsert=True,
+                )
+                for asset in assets
+            ],
+            ordered=False,
+        )
+
+    collection.delete_many({**source, "asset": {"$nin": assets}})
+    logger.debug(f"Granted access to {len(assets)} assets of offering {contract.offering}")
+
+
+def revoke_access(order, contract):
+    """
+    Removes the access to the assets granted by the given contract
+    """
+    _get_collection().delete_many({"order": order.pk, "item": contract.item_id})
+    logger.debug(f"Revoked access to the assets of offering {contract.offering}")
+
+
+def has_access(organization_id, asset_id):
+    return _get_collection().find_one({"organization": organization_id, "asset": asset_id}, {"_id": 1}) is not None
+
+
+def build_entitlements():
+    """
+    Creates the entitlements of the active contracts of the existing orders,
+    returning the number of contracts processed
+    """
+    processed = 0
+    for order in Order.objects.all():
+        if order.owner_organization_id is None:
+            continue
+
+        acquired = order.owner_organization.acquired_offerings
+        for contract in order.get_contracts():
+            if contract.terminated or contract.suspended:
+                continue
+
+            if contract.product_id is None and contract.offering not in acquired:
+                continue
+
+            try:
+                grant_access(order, contract)
+                processed += 1
+            except Exception as e:
+                logger.error(f"Error creating the entitlements of order {order.order_id}: {e}")
+
+    return processed
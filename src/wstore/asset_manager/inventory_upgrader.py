@@ -19,10 +19,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import math
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 from logging import getLogger
 from threading import Thread
+from uuid import uuid4
 
-import requests
 from django.conf import settings
 from requests.exceptions import HTTPError
 
@@ -30,18 +33,32 @@ from wstore.admin.users.notification_handler import NotificationsHandler
 from wstore.models import Context, Resource
 from wstore.ordering.inventory_client import InventoryClient
 from wstore.ordering.models import Offering, Order
-from wstore.store_commons.database import DocumentLock
+from wstore.store_commons import http_client
+from wstore.store_commons.database import DocumentLock, get_database_connection
+from wstore.store_commons.utils.concurrency import run_in_worker
 from wstore.store_commons.utils.url import get_service_url
 
 logger = getLogger("wstore.default_logger")
 PAGE_LEN = 100.0
 
+# Progress of the running upgrades, so an interrupted one can be resumed
+CHECKPOINT_COLLECTION = "wstore_upgrade_checkpoint"
+
+
+class UpgradeTakenOver(Exception):
+    pass
+
 
 class InventoryUpgrader(Thread):
     def __init__(self, asset):
         super().__init__()
         self._asset = asset
         self._client = InventoryClient()
+        self._asset_offerings = None
+        self._offering_ids = None
+
+        # Id of the run owning the checkpoint of the upgrade
+        self._owner = uuid4().hex
 
         # Get product name
         try:
@@ -50,7 +67,7 @@ class InventoryUpgrader(Thread):
             )
 
             prod_url = get_service_url("catalog", prod_path)
-            resp = requests.get(prod_url)
+            resp = http_client.get(prod_url)
             resp.raise_for_status()
 
             self._product_name = resp.json()["name"]
@@ -94,137 +111,187 @@ class InventoryUpgrader(Thread):
                 # A failure in the email notification is not relevant
                 pass
 
-    def upgrade_products(self, product_ids, id_filter):
-        def is_digital_char(characteristic):
-            # Return whether a characteristics is defining asset info for the given one
-            def is_product(id_):
-                sp = id_.split(":")
-                return len(sp) == 2 and sp[0] == "product" and sp[1] == self._asset.product_id
+    def _get_asset_offerings(self):
+        # Get all the offerings that include the asset, directly or within a product bundle
+        if self._asset_offerings is None:
+            assets = [self._asset]
+            assets.extend(Resource.objects.filter(bundled_assets=self._asset.pk))
 
-            def is_offering(id_):
-                sp = id_.split(":")
-                offerings = []
+            offerings = []
+            for asset in assets:
+                offerings.extend(Offering.objects.filter(asset=asset))
 
-                if len(sp) == 2 and sp[0] == "offering":
-                    offerings = Offering.objects.filter(off_id=sp[1])
+            self._asset_offerings = offerings
 
-                return len(offerings) == 1 and (
-                    offerings[0].asset == self._asset or self._asset.pk in offerings[0].asset.bundled_assets
-                )
+        return self._asset_offerings
 
-            dig_char = False
-            id_str = ""
+    def _is_digital_char(self, characteristic):
+        # Return whether a characteristics is defining asset info for the given one
+        def is_product(id_):
+            sp = id_.split(":")
+            return len(sp) == 2 and sp[0] == "product" and sp[1] == self._asset.product_id
 
-            name = characteristic["name"].lower()
+        def is_offering(id_):
+            sp = id_.split(":")
+            return len(sp) == 2 and sp[0] == "offering" and sp[1] in self._offering_ids
 
-            if name.endswith("asset type") or name.endswith("media type") or name.endswith("location"):
-                # There are several formats for asset characteristics within the inventory products depending on
-                # the number and the structure of the involved bundles
-                # name: Asset Type  , For single offering with single product
-                # name: offering:123 Asset Type   , For bundle offering with single product
-                # name: product:123 Asset Type    , For single offering with bundle product
-                # name: offering:123 product:345 Asset Type  , For bundle offering with bundle product
+        dig_char = False
+        id_str = ""
 
-                id_str = name.replace("asset type", "").replace("media type", "").replace("location", "")
-                bundle_ids = id_str.split(" ")
+        name = characteristic["name"].lower()
 
-                dig_char = (
-                    len(bundle_ids) == 1
-                    or (len(bundle_ids) == 2 and (is_product(bundle_ids[0]) or is_offering(bundle_ids[0])))
-                    or (len(bundle_ids) == 3 and is_offering(bundle_ids[0]) and is_product(bundle_ids[1]))
-                )
+        if name.endswith("asset type") or name.endswith("media type") or name.endswith("location"):
+            # There are several formats for asset characteristics within the inventory products depending on
+            # the number and the structure of the involved bundles
+            # name: Asset Type  , For single offering with single product
+            # name: offering:123 Asset Type   , For bundle offering with single product
+            # name: product:123 Asset Type    , For single offering with bundle product
+            # name: offering:123 product:345 Asset Type  , For bundle offering with bundle product
 
-            return dig_char, id_str
+            id_str = name.replace("asset type", "").replace("media type", "").replace("location", "")
+            bundle_ids = id_str.split(" ")
 
-        n_pages = int(math.ceil(len(product_ids) / PAGE_LEN))
+            dig_char = (
+                len(bundle_ids) == 1
+                or (len(bundle_ids) == 2 and (is_product(bundle_ids[0]) or is_offering(bundle_ids[0])))
+                or (len(bundle_ids) == 3 and is_offering(bundle_ids[0]) and is_product(bundle_ids[1]))
+            )
 
-        missing_upgrades = []
-        for page in range(0, n_pages):
-            # Get the ids related to the current product page
-            offset = page * int(PAGE_LEN)
+        return dig_char, id_str
 
-            page_ids = [str(id_filter(p_id)) for p_id in product_ids[offset : offset + int(PAGE_LEN)]]
-            ids = ",".join(page_ids)
+    def _upgrade_product(self, product):
+        # Patch product to include new asset information, returns the product id if failed
+        pre_ids = ""
+        product_id = str(product["id"])
 
-            # Get product characteristics field
-            try:
-                products = self._client.get_products(query={"id": ids, "fields": "id,productCharacteristic"})
-            except HTTPError:
-                missing_upgrades.extend(page_ids)
-                continue
-
-            # Patch product to include new asset information
-            for product in products:
-                pre_ids = ""
-                product_id = str(product["id"])
-
-                new_characteristics = []
-                for char in product["productCharacteristic"]:
-                    is_dig, ids_str = is_digital_char(char)
-                    if not is_dig:
-                        new_characteristics.append(char)
-                    else:
-                        pre_ids = ids_str
-
-                new_characteristics.append(
-                    {
-                        "name": "{}Media Type".format(pre_ids),
-                        "value": self._asset.content_type,
-                    }
-                )
+        new_characteristics = []
+        for char in product["productCharacteristic"]:
+            is_dig, ids_str = self._is_digital_char(char)
+            if not is_dig:
+                new_characteristics.append(char)
+            else:
+                pre_ids = ids_str
 
-                new_characteristics.append(
-                    {
-                        "name": "{}Asset Type".format(pre_ids),
-                        "value": self._asset.resource_type,
-                    }
-                )
+        new_characteristics.append(
+            {
+                "name": "{}Media Type".format(pre_ids),
+                "value": self._asset.content_type,
+            }
+        )
 
-                new_characteristics.append(
-                    {
-                        "name": "{}Location".format(pre_ids),
-                        "value": self._asset.download_link,
-                    }
-                )
+        new_characteristics.append(
+            {
+                "name": "{}Asset Type".format(pre_ids),
+                "value": self._asset.resource_type,
+            }
+        )
+
+        new_characteristics.append(
+            {
+                "name": "{}Location".format(pre_ids),
+                "value": self._asset.download_link,
+            }
+        )
+
+        try:
+            # The inventory API returns the product after patching
+            patched_product = self._client.patch_product(product_id, {"productCharacteristic": new_characteristics})
+        except HTTPError:
+            return product_id
+
+        self._notify_user(patched_product)
+        return None
 
+    def upgrade_products(self, product_ids, id_filter, start=0, on_page=None):
+        """
+        Upgrades the given inventory products starting at the given offset. After
+        each page on_page is called with the offset of the next page and the ids of
+        the products of the page that could not be upgraded
+        """
+        if self._offering_ids is None:
+            # Offering ids are included lowercased in the characteristic names
+            self._offering_ids = {offering.off_id.lower() for offering in self._get_asset_offerings()}
+
+        n_pages = int(math.ceil(len(product_ids) / PAGE_LEN))
+        workers = getattr(settings, "INVENTORY_UPGRADER", {}).get("workers", 8)
+
+        missing_upgrades = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for page in range(int(start // PAGE_LEN), n_pages):
+                # Get the ids related to the current product page
+                offset = page * int(PAGE_LEN)
+
+                page_ids = [str(id_filter(p_id)) for p_id in product_ids[offset : offset + int(PAGE_LEN)]]
+                ids = ",".join(page_ids)
+
+                # Get product characteristics field
                 try:
-                    # The inventory API returns the product after patching
-                    patched_product = self._client.patch_product(
-                        product_id, {"productCharacteristic": new_characteristics}
-                    )
+                    products = self._client.get_products(query={"id": ids, "fields": "id,productCharacteristic"})
                 except HTTPError:
-                    missing_upgrades.append(product_id)
-                    continue
+                    page_missing = page_ids
+                else:
+                    # Products are patched concurrently, the page is completed before the next one is read
+                    upgrade = partial(run_in_worker, self._upgrade_product)
+                    page_missing = [p_id for p_id in executor.map(upgrade, products) if p_id is not None]
 
-                self._notify_user(patched_product)
+                missing_upgrades.extend(page_missing)
+
+                if on_page is not None:
+                    on_page(offset + int(PAGE_LEN), page_missing)
 
         return missing_upgrades
 
-    def upgrade_asset_products(self, offering_ids):
+    def _checkpoint_page(self, checkpoint, off_id, next_offset, page_missing):
+        # Saves the progress of the upgrade once a page of products is processed
+        checkpoint["pending_products"].extend(page_missing)
+        checkpoint["offering"] = off_id
+        checkpoint["offset"] = next_offset
+        self._save_checkpoint(checkpoint)
+
+    def upgrade_asset_products(self, offering_ids, checkpoint=None):
+        """
+        Upgrades the products of the given offerings. If a checkpoint is provided, the offerings
+        and pages already processed are skipped and the progress is saved as the upgrade goes on
+        """
         # Get all the product ids related to the given product offering
         missing_off = []
         missing_products = []
+
+        if checkpoint is not None:
+            missing_off = checkpoint["pending_offerings"]
+            missing_products = checkpoint["pending_products"]
+
         for off_id in offering_ids:
+            offset = 0
+            if checkpoint is not None:
+                if off_id in checkpoint["completed"]:
+                    continue
+
+                if checkpoint["offering"] == off_id:
+                    offset = checkpoint["offset"]
+
+            on_page = partial(self._checkpoint_page, checkpoint, off_id) if checkpoint is not None else None
+
             try:
                 product_ids = self._client.get_products(query={"productOffering.id": off_id, "fields": "id"})
             except HTTPError:
                 # Failure reading the available product ids, all upgrades pending
                 missing_off.append(off_id)
-                continue
+            else:
+                partial_prods = self.upgrade_products(product_ids, lambda p_id: p_id["id"], offset, on_page)
+                if checkpoint is None:
+                    missing_products.extend(partial_prods)
 
-            missing_products.extend(self.upgrade_products(product_ids, lambda p_id: p_id["id"]))
+            if checkpoint is not None:
+                checkpoint["completed"].append(off_id)
+                checkpoint["offering"] = None
+                checkpoint["offset"] = 0
+                self._save_checkpoint(checkpoint)
 
         return missing_off, missing_products
 
     def _get_providing_offerings(self):
-        # Get product bundles that contain the included asset
-        assets = [self._asset]
-        assets.extend(Resource.objects.filter(bundled_assets=self._asset.pk))
-
-        # Get all the offerings that include the asset or one of the bundles
-        offerings = []
-        for asset in assets:
-            offerings.extend(Offering.objects.filter(asset=asset))
+        offerings = list(self._get_asset_offerings())
 
         # Get all the offering bundles which include the previous offerings
         bundles = []
@@ -234,12 +301,58 @@ class InventoryUpgrader(Thread):
         offerings.extend(bundles)
         return offerings
 
+    def _load_checkpoint(self):
+        checkpoint = get_database_connection()[CHECKPOINT_COLLECTION].find_one({"_id": self._asset.pk})
+
+        # A checkpoint of a previous version of the asset is outdated, the upgrade starts again
+        if checkpoint is None or checkpoint.get("version") != self._asset.version:
+            checkpoint = {
+                "_id": self._asset.pk,
+                "version": self._asset.version,
+                "completed": [],
+                "offering": None,
+                "offset": 0,
+                "pending_offerings": [],
+                "pending_products": [],
+            }
+        else:
+            logger.info(f"Resuming the upgrade of the inventory products of asset {self._asset.pk}")
+
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint):
+        checkpoint["updated_at"] = datetime.utcnow()
+        result = get_database_connection()[CHECKPOINT_COLLECTION].replace_one(
+            {"_id": checkpoint["_id"], "owner": self._owner}, checkpoint
+        )
+
+        # The upgrade has been resumed by another run, which continues it from here
+        if result.matched_count == 0:
+            raise UpgradeTakenOver(f"The upgrade of asset {checkpoint['_id']} has been resumed by another run")
+
     def run(self):
+        checkpoint = self._load_checkpoint()
+
+        # Take the ownership of the upgrade
+        checkpoint["owner"] = self._owner
+        checkpoint["updated_at"] = datetime.utcnow()
+        get_database_connection()[CHECKPOINT_COLLECTION].replace_one(
+            {"_id": checkpoint["_id"]}, checkpoint, upsert=True
+        )
+
         # Get all the offerings that give access to the provided digital asset
         offerings = self._get_providing_offerings()
 
         # Upgrade all the products related to the provided asset
-        missing_off, missing_products = self.upgrade_asset_products([offering.off_id for offering in offerings])
+        try:
+            missing_off, missing_products = self.upgrade_asset_products(
+                [offering.off_id for offering in offerings], checkpoint
+            )
+        except UpgradeTakenOver as e:
+            logger.info(str(e))
+            return
 
         if len(missing_off) > 0 or len(missing_products) > 0:
             self._save_failed(missing_off, missing_products)
+
+        get_database_connection()[CHECKPOINT_COLLECTION].delete_one({"_id": self._asset.pk, "owner": self._owner})
@@ -20,8 +20,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from decimal import Decimal
+from functools import partial
 
-import requests
 
 from django.conf import settings
 
@@ -29,6 +29,9 @@ from wstore.asset_manager.catalog_validator import CatalogValidator
 from wstore.asset_manager.models import Resource
 from wstore.asset_manager.resource_plugins.decorators import on_product_offering_validation
 from wstore.ordering.models import Offering
+from wstore.store_commons import http_client
+from wstore.store_commons.utils.cache import LRUCache
+from wstore.store_commons.utils.concurrency import fetch_all, get_deadline
 from wstore.store_commons.utils.units import ChargePeriod, CurrencyCode
 from wstore.store_commons.utils.url import get_service_url
 
@@ -36,6 +39,12 @@ from logging import getLogger
 
 
 logger = getLogger("wstore.default_logger")
+
+# Price components already validated, keyed by their id and lastUpdate and the ones of
+# the product spec. The values are the characteristic ranges used by the component
+VALIDATION_CACHE = LRUCache(getattr(settings, "OFFERING_VALIDATION_CACHE", {}).get("max_entries", 5000))
+
+
 class OfferingValidator(CatalogValidator):
     def _get_bundled_offerings(self, product_offering):
         bundled_offerings = []
@@ -76,7 +85,7 @@ class OfferingValidator(CatalogValidator):
     def _get_product_spec(self, id_):
         if self._product_spec is None:
             url = get_service_url("catalog", "/productSpecification/{}".format(id_))
-            resp = requests.get(url)
+            resp = http_client.get(url)
 
             if resp.status_code != 200:
                 raise ValueError("Invalid product reference")
@@ -84,15 +93,42 @@ class OfferingValidator(CatalogValidator):
 
         return self._product_spec
 
-    def _get_price(self, id_):
+    def _download_price(self, id_):
         url = get_service_url("catalog", "/productOfferingPrice/{}".format(id_))
-        resp = requests.get(url)
+        resp = http_client.get(url)
 
         if resp.status_code != 200:
             raise ValueError("Invalid pricing reference")
 
         return resp.json()
 
+    def _fetch_price(self, id_):
+        # Errors are kept so they are raised when the price is used, in validation order
+        try:
+            return self._download_price(id_), None
+        except ValueError as e:
+            return None, e
+
+    def _prefetch_prices(self, ids):
+        # Download concurrently the given productOfferingPrices not already downloaded
+        pending = []
+        for id_ in ids:
+            if id_ not in self._prices and id_ not in pending:
+                pending.append(id_)
+
+        results = fetch_all([partial(self._fetch_price, id_) for id_ in pending], get_deadline())
+        self._prices.update(zip(pending, results))
+
+    def _get_price(self, id_):
+        if id_ not in self._prices:
+            self._prices[id_] = self._fetch_price(id_)
+
+        price, error = self._prices[id_]
+        if error is not None:
+            raise error
+
+        return price
+
     def _validate_value_price(self, price):
         if "unit" not in price:
             raise ValueError("Missing currency code in price")
@@ -196,9 +232,43 @@ class OfferingValidator(CatalogValidator):
         self._validate_value_price(price_component["price"])
         self._validate_char_value_use(price_component, product_spec, anti_collision_record=anti_collision)
 
+    def _validate_cached_component(self, price_component, product_spec, anti_collision=None, has_profile=False):
+        # The validation only depends on the component and the product spec, so it
+        # is not repeated while none of them has been updated
+        key = None
+        if (
+            price_component.get("id") is not None
+            and price_component.get("lastUpdate") is not None
+            and product_spec.get("lastUpdate") is not None
+        ):
+            key = (
+                price_component["id"],
+                price_component["lastUpdate"],
+                product_spec.get("id"),
+                product_spec["lastUpdate"],
+                has_profile,
+            )
+
+        ranges = VALIDATION_CACHE.get(key) if key is not None else None
+        if ranges is None:
+            ranges = {}
+            self._validate_price_component(price_component, product_spec, ranges, has_profile)
+
+            if key is not None:
+                VALIDATION_CACHE.set(key, ranges)
+
+        if anti_collision is not None:
+            for char_id, char_ranges in ranges.items():
+                char_record = anti_collision.setdefault(char_id, {"total_range": char_ranges["total_range"]})
+
+                for range_key, range_ends in char_ranges.items():
+                    if range_key != "total_range":
+                        char_record.setdefault(range_key, []).extend(range_ends)
+
     @on_product_offering_validation
     def _validate_offering_pricing(self, provider, product_offering, bundled_offerings):
         self._product_spec = None
+        self._prices = {}
 
         is_open = False
         is_custom = False
@@ -208,6 +278,17 @@ class OfferingValidator(CatalogValidator):
             names = []
             customs = 0
 
+            # Download the price plans and then all the price components of the bundled ones
+            self._prefetch_prices([price["id"] for price in product_offering["productOfferingPrice"]])
+            self._prefetch_prices(
+                [
+                    price_comp["id"]
+                    for price_model, error in self._prices.values()
+                    if error is None and price_model.get("isBundle") and "bundledPopRelationship" in price_model
+                    for price_comp in price_model["bundledPopRelationship"]
+                ]
+            )
+
             # Check if the pricing is included or if it is needed to download it
             for price in product_offering["productOfferingPrice"]:
                 price_model = self._get_price(price["id"])
@@ -251,14 +332,14 @@ class OfferingValidator(CatalogValidator):
                     self._validate_char_value_use(price_model, product_spec)
 
                     # The price plan has the price components linked
-                    [self._validate_price_component(self._get_price(price_comp["id"]), product_spec, anti_collision, has_profile)
+                    [self._validate_cached_component(self._get_price(price_comp["id"]), product_spec, anti_collision, has_profile)
                         for price_comp in price_model["bundledPopRelationship"]]
                     if len(anti_collision) != 0:
                         self._check_range_collision(anti_collision)
 
                 else:
                     # The price plan has 1 single price component attached
-                    self._validate_price_component(price_model, product_spec)
+                    self._validate_cached_component(price_model, product_spec)
 
             if is_open and len(names) > 1:
                 raise ValueError("Open offerings cannot include price plans")
@@ -268,38 +349,54 @@ class OfferingValidator(CatalogValidator):
 
         return is_open, is_custom
 
-    def _recursive_anti_collision(self, value_search, value_end, record):
-        value_nexts = record.get(f"from-{value_search}", None)
-        if value_nexts is None or len(value_nexts) == 0:
-            return False
+    def _is_continuous_range(self, value_init, value_end, record):
+        """
+        Returns whether the subranges of the record (lists of range ends keyed by
+        "from-<range start>") chain from value_init to value_end, each subrange
+        starting right after the end of the previous one
+        """
+        ranges = sorted(
+            (Decimal(key[len("from-") :]), Decimal(str(range_end)))
+            for key, range_ends in record.items()
+            for range_end in range_ends
+        )
 
-        for value_next in value_nexts:
-            if value_next == value_end:
-                return True
-            else:
-                reached = self._recursive_anti_collision(value_next + 1, value_end, record)
-                if reached:
-                    return reached
+        # Subranges are swept by their start, so the ones that may precede a
+        # subrange (ending right before its start) have already been reached
+        reached = {Decimal(str(value_init)) - 1}
+        value_end = Decimal(str(value_end))
 
-        return False
+        for range_start, range_end in ranges:
+            if range_start - 1 in reached:
+                if range_end == value_end:
+                    return True
 
+                reached.add(range_end)
 
+        return False
 
     def _check_range_collision(self, anti_collision: dict):
+        non_continuous = []
         for k, char_range_record in anti_collision.items():
             total_range = char_range_record.pop("total_range")
             value_init = total_range["valueFrom"]
             value_end = total_range["valueTo"]
-            continous = self._recursive_anti_collision(value_init, value_end, char_range_record)
-            if not continous:
-                logger.error(f"Offering price linked to Characteristic with key: {k} doesn't have continous subranges")
-                raise ValueError(f"Offering price linked to Characteristic with key: {k} doesn't have continous subranges")
 
+            if not self._is_continuous_range(value_init, value_end, char_range_record):
+                non_continuous.append(k)
+
+        if len(non_continuous) > 0:
+            # All the invalid characteristics are reported at once
+            msg = "Offering price linked to Characteristic with key: {} doesn't have continous subranges".format(
+                ", ".join(non_continuous)
+            )
+            logger.error(msg)
+            raise ValueError(msg)
 
         return None
 
     def _download(self, url):
-        r = requests.get(url)
+        r = http_client.get(url)
 
         if r.status_code != 200:
             raise ValueError("There has been a problem accessing the product spec included in the offering")
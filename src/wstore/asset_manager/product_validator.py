@@ -26,12 +26,13 @@ from django.core.exceptions import PermissionDenied
 from wstore.asset_manager.catalog_validator import CatalogValidator
 from wstore.asset_manager.errors import ProductError
 from wstore.asset_manager.inventory_upgrader import InventoryUpgrader
-from wstore.asset_manager.models import Resource, ResourcePlugin
+from wstore.asset_manager.models import Resource
 from wstore.asset_manager.resource_plugins.decorators import (
     on_product_spec_attachment,
     on_product_spec_upgrade,
     on_product_spec_validation,
 )
+from wstore.asset_manager.resource_plugins.plugin_registry import PLUGIN_REGISTRY
 from wstore.store_commons.database import DocumentLock
 from wstore.store_commons.errors import ConflictError
 from wstore.store_commons.rollback import downgrade_asset, downgrade_asset_pa, rollback
@@ -42,7 +43,9 @@ from wstore.store_commons.utils.version import is_lower_version, is_valid_versio
 class ProductValidator(CatalogValidator):
     def _get_asset_resouces(self, asset_t, url):
         # Search the asset type
-        asset_type = ResourcePlugin.objects.get(name=asset_t)
+        asset_type = PLUGIN_REGISTRY.get_plugin(asset_t)
+        if asset_type is None:
+            raise ProductError("The given product specification contains a not supported asset type: " + asset_t)
 
         # Validate location format
         if not is_valid_url(url):
@@ -25,36 +25,22 @@ from logging import getLogger
 from bson.objectid import ObjectId
 
 from wstore.asset_manager.errors import ProductError
+from wstore.asset_manager.entitlements import grant_access, revoke_access
 from wstore.asset_manager.models import Resource
-from wstore.models import ResourcePlugin
+from wstore.asset_manager.resource_plugins.plugin_registry import PLUGIN_REGISTRY
 from wstore.ordering.models import Offering
 
 logger = getLogger("wstore.default_logger")
 
 
-def _get_plugin_model(name):
-    try:
-        plugin_model = ResourcePlugin.objects.get(name=name)
-    except:
-        # Validate resource type
-        raise ProductError("The given product specification contains a not supported asset type: " + name)
-
-    return plugin_model
-
-
 def load_plugin_module(asset_t):
-    plugin_model = _get_plugin_model(asset_t)
-    module = plugin_model.module
-    module_class_name = module.split(".")[-1]
-    module_package = module.partition("." + module_class_name)[0]
+    plugin_module = PLUGIN_REGISTRY.get_module(asset_t)
 
-    module_class = getattr(
-        __import__(module_package, globals(), locals(), [module_class_name], 0),
-        module_class_name,
-    )
+    if plugin_module is None:
+        # Validate resource type
+        raise ProductError("The given product specification contains a not supported asset type: " + asset_t)
 
-    logger.debug(f"Loaded plugin module for {asset_t}")
-    return module_class(plugin_model)
+    return plugin_module
 
 
 def on_product_spec_validation(func):
@@ -150,6 +136,7 @@ def on_product_offering_validation(func):
         is_open = func(self, provider, product_offering, bundled_offerings)
 
         for asset in assets:
+            plugin_module = load_plugin_module(asset.resource_type)
             plugin_module.on_post_product_offering_validation(asset, product_offering)
 
         return is_open
@@ -193,10 +180,15 @@ def process_product_notification(order, contract, type_):
 
 
 def on_product_acquired(order, contract):
+    # Manual procurements provide the raw order, the access is granted when the product is activated
+    if not isinstance(order, dict):
+        grant_access(order, contract)
+
     process_product_notification(order, contract, "activate")
 
 
 def on_product_suspended(order, contract):
+    revoke_access(order, contract)
     process_product_notification(order, contract, "suspend")
 
 
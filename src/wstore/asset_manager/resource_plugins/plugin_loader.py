@@ -28,6 +28,7 @@ from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from wstore.asset_manager.resource_plugins.plugin import Plugin
 from wstore.asset_manager.resource_plugins.plugin_error import PluginError
+from wstore.asset_manager.resource_plugins.plugin_registry import get_plugin_class, notify_plugins_changed
 from wstore.asset_manager.resource_plugins.plugin_rollback import installPluginRollback
 from wstore.asset_manager.resource_plugins.plugin_validator import PluginValidator
 from wstore.models import Resource, ResourcePlugin
@@ -51,14 +52,8 @@ class PluginLoader:
         logger.debug(f"Plugins path: {self._plugins_path}")
 
     def _get_plugin_module(self, module):
-        module_class_name = module.split(".")[-1]
-        module_package = module.partition("." + module_class_name)[0]
-
-        logger.debug(f"Plugin module: {module_package}.{module_class_name}")
-        return getattr(
-            __import__(module_package, globals(), locals(), [module_class_name], 0),
-            module_class_name,
-        )
+        logger.debug(f"Plugin module: {module}")
+        return get_plugin_class(module)
 
     def _update_model_data_from_json(self, model, module, json_info):
         # Create or update plugin model data
@@ -163,6 +158,7 @@ class PluginLoader:
         if plugin_model.pull_accounting:
             module_class(plugin_model).configure_usage_spec()
 
+        notify_plugins_changed()
         logger.info(f"Plugin {plugin_id} installed.")
 
         return plugin_id
@@ -218,6 +214,7 @@ class PluginLoader:
         while plugin_model.version != version:
             self._downgrade_plugin_to_last_version(plugin_id, plugin_model)
 
+        notify_plugins_changed()
         logger.info(f"Plugin {plugin_id} successfully downgraded")
 
     def uninstall_plugin(self, plugin_id):
@@ -253,4 +250,5 @@ class PluginLoader:
 
         # Remove model
         plugin_model.delete()
+        notify_plugins_changed()
         logger.info(f"Plugin {plugin_id} successfully uninstalled")
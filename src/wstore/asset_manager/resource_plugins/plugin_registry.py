@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+import time
+from logging import getLogger
+
+from django.conf import settings
+
+from wstore.models import ResourcePlugin
+from wstore.store_commons.database import get_database_connection
+
+logger = getLogger("wstore.default_logger")
+
+# The version stamp of the installed plugins is stored in this collection, so
+# the registries of all the processes are reloaded when a plugin changes
+REGISTRY_COLLECTION = "wstore_plugin_registry"
+REGISTRY_STAMP = "resource_plugins"
+
+
+def get_plugin_class(module):
+    module_class_name = module.split(".")[-1]
+    module_package = module.partition("." + module_class_name)[0]
+
+    return getattr(
+        __import__(module_package, globals(), locals(), [module_class_name], 0),
+        module_class_name,
+    )
+
+
+def notify_plugins_changed():
+    """
+    Increments the version stamp of the installed plugins, so every process
+    reloads its registry
+    """
+    get_database_connection()[REGISTRY_COLLECTION].update_one(
+        {"_id": REGISTRY_STAMP}, {"$inc": {"version": 1}}, upsert=True
+    )
+    PLUGIN_REGISTRY.invalidate()
+
+
+class PluginRegistry:
+    """
+    In-memory copy of the installed resource plugins, including the instances
+    of their modules, which are imported only once per process
+    """
+
+    def __init__(self):
+        # Tuple of (plugin models by name, plugin module instances by name)
+        self._state = None
+        self._version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._state = None
+
+    def _get_version(self):
+        stamp = get_database_connection()[REGISTRY_COLLECTION].find_one({"_id": REGISTRY_STAMP})
+        return stamp["version"] if stamp is not None else 0
+
+    def _get_state(self):
+        check_interval = getattr(settings, "PLUGIN_REGISTRY", {}).get("check_interval", 10)
+
+        state = self._state
+        if state is not None and time.monotonic() - self._checked < check_interval:
+            return state
+
+        with self._lock:
+            if self._state is not None and time.monotonic() - self._checked < check_interval:
+                return self._state
+
+            version = self._get_version()
+            if self._state is None or version != self._version:
+                self._state = ({plugin.name: plugin for plugin in ResourcePlugin.objects.all()}, {})
+                self._version = version
+
+                logger.debug(f"Loaded resource plugin registry version {version}")
+
+            self._checked = time.monotonic()
+            return self._state
+
+    def get_plugin(self, name):
+        """
+        Returns the plugin model of the given asset type, or None if it is not installed
+        """
+        return self._get_state()[0].get(name)
+
+    def get_module(self, name):
+        """
+        Returns the plugin module instance of the given asset type, or None if it is not installed
+        """
+        plugins, modules = self._get_state()
+
+        module = modules.get(name)
+        if module is None and name in plugins:
+            plugin_model = plugins[name]
+            module = get_plugin_class(plugin_model.module)(plugin_model)
+            modules[name] = module
+
+            logger.debug(f"Loaded plugin module for {name}")
+
+        return module
+
+
+PLUGIN_REGISTRY = PluginRegistry()
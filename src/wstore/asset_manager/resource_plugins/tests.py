@@ -30,7 +30,8 @@ from django.test import TestCase
 from mock import MagicMock, call
 from parameterized import parameterized
 from requests.exceptions import HTTPError
-from wstore.asset_manager.resource_plugins import decorators, plugin, plugin_loader
+from django.test.utils import override_settings
+from wstore.asset_manager.resource_plugins import decorators, plugin, plugin_loader, plugin_registry
 from wstore.asset_manager.resource_plugins.plugin_error import PluginError
 from wstore.asset_manager.resource_plugins.plugin_validator import PluginValidator
 from wstore.asset_manager.resource_plugins.test_data import *
@@ -58,6 +59,7 @@ class PluginLoaderTestCase(TestCase):
         self.manager_mock.validate_pull_accounting.return_value = None
 
         plugin_loader.PluginValidator.return_value = self.manager_mock
+        plugin_loader.notify_plugins_changed = MagicMock()
 
     def _clean_plugin_dir(self):
         plugin_dir = os.path.join("wstore", "test")
@@ -426,6 +428,7 @@ class PluginLoaderTestCase(TestCase):
             plugin_loader.Resource.objects.filter.assert_called_once_with(resource_type=plugin_name)
             plugin_loader.rmtree.assert_called_once_with(os.path.join(plugin_l._plugins_path, "test_plugin"))
             plugin_mock.delete.assert_called_once_with()
+            plugin_loader.notify_plugins_changed.assert_called_once_with()
 
             self.assertEquals(pull, plugin_mock.usage_called)
         else:
@@ -882,6 +885,75 @@ class PluginTestCase(TestCase):
         self.assertEquals(0, plugin_handler.get_pending_accounting.call_count)
 
 
+@override_settings(PLUGIN_REGISTRY={"check_interval": 0})
+class PluginRegistryTestCase(TestCase):
+    tags = ("plugin",)
+
+    def setUp(self):
+        self._plugin_model = MagicMock(module="wstore.asset_manager.resource_plugins.tests.TestPlugin")
+        self._plugin_model.name = "Test Plugin"
+
+        plugin_registry.ResourcePlugin = MagicMock()
+        plugin_registry.ResourcePlugin.objects.all.return_value = [self._plugin_model]
+
+        self._stamps = MagicMock()
+        self._stamps.find_one.return_value = {"_id": "resource_plugins", "version": 1}
+        plugin_registry.get_database_connection = MagicMock(return_value={"wstore_plugin_registry": self._stamps})
+
+        self._registry = plugin_registry.PluginRegistry()
+
+    def tearDown(self):
+        reload(plugin_registry)
+
+    def test_get_module(self):
+        module = self._registry.get_module("Test Plugin")
+
+        self.assertEquals("TestPlugin", type(module).__name__)
+        self.assertEquals(self._plugin_model, module._plugin_model)
+
+        # The module is imported and instantiated once
+        self.assertTrue(module is self._registry.get_module("Test Plugin"))
+        self.assertEquals(self._plugin_model, self._registry.get_plugin("Test Plugin"))
+        plugin_registry.ResourcePlugin.objects.all.assert_called_once_with()
+
+    def test_not_installed(self):
+        self.assertIsNone(self._registry.get_module("Other Plugin"))
+        self.assertIsNone(self._registry.get_plugin("Other Plugin"))
+
+    def test_version_changed(self):
+        module = self._registry.get_module("Test Plugin")
+        self.assertIsNotNone(module)
+
+        # The cached module is dropped once the plugins are changed
+        self._stamps.find_one.return_value = {"_id": "resource_plugins", "version": 2}
+        plugin_registry.ResourcePlugin.objects.all.return_value = []
+
+        self.assertIsNone(self._registry.get_module("Test Plugin"))
+        self.assertEquals(2, plugin_registry.ResourcePlugin.objects.all.call_count)
+
+    @override_settings(PLUGIN_REGISTRY={"check_interval": 60})
+    def test_version_check_interval(self):
+        self._registry.get_module("Test Plugin")
+        self._registry.get_module("Test Plugin")
+        self._registry.get_plugin("Test Plugin")
+
+        self._stamps.find_one.assert_called_once_with({"_id": "resource_plugins"})
+
+    def test_notify_plugins_changed(self):
+        plugin_registry.PLUGIN_REGISTRY = self._registry
+        self._registry.get_module("Test Plugin")
+
+        plugin_registry.notify_plugins_changed()
+
+        self._stamps.update_one.assert_called_once_with(
+            {"_id": "resource_plugins"}, {"$inc": {"version": 1}}, upsert=True
+        )
+
+        # The registry of the process is reloaded without waiting for the check interval
+        self._registry.get_module("Test Plugin")
+        self.assertEquals(2, plugin_registry.ResourcePlugin.objects.all.call_count)
+
+
 class DecoratorsTestCase(TestCase):
     tags = ("decorators",)
 
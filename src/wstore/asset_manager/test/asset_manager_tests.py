@@ -20,17 +20,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import base64
+import hashlib
+import os
 from copy import deepcopy
 from importlib import reload
 from urllib.parse import quote
 
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.stub import Stubber
 from django.core.exceptions import ObjectDoesNotExist
 from django.test import TestCase
 from django.test.utils import override_settings
 from mock import MagicMock, mock_open
 from parameterized import parameterized
 
-from wstore.asset_manager import asset_manager, models
+from wstore.asset_manager import asset_manager, asset_stream, models
 from wstore.asset_manager.test.resource_test_data import *
 from wstore.store_commons.errors import ConflictError
 from wstore.store_commons.utils.testing import decorator_mock
@@ -189,6 +195,8 @@ class UploadAssetTestCase(TestCase):
         self._old_remove = asset_manager.os.remove
         asset_manager.os.remove = MagicMock()
 
+        self._old_makedirs = asset_manager.os.makedirs
+
         self._old_exists = asset_manager.os.path.exists
         asset_manager.os.path.exists = MagicMock()
         asset_manager.os.path.exists.return_value = False
@@ -201,6 +209,7 @@ class UploadAssetTestCase(TestCase):
         asset_manager.os.path.isdir = self._old_is_dir
         asset_manager.os.path.exists = self._old_exists
         asset_manager.os.remove= self._old_remove
+        asset_manager.os.makedirs = self._old_makedirs
         import wstore.store_commons.rollback
 
         reload(wstore.store_commons.rollback)
@@ -213,7 +222,7 @@ class UploadAssetTestCase(TestCase):
         # Mock file
         self._file = MagicMock(name="example.wgt")
         self._file.name = "example.wgt"
-        self._file.read.return_value = "Test data content".encode()
+        self._file.read.side_effect = ["Test data content".encode(), b""]
         asset_manager.os.path.isdir.return_value = False
         # asset_manager.os.mkdir = MagicMock()
         asset_manager.os.makedirs = MagicMock()
@@ -226,18 +235,22 @@ class UploadAssetTestCase(TestCase):
         asset_manager.os.path.exists.return_value = True
         self.res_mock.product_id = "1"
 
-    def _check_file_calls(self, file_name="example.wgt", aws= False):
-        final_dir = "test_user" if not aws else "temp"
-        asset_manager.os.path.isdir.assert_called_once_with("/home/test/media/assets/{}".format(final_dir))
-        asset_manager.os.path.exists.assert_called_once_with("/home/test/media/assets/{}/{}".format(final_dir, file_name))
-        self.open_mock.assert_called_once_with("/home/test/media/assets/{}/{}".format(final_dir, file_name), "wb")
+    def _check_file_calls(self, file_name="example.wgt"):
+        asset_manager.os.path.isdir.assert_called_once_with("/home/test/media/assets/test_user")
+        asset_manager.os.path.exists.assert_called_once_with("/home/test/media/assets/test_user/{}".format(file_name))
+        self.open_mock.assert_called_once_with("/home/test/media/assets/test_user/{}".format(file_name), "wb")
         self.open_mock().write.assert_called_once_with("Test data content".encode())
 
     def _aws_mocks(self, side_effect, err):
+        asset_manager.boto3 = MagicMock()
+        asset_manager.boto3.client.return_value.get_bucket_location.return_value = {"LocationConstraint": "eu-west-1"}
+
         if side_effect is not None:
-            asset_manager.boto3.client.return_value.upload_file.side_effect =  Exception({'Error': {'Code': side_effect, 'Message': err}}, 'upload_file')
+            asset_manager.boto3.client.return_value.upload_fileobj.side_effect = Exception(
+                {'Error': {'Code': side_effect, 'Message': err}}, 'upload_fileobj'
+            )
         else:
-            asset_manager.boto3.client.return_value.upload_file.return_value = None
+            asset_manager.boto3.client.return_value.upload_fileobj.return_value = None
 
     @parameterized.expand(
         [
@@ -378,8 +391,13 @@ class UploadAssetTestCase(TestCase):
             self.assertTrue(isinstance(error, err_type))
             self.assertEquals(err_msg, str(error))
     
-    @parameterized.expand([("basic", UPLOAD_CONTENT_AWS, True), ("basic", UPLOAD_CONTENT_AWS, True, "AccessDenied", "Access Denied") ])
-    @override_settings(MEDIA_ROOT="/home/test/media")
+    @parameterized.expand(
+        [
+            ("basic", UPLOAD_CONTENT_AWS, True),
+            ("basic", UPLOAD_CONTENT_AWS, True, "AccessDenied", "Access Denied"),
+        ]
+    )
+    @override_settings(MEDIA_ROOT="/home/test/media", MEDIA_DIR="media/", BUCKET_NAME="bucket", ACL_ENABLED=False)
     def test_upload_asset_aws(
         self,
         name,
@@ -390,9 +408,9 @@ class UploadAssetTestCase(TestCase):
         file_name="example.wgt",
     ):
         asset_manager.settings.AWS_ENABLED= awsEnabled
+        self._aws_mocks(side_effect, err_msg)
         am = asset_manager.AssetManager()
         am.rollback_logger = {"files": [], "models": []}
-        self._aws_mocks(side_effect, err_msg)
         error = None
         try:
             resource = am.upload_asset(self._user, data, file_=self._file)
@@ -403,27 +421,42 @@ class UploadAssetTestCase(TestCase):
             # Check calls
             self.assertEquals("http://locationurl.com/", resource.get_url())
             self.assertEqual("http://uri.com/", resource.get_uri())
-            self._check_file_calls(file_name, True)
-            # Check rollback logger
-            self.assertEquals(["/home/test/media/assets/temp/{}".format(file_name)],
-                am.rollback_logger["files"])
-            # Check file calls
-            if self._file is not None:
-                self._file.seek.assert_called_once_with(0)
-                asset_manager.os.makedirs.assert_called_once_with("/home/test/media/assets/temp", exist_ok=True)
-            if self._file is not None:
-                self._file.seek.assert_called_once_with(0)
-                asset_manager.os.makedirs.assert_called_once_with("/home/test/media/assets/temp", exist_ok=True)
-                # Check resource creation
+
+            # The file is streamed to S3 without local copies
+            s3 = asset_manager.boto3.client.return_value
+            self.assertEquals(1, s3.upload_fileobj.call_count)
+
+            stream, bucket, key = s3.upload_fileobj.call_args[0]
+            self.assertEquals("bucket", bucket)
+            self.assertEquals("media/" + file_name, key)
+            self.assertEquals(None, s3.upload_fileobj.call_args[1]["ExtraArgs"])
+            self.assertEquals(4, s3.upload_fileobj.call_args[1]["Config"].max_concurrency)
+
+            self.assertEquals(0, self.open_mock.call_count)
+            self.assertEquals([], am.rollback_logger["files"])
+
+            asset_manager.Resource.objects.create.assert_called_once_with(
+                provider=self._user.userprofile.current_organization,
+                version="",
+                download_link="https://s3-eu-west-1.amazonaws.com/bucket/media/" + file_name,
+                resource_path="media/" + file_name,
+                content_type="application/x-widget",
+                resource_type="",
+                state="",
+                is_public=True,
+                meta_info={},
+            )
         else:
-            self.assertEquals("({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'upload_file')", str(error))
+            self.assertEquals(
+                "({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'upload_fileobj')", str(error)
+            )
 
     def _mock_resource_type(self, form):
-        asset_manager.ResourcePlugin = MagicMock()
+        asset_manager.PLUGIN_REGISTRY = MagicMock()
         asset_manager.Resource.objects.filter.return_value = []
-        asset_manager.ResourcePlugin.objects.filter.return_value = [
-            MagicMock(media_types=[], name="service", formats=["URL"], form=form)
-        ]
+        asset_manager.PLUGIN_REGISTRY.get_plugin.return_value = MagicMock(
+            media_types=[], name="service", formats=["URL"], form=form
+        )
 
     BASIC_META = {"field1": "value", "field2": True, "field3": "value2"}
 
@@ -470,7 +503,7 @@ class UploadAssetTestCase(TestCase):
         self.assertEquals({"files": [], "models": [self.res_mock]}, am.rollback_logger)
 
         # Check calls
-        asset_manager.ResourcePlugin.objects.filter.assert_called_once_with(name="service")
+        asset_manager.PLUGIN_REGISTRY.get_plugin.assert_called_once_with("service")
 
         # Check resource creation
         asset_manager.Resource.objects.create.assert_called_once_with(
@@ -489,25 +522,21 @@ class UploadAssetTestCase(TestCase):
         asset_manager.Resource.objects.filter.return_value = [MagicMock(product_id="1")]
 
     def _type_not_found(self):
-        asset_manager.ResourcePlugin.objects.filter.return_value = []
+        asset_manager.PLUGIN_REGISTRY.get_plugin.return_value = None
 
     def _inv_content(self):
-        asset_manager.ResourcePlugin.objects.filter.return_value = [
-            MagicMock(
-                media_types=["text"],
-                name="service",
-                formats=["URL"],
-            )
-        ]
+        asset_manager.PLUGIN_REGISTRY.get_plugin.return_value = MagicMock(
+            media_types=["text"],
+            name="service",
+            formats=["URL"],
+        )
 
     def _inv_format(self):
-        asset_manager.ResourcePlugin.objects.filter.return_value = [
-            MagicMock(
-                media_types=[],
-                name="service",
-                formats=["FILE"],
-            )
-        ]
+        asset_manager.PLUGIN_REGISTRY.get_plugin.return_value = MagicMock(
+            media_types=[],
+            name="service",
+            formats=["FILE"],
+        )
 
     @parameterized.expand(
         [
@@ -822,3 +851,75 @@ class ResourceModelTestCase(TestCase):
         self.assertEquals(uri, res.get_uri())
 
         reload(models)
+
+
+class AssetStreamTestCase(TestCase):
+    tags = ("asset-manager",)
+
+    def test_base64_reader(self):
+        content = bytes(range(256)) * 10
+        encoded = base64.encodebytes(content).decode()  # Includes new lines every 76 characters
+
+        reader = asset_stream.Base64Reader(encoded)
+        chunks = []
+        while True:
+            chunk = reader.read(100)
+            if not chunk:
+                break
+
+            chunks.append(chunk)
+
+        self.assertEquals(content, b"".join(chunks))
+
+        # Reads are only short at the end of the data
+        self.assertEquals([100] * 25 + [60], [len(chunk) for chunk in chunks])
+
+    def test_s3_multipart_upload(self):
+        threshold = 5 * 1024 * 1024
+        content = os.urandom(threshold + 1024)
+
+        s3 = boto3.client("s3", region_name="us-east-1", aws_access_key_id="key", aws_secret_access_key="secret")
+        parts = []
+
+        def upload_part(params, **kwargs):
+            parts.append(params["Body"].read())
+
+        s3.meta.events.register("before-parameter-build.s3.UploadPart", upload_part)
+
+        with Stubber(s3) as stubber:
+            stubber.add_response("create_multipart_upload", {"UploadId": "upload"})
+            stubber.add_response("upload_part", {"ETag": "part1"})
+            stubber.add_response("upload_part", {"ETag": "part2"})
+            stubber.add_response("complete_multipart_upload", {})
+
+            stream = asset_stream.AssetStream(asset_stream.Base64Reader(base64.encodebytes(content).decode()), 1024)
+            s3.upload_fileobj(
+                stream,
+                "bucket",
+                "asset",
+                Config=TransferConfig(multipart_threshold=threshold, multipart_chunksize=threshold, max_concurrency=1),
+            )
+
+            stubber.assert_no_pending_responses()
+
+        # The file is uploaded in parts of the configured size
+        self.assertEquals([threshold, 1024], [len(part) for part in parts])
+        self.assertEquals(content, b"".join(parts))
+
+    def test_asset_stream(self):
+        content = b"Test data content"
+        stream = asset_stream.AssetStream(asset_stream.Base64Reader(base64.b64encode(content).decode()), 4)
+
+        self.assertEquals(content, b"".join(stream.chunks()))
+        self.assertEquals(len(content), stream.size)
+        self.assertEquals(hashlib.sha256(content).hexdigest(), stream.hexdigest())
+
+    def test_asset_stream_max_size(self):
+        stream = asset_stream.AssetStream(MagicMock(read=MagicMock(return_value=b"1234")), 4, max_size=10)
+
+        with self.assertRaises(ValueError) as e:
+            list(stream.chunks())
+
+        self.assertEquals(
+            "The provided digital asset file exceeds the maximum size allowed (10 bytes)", str(e.exception)
+        )
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from importlib import reload
+
+from bson import ObjectId
+from django.test.testcases import TestCase
+from mock import MagicMock
+from parameterized import parameterized
+
+from wstore.asset_manager import entitlements
+
+OFFERING = "61004aba5e05acc115f022f0"
+BUNDLED_OFFERING1 = "61004aba5e05acc115f022f1"
+BUNDLED_OFFERING2 = "61004aba5e05acc115f022f2"
+ASSET = ObjectId("61004aba5e05acc115f02200")
+ASSET2 = ObjectId("61004aba5e05acc115f02201")
+ASSET3 = ObjectId("61004aba5e05acc115f02202")
+
+
+class EntitlementsTestCase(TestCase):
+    tags = ("entitlements",)
+
+    def setUp(self):
+        self._collection = MagicMock()
+        entitlements.get_database_connection = MagicMock(return_value={"wstore_entitlement": self._collection})
+
+        entitlements.Offering = MagicMock()
+        self._offering = MagicMock(is_digital=True, bundled_offerings=[])
+        self._offering.asset = MagicMock(pk=ASSET, bundled_assets=[])
+        entitlements.Offering.objects.get.return_value = self._offering
+
+        self._order = MagicMock(pk=ObjectId("61004aba5e05acc115f022ff"), owner_organization_id="org")
+        self._contract = MagicMock(item_id="1", offering=OFFERING)
+
+    def tearDown(self):
+        reload(entitlements)
+
+    def _offering_bundle(self):
+        self._offering.bundled_offerings = [BUNDLED_OFFERING1, BUNDLED_OFFERING2]
+        entitlements.Offering.objects.filter.return_value = [
+            MagicMock(is_digital=True, asset=MagicMock(pk=ASSET2, bundled_assets=[])),
+            MagicMock(is_digital=False, asset=None),
+        ]
+
+    def _product_bundle(self):
+        self._offering.asset.bundled_assets = [str(ASSET2), str(ASSET3)]
+
+    def _not_digital(self):
+        self._offering.is_digital = False
+        self._offering.asset = None
+
+    @parameterized.expand(
+        [
+            ("single", [ASSET]),
+            ("offering_bundle", [ASSET2], _offering_bundle),
+            ("product_bundle", [ASSET2, ASSET3], _product_bundle),
+            ("not_digital", [], _not_digital),
+        ]
+    )
+    def test_get_offering_assets(self, name, expected, side_effect=None):
+        if side_effect is not None:
+            side_effect(self)
+
+        self.assertEquals(expected, entitlements.get_offering_assets(OFFERING))
+        entitlements.Offering.objects.get.assert_called_once_with(pk=ObjectId(OFFERING))
+
+        if name == "offering_bundle":
+            entitlements.Offering.objects.filter.assert_called_once_with(
+                pk__in=[ObjectId(BUNDLED_OFFERING1), ObjectId(BUNDLED_OFFERING2)]
+            )
+
+    def test_grant_access(self):
+        self._product_bundle()
+        entitlements.grant_access(self._order, self._contract)
+
+        requests = self._collection.bulk_write.call_args[0][0]
+        self.assertEquals(2, len(requests))
+
+        for request, asset in zip(requests, [ASSET2, ASSET3]):
+            self.assertEquals({"order": self._order.pk, "item": "1", "asset": asset}, request._filter)
+            self.assertEquals({"$set": {"organization": "org", "offering": OFFERING}}, request._doc)
+            self.assertTrue(request._upsert)
+
+        # Assets of a previous offering of the contract are removed
+        self._collection.delete_many.assert_called_once_with(
+            {"order": self._order.pk, "item": "1", "asset": {"$nin": [ASSET2, ASSET3]}}
+        )
+
+    def test_revoke_access(self):
+        entitlements.revoke_access(self._order, self._contract)
+        self._collection.delete_many.assert_called_once_with({"order": self._order.pk, "item": "1"})
+
+    @parameterized.expand([("allowed", {"_id": "1"}, True), ("forbidden", None, False)])
+    def test_has_access(self, name, entry, expected):
+        self._collection.find_one.return_value = entry
+
+        self.assertEquals(expected, entitlements.has_access("org", ASSET))
+        self._collection.find_one.assert_called_once_with({"organization": "org", "asset": ASSET}, {"_id": 1})
+
+    def test_build_entitlements(self):
+        entitlements.grant_access = MagicMock()
+        entitlements.Order = MagicMock()
+
+        order = MagicMock(owner_organization_id="org")
+        order.owner_organization.acquired_offerings = [OFFERING]
+        active = MagicMock(product_id="product", terminated=False, suspended=False)
+        legacy = MagicMock(product_id=None, offering=OFFERING, terminated=False, suspended=False)
+        pending = MagicMock(product_id=None, offering="other", terminated=False, suspended=False)
+        terminated = MagicMock(product_id="product", terminated=True, suspended=False)
+        suspended = MagicMock(product_id="product", terminated=False, suspended=True)
+        order.get_contracts.return_value = [active, legacy, pending, terminated, suspended]
+
+        entitlements.Order.objects.all.return_value = [order, MagicMock(owner_organization_id=None)]
+
+        self.assertEquals(2, entitlements.build_entitlements())
+        self.assertEquals(
+            [((order, active),), ((order, legacy),)],
+            [(call[0],) for call in entitlements.grant_access.call_args_list],
+        )
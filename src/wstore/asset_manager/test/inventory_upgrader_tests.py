@@ -23,12 +23,14 @@ from copy import deepcopy
 
 from bson import ObjectId
 from django.test.testcases import TestCase
-from mock import MagicMock, call
+from django.test.utils import override_settings
+from mock import ANY, MagicMock, call
 from requests.exceptions import HTTPError
 
 from wstore.asset_manager import inventory_upgrader
 
 
+@override_settings(INVENTORY_UPGRADER={"workers": 1})
 class InventoryUpgraderTestCase(TestCase):
     tags = ("upgrades",)
 
@@ -258,15 +260,22 @@ class InventoryUpgraderTestCase(TestCase):
         self._lock_inst = MagicMock()
         inventory_upgrader.DocumentLock = MagicMock(return_value=self._lock_inst)
 
-        inventory_upgrader.requests = MagicMock()
+        self._checkpoints = MagicMock()
+        self._checkpoints.find_one.return_value = None
+        inventory_upgrader.get_database_connection = MagicMock(
+            return_value={inventory_upgrader.CHECKPOINT_COLLECTION: self._checkpoints}
+        )
+
+        inventory_upgrader.http_client = MagicMock()
         self._resp = MagicMock()
         self._resp.json.return_value = {"name": self._product_spec_name}
-        inventory_upgrader.requests.get.return_value = self._resp
+        inventory_upgrader.http_client.get.return_value = self._resp
 
         inventory_upgrader.PAGE_LEN = 2.0
 
         self._asset = MagicMock()
         self._asset.pk = self._asset_pk
+        self._asset.version = "2.0"
         self._asset.product_id = self._product_spec_id
         self._asset.content_type = self._new_media_type
         self._asset.resource_type = "Service"
@@ -288,7 +297,7 @@ class InventoryUpgraderTestCase(TestCase):
         inventory_upgrader.settings.CATALOG = self._cat_url
 
     def _check_product_spec_retrieved(self):
-        inventory_upgrader.requests.get.assert_called_once_with(self._product_spec_url)
+        inventory_upgrader.http_client.get.assert_called_once_with(self._product_spec_url)
         self._resp.raise_for_status.assert_called_once_with()
         self._resp.json.assert_called_once_with()
 
@@ -346,19 +355,6 @@ class InventoryUpgraderTestCase(TestCase):
             [MagicMock(off_id=self._off_bundle_id, pk=self._off_bundle_pk)],
             [],
             [MagicMock(off_id=self._off_bundle_id2, pk=self._off_bundle_pk2)],
-            # Offering id validation results
-            [offering1],
-            [MagicMock()],
-            [offering1],
-            [MagicMock()],
-            [offering1],
-            [MagicMock()],
-            [offering3],
-            [offering3],
-            [offering3],
-            [],
-            [],
-            [],
         ]
 
         # Mock inventory client methods
@@ -401,18 +397,6 @@ class InventoryUpgraderTestCase(TestCase):
                 call(bundled_offerings=self._product_off_pk),
                 call(bundled_offerings=self._product_off_pk2),
                 call(bundled_offerings=self._product_off_pk3),
-                call(off_id=self._product_off_id),
-                call(off_id="asd"),
-                call(off_id=self._product_off_id),
-                call(off_id="asd"),
-                call(off_id=self._product_off_id),
-                call(off_id="asd"),
-                call(off_id=self._product_off_id3),
-                call(off_id=self._product_off_id3),
-                call(off_id=self._product_off_id3),
-                call(off_id="asd"),
-                call(off_id="asd"),
-                call(off_id="asd"),
             ],
             inventory_upgrader.Offering.objects.filter.call_args_list,
         )
@@ -614,7 +598,7 @@ class InventoryUpgraderTestCase(TestCase):
 
         self._client_instance.patch_product.side_effect = [None, HTTPError()]
 
-        inventory_upgrader.requests.get.side_effect = HTTPError()
+        inventory_upgrader.http_client.get.side_effect = HTTPError()
 
         # Execute the tested method
         upgrader = inventory_upgrader.InventoryUpgrader(self._asset)
@@ -653,8 +637,123 @@ class InventoryUpgraderTestCase(TestCase):
             self._client_instance.patch_product.call_args_list,
         )
 
-        inventory_upgrader.requests.get.assert_called_once_with(self._product_spec_url)
+        inventory_upgrader.http_client.get.assert_called_once_with(self._product_spec_url)
         self.assertEquals(0, self._resp.raise_for_status.call_count)
         self.assertEquals(0, self._resp.json.call_count)
 
         self.assertEquals(0, inventory_upgrader.NotificationsHandler.call_count)
+
+    def _mock_checkpoint(self, version):
+        self._checkpoints.find_one.return_value = {
+            "_id": self._asset_pk,
+            "version": version,
+            "completed": [self._product_off_id],
+            "offering": self._product_off_id2,
+            "offset": 2,
+            "pending_offerings": [],
+            "pending_products": ["10"],
+        }
+
+        inventory_upgrader.Offering.objects.filter.side_effect = [
+            [
+                MagicMock(off_id=self._product_off_id),
+                MagicMock(off_id=self._product_off_id2),
+            ],
+            [],
+            [],
+        ]
+
+    def test_inventory_upgrader_resume(self):
+        self._mock_checkpoint("2.0")
+
+        self._client_instance.get_products.side_effect = [
+            [{"id": str(i)} for i in range(1, 5)],
+            [self._product3, self._product4],
+        ]
+        self._client_instance.patch_product.side_effect = [self._product3, HTTPError()]
+
+        upgrader = inventory_upgrader.InventoryUpgrader(self._asset)
+        upgrader.run()
+
+        # The completed offering and the pages already processed are skipped
+        self.assertEquals(
+            [
+                call(query={"productOffering.id": self._product_off_id2, "fields": "id"}),
+                call(query={"id": "3,4", "fields": "id,productCharacteristic"}),
+            ],
+            self._client_instance.get_products.call_args_list,
+        )
+
+        self.assertEquals(
+            [
+                call("3", {"productCharacteristic": self._new_asset_chars}),
+                call("4", {"productCharacteristic": self._new_asset_chars}),
+            ],
+            self._client_instance.patch_product.call_args_list,
+        )
+
+        # Failed products of the previous execution are kept
+        self.assertEquals(
+            [
+                {
+                    "asset_id": self._asset_pk,
+                    "pending_offerings": [],
+                    "pending_products": ["10", "4"],
+                }
+            ],
+            self._ctx_instance.failed_upgrades,
+        )
+
+        self._checkpoints.find_one.assert_called_once_with({"_id": self._asset_pk})
+        owner = self._checkpoints.replace_one.call_args_list[0][0][1]["owner"]
+        self.assertEquals(
+            [call({"_id": self._asset_pk}, ANY, upsert=True)]
+            + [call({"_id": self._asset_pk, "owner": owner}, ANY) for i in range(0, 2)],
+            self._checkpoints.replace_one.call_args_list,
+        )
+
+        checkpoint = self._checkpoints.replace_one.call_args[0][1]
+        self.assertEquals([self._product_off_id, self._product_off_id2], checkpoint["completed"])
+        self.assertEquals(None, checkpoint["offering"])
+
+        self._checkpoints.delete_one.assert_called_once_with({"_id": self._asset_pk, "owner": owner})
+
+    def test_inventory_upgrader_taken_over(self):
+        self._mock_checkpoint("2.0")
+
+        self._client_instance.get_products.side_effect = [
+            [{"id": str(i)} for i in range(1, 5)],
+            [self._product3, self._product4],
+        ]
+        self._client_instance.patch_product.side_effect = [self._product3, self._product4]
+
+        # The upgrade is resumed by another run while the page is processed
+        self._checkpoints.replace_one.side_effect = [MagicMock(matched_count=1), MagicMock(matched_count=0)]
+
+        upgrader = inventory_upgrader.InventoryUpgrader(self._asset)
+        upgrader.run()
+
+        # The upgrade stops, leaving the checkpoint to the new owner
+        self.assertEquals(2, self._client_instance.get_products.call_count)
+        self.assertEquals([], self._ctx_instance.failed_upgrades)
+        self._checkpoints.delete_one.assert_not_called()
+
+    def test_inventory_upgrader_outdated_checkpoint(self):
+        self._mock_checkpoint("1.0")
+
+        self._client_instance.get_products.side_effect = [[], []]
+
+        upgrader = inventory_upgrader.InventoryUpgrader(self._asset)
+        upgrader.run()
+
+        # The checkpoint belongs to a previous version of the asset, so all the offerings are processed
+        self.assertEquals(
+            [
+                call(query={"productOffering.id": self._product_off_id, "fields": "id"}),
+                call(query={"productOffering.id": self._product_off_id2, "fields": "id"}),
+            ],
+            self._client_instance.get_products.call_args_list,
+        )
+
+        self.assertEquals([], self._ctx_instance.failed_upgrades)
+        self._checkpoints.delete_one.assert_called_once_with({"_id": self._asset_pk, "owner": ANY})
@@ -18,6 +18,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import random
+import sys
+from copy import deepcopy
 from importlib import reload
 from mock import MagicMock, call
 from parameterized import parameterized
@@ -31,7 +34,7 @@ from wstore.asset_manager.test.offering_validator_test_data import *
 from wstore.asset_manager.test.product_validator_test_data import BASIC_PRODUCT
 
 
-@override_settings(CATALOG='https://tmf-catalog.com')
+@override_settings(CATALOG='https://tmf-catalog.com', CONCURRENT_FETCH={"max_workers": 1})
 class OfferingValidatorTestCase(TestCase):
     tags = ("offering-validator",)
 
@@ -60,14 +63,14 @@ class OfferingValidatorTestCase(TestCase):
 
         import wstore.asset_manager.resource_plugins.decorators
 
-        wstore.asset_manager.resource_plugins.decorators.ResourcePlugin = MagicMock()
-        wstore.asset_manager.resource_plugins.decorators.ResourcePlugin.objects.get.return_value = self._plugin_instance
+        wstore.asset_manager.resource_plugins.decorators.PLUGIN_REGISTRY = MagicMock()
+        wstore.asset_manager.resource_plugins.decorators.PLUGIN_REGISTRY.get_module.return_value = MagicMock()
 
     def tearDown(self):
         reload(offering_validator)
 
     def _mock_requests(self, responses):
-        offering_validator.requests = MagicMock()
+        offering_validator.http_client = MagicMock()
 
         mock_responses = []
         for response in responses:
@@ -76,7 +79,7 @@ class OfferingValidatorTestCase(TestCase):
             resp.status_code = 200
             mock_responses.append(resp)
         
-        offering_validator.requests.get.side_effect = mock_responses
+        offering_validator.http_client.get.side_effect = mock_responses
 
     def _mock_offering_bundle(self, offering, is_digital=True):
         offering_validator.Offering = MagicMock()
@@ -112,7 +115,7 @@ class OfferingValidatorTestCase(TestCase):
         self.assertEquals([
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')),
             call("{}/productSpecification/{}".format('https://tmf-catalog.com', 'urn:ProductSpecification:12345'))
-        ], offering_validator.requests.get.call_args_list)
+        ], offering_validator.http_client.get.call_args_list)
         self._validate_offering_calls(offering, self._asset_instance, True)
 
     def _validate_physical_offering_calls(self, offering):
@@ -144,7 +147,7 @@ class OfferingValidatorTestCase(TestCase):
         self._validate_bundle_offering_calls(offering, False)
 
     def _validate_open_offering_calls(self, offering):
-        offering_validator.requests.get.assert_called_once_with(
+        offering_validator.http_client.get.assert_called_once_with(
             "{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')
         )
         self._validate_offering_calls(offering, self._asset_instance, True, is_open=True)
@@ -156,7 +159,7 @@ class OfferingValidatorTestCase(TestCase):
         self._validate_bundle_offering_calls(offering, True, is_open=True)
 
     def _validate_custom_pricing_calls(self, offering):
-        offering_validator.requests.get.assert_called_once_with(
+        offering_validator.http_client.get.assert_called_once_with(
             "{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')
         )
         self._validate_offering_calls(offering, self._asset_instance, True, False, True)
@@ -165,7 +168,7 @@ class OfferingValidatorTestCase(TestCase):
         self.assertEquals([
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')),
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:4567'))
-        ], offering_validator.requests.get.call_args_list)
+        ], offering_validator.http_client.get.call_args_list)
 
         self._validate_offering_calls(offering, self._asset_instance, True, False, True)
 
@@ -173,27 +176,27 @@ class OfferingValidatorTestCase(TestCase):
         self.assertEquals([
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')),
             call("{}/productSpecification/{}".format('https://tmf-catalog.com', 'urn:ProductSpecification:12345'))
-        ], offering_validator.requests.get.call_args_list)
+        ], offering_validator.http_client.get.call_args_list)
 
         self._validate_offering_calls(offering, self._asset_instance, True)
 
     def _validate_profile_multiple(self, offering):
         self.assertEquals([
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')),
-            call("{}/productSpecification/{}".format('https://tmf-catalog.com', 'urn:ProductSpecification:12345')),
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:ProductOfferingPrice:1111')),
-            call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:ProductOfferingPrice:1112'))
-        ], offering_validator.requests.get.call_args_list)
+            call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:ProductOfferingPrice:1112')),
+            call("{}/productSpecification/{}".format('https://tmf-catalog.com', 'urn:ProductSpecification:12345'))
+        ], offering_validator.http_client.get.call_args_list)
 
         self._validate_offering_calls(offering, self._asset_instance, True)
 
     def _validate_component_multiple(self, offering):
         self.assertEquals([
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:product-offering-price:1234')),
-            call("{}/productSpecification/{}".format('https://tmf-catalog.com', 'urn:ProductSpecification:12345')),
             call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:ProductOfferingPrice:1111')),
-            call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:ProductOfferingPrice:1112'))
-        ], offering_validator.requests.get.call_args_list)
+            call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', 'urn:ProductOfferingPrice:1112')),
+            call("{}/productSpecification/{}".format('https://tmf-catalog.com', 'urn:ProductSpecification:12345'))
+        ], offering_validator.http_client.get.call_args_list)
 
         self._validate_offering_calls(offering, self._asset_instance, True)
 
@@ -225,7 +228,7 @@ class OfferingValidatorTestCase(TestCase):
         ]
 
     def _catalog_api_error(self):
-        offering_validator.requests.get().status_code = 500
+        offering_validator.http_client.get().status_code = 500
 
     def _non_open_bundled(self):
         for bundle_resp in self._bundles:
@@ -242,8 +245,8 @@ class OfferingValidatorTestCase(TestCase):
         ("custom_pricing", BASE_OFFERING, [CUSTOM_OFFERING_PRICING], _validate_custom_pricing_calls),
         ("custom_pricing_multiple", BASE_OFFERING_MULTIPLE, [CUSTOM_OFFERING_PRICING, CUSTOM_OFFERING_PRICING_2], _validate_custom_pricing_calls_multiple),
         ("profile_plan_single", BASE_OFFERING, [PROFILE_PLAN, PROFILE_PROD_SPEC], _validate_profile_plan),
-        ("profile_plan_multiple", BASE_OFFERING, [PROFILE_PLAN_MULTIPLE, PROFILE_PROD_SPEC, PRICE_COMPONENT_1, PRICE_COMPONENT_2], _validate_profile_multiple),
-        ("component_char_plan", BASE_OFFERING, [COMPONENT_PLAN, PROFILE_PROD_SPEC, PRICE_COMPONENT_3, PRICE_COMPONENT_4], _validate_component_multiple)
+        ("profile_plan_multiple", BASE_OFFERING, [PROFILE_PLAN_MULTIPLE, PRICE_COMPONENT_1, PRICE_COMPONENT_2, PROFILE_PROD_SPEC], _validate_profile_multiple),
+        ("component_char_plan", BASE_OFFERING, [COMPONENT_PLAN, PRICE_COMPONENT_3, PRICE_COMPONENT_4, PROFILE_PROD_SPEC], _validate_component_multiple)
     ])
     def test_create_offering_validation(self, name, offering, requests, checker, side_effect=None):
         # Mock requests
@@ -268,7 +271,7 @@ class OfferingValidatorTestCase(TestCase):
         ("missing_currency", BASE_OFFERING, [MISSING_CURRENCY, BASIC_PROD_SPEC], "Missing currency code in price"),
         ("invalid_currency", BASE_OFFERING, [INVALID_CURRENCY, BASIC_PROD_SPEC], "Unrecognized currency: invalid"),
         ("missing_name", BASE_OFFERING, [MISSING_NAME], "Missing required field name in productOfferingPrice"),
-        ("multiple_names", BASE_OFFERING_MULTIPLE, [OT_OFFERING_PRICE, BASIC_PROD_SPEC, OT_OFFERING_PRICE_2], "Price plans names must be unique (plan)"),
+        ("multiple_names", BASE_OFFERING_MULTIPLE, [OT_OFFERING_PRICE, OT_OFFERING_PRICE_2, BASIC_PROD_SPEC], "Price plans names must be unique (plan)"),
         ("bundle_missing", BUNDLE_MISSING_FIELD, [], "Offering bundles must contain a bundledProductOffering field"),
         ("bundle_invalid_number", BUNDLE_MISSING_ELEMS, [], "Offering bundles must contain at least two bundled offerings"),
         ("open_mixed", OPEN_MIXED, [OPEN_OFFERING_PRICE, OPEN_MIXED_PRICE, BASIC_PROD_SPEC], "Open offerings cannot include price plans"),
@@ -416,7 +419,7 @@ class OfferingValidatorTestCase(TestCase):
         self.assertIn(expected_char_id, str(error))
         self.assertIn("doesn't have continous subranges", str(error))
 
-    def test_recursive_anti_collision_basic(self):
+    def test_continuous_range_basic(self):
         validator = offering_validator.OfferingValidator()
 
         record = {
@@ -425,14 +428,14 @@ class OfferingValidatorTestCase(TestCase):
         }
 
         # Should find path from 1 to 20
-        result = validator._recursive_anti_collision(1, 20, record)
+        result = validator._is_continuous_range(1, 20, record)
         self.assertTrue(result)
 
         # Should not find path from 1 to 30
-        result = validator._recursive_anti_collision(1, 30, record)
+        result = validator._is_continuous_range(1, 30, record)
         self.assertFalse(result)
 
-    def test_recursive_anti_collision_multiple_paths(self):
+    def test_continuous_range_multiple_paths(self):
         validator = offering_validator.OfferingValidator()
 
         record = {
@@ -446,23 +449,23 @@ class OfferingValidatorTestCase(TestCase):
         }
 
         # Should find path from 1 to 50 through multiple branches
-        result = validator._recursive_anti_collision(1, 50, record)
+        result = validator._is_continuous_range(1, 50, record)
         self.assertTrue(result)
 
         # Should find path from 1 to 40
-        result = validator._recursive_anti_collision(1, 40, record)
+        result = validator._is_continuous_range(1, 40, record)
         self.assertTrue(result)
 
-    def test_recursive_anti_collision_empty_record(self):
+    def test_continuous_range_empty_record(self):
         validator = offering_validator.OfferingValidator()
 
         record = {}
 
         # Should return False for empty record
-        result = validator._recursive_anti_collision(1, 100, record)
+        result = validator._is_continuous_range(1, 100, record)
         self.assertFalse(result)
 
-    def test_recursive_anti_collision_no_path(self):
+    def test_continuous_range_no_path(self):
         validator = offering_validator.OfferingValidator()
 
         record = {
@@ -471,5 +474,165 @@ class OfferingValidatorTestCase(TestCase):
         }
 
         # Should not find path from 1 to 100 due to gap
-        result = validator._recursive_anti_collision(1, 100, record)
+        result = validator._is_continuous_range(1, 100, record)
         self.assertFalse(result)
+
+    def _reference_anti_collision(self, value_search, value_end, record):
+        # Previous recursive implementation, used to check the range sweep
+        value_nexts = record.get(f"from-{value_search}", None)
+        if value_nexts is None or len(value_nexts) == 0:
+            return False
+
+        for value_next in value_nexts:
+            if value_next == value_end or self._reference_anti_collision(value_next + 1, value_end, record):
+                return True
+
+        return False
+
+    def test_continuous_range_matches_reference(self):
+        validator = offering_validator.OfferingValidator()
+        rand = random.Random(1234)
+
+        for i in range(0, 500):
+            value_init = rand.randint(0, 10)
+            value_end = value_init + rand.randint(0, 40)
+
+            # Continuous subranges covering the total range
+            cuts = sorted(rand.sample(range(value_init, value_end + 1), rand.randint(0, value_end - value_init)))
+            ranges = []
+            range_from = value_init
+            for cut in cuts + [value_end]:
+                if cut >= range_from:
+                    ranges.append((range_from, cut))
+                    range_from = cut + 1
+
+            # Random overlapping subranges, and some of the chain ones removed or shifted
+            for j in range(0, rand.randint(0, 6)):
+                range_from = rand.randint(value_init - 2, value_end + 2)
+                ranges.append((range_from, range_from + rand.randint(0, 15)))
+
+            for j in range(0, min(rand.randint(0, 2), len(ranges))):
+                index = rand.randrange(len(ranges))
+                if rand.random() < 0.5:
+                    ranges.pop(index)
+                else:
+                    # valueFrom greater than valueTo is rejected before checking the ranges
+                    range_from, range_to = ranges[index]
+                    ranges[index] = (range_from, max(range_from, range_to + rand.choice([-1, 1])))
+
+            record = {}
+            for range_from, range_to in ranges:
+                record.setdefault(f"from-{range_from}", []).append(range_to)
+
+            self.assertEquals(
+                self._reference_anti_collision(value_init, value_end, record),
+                validator._is_continuous_range(value_init, value_end, record),
+                "Different result for range ({}, {}) and {}".format(value_init, value_end, record),
+            )
+
+    def test_continuous_range_large_table(self):
+        validator = offering_validator.OfferingValidator()
+
+        # Long chains of subranges must not reach the recursion limit
+        n_ranges = max(10000, sys.getrecursionlimit() * 2)
+        record = {f"from-{i * 10}": [i * 10 + 9] for i in range(0, n_ranges)}
+
+        self.assertTrue(validator._is_continuous_range(0, n_ranges * 10 - 1, record))
+
+        del record["from-50"]
+        self.assertFalse(validator._is_continuous_range(0, n_ranges * 10 - 1, record))
+
+    def test_check_range_collision_reports_all(self):
+        validator = offering_validator.OfferingValidator()
+
+        anti_collision = deepcopy(ANTICOLLISION_NON_CONTINUOUS_GAP)
+        anti_collision.update(deepcopy(ANTICOLLISION_MULTIPLE_CHARS_ONE_NON_CONTINUOUS))
+
+        error = None
+        try:
+            validator._check_range_collision(anti_collision)
+        except ValueError as e:
+            error = e
+
+        self.assertEquals(
+            "Offering price linked to Characteristic with key: urn:Characteristic:9999, urn:Characteristic:4444 "
+            "doesn't have continous subranges",
+            str(error),
+        )
+
+    def test_prefetch_prices_deduplicated(self):
+        offering_validator.http_client = MagicMock()
+        offering_validator.http_client.get.side_effect = [
+            MagicMock(status_code=200, json=MagicMock(return_value={"id": "1"})),
+            MagicMock(status_code=404),
+        ]
+
+        validator = offering_validator.OfferingValidator()
+        validator._prices = {}
+        validator._prefetch_prices(["1", "2", "1"])
+        validator._prefetch_prices(["2"])
+
+        self.assertEquals([
+            call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', '1')),
+            call("{}/productOfferingPrice/{}".format('https://tmf-catalog.com', '2'))
+        ], offering_validator.http_client.get.call_args_list)
+
+        self.assertEquals({"id": "1"}, validator._get_price("1"))
+
+        # Download errors are raised when the price is used
+        error = None
+        try:
+            validator._get_price("2")
+        except ValueError as e:
+            error = e
+
+        self.assertEquals("Invalid pricing reference", str(error))
+        self.assertEquals(2, offering_validator.http_client.get.call_count)
+
+    def _validate_component_ranges(self, price_component, product_spec, anti_collision, has_profile):
+        anti_collision["urn:Characteristic:1"] = {
+            "total_range": {"valueFrom": 1, "valueTo": 20},
+            "from-1": [10],
+        }
+
+    def test_validate_cached_component(self):
+        validator = offering_validator.OfferingValidator()
+        validator._validate_price_component = MagicMock(side_effect=self._validate_component_ranges)
+
+        component = {"id": "urn:ProductOfferingPrice:1111", "lastUpdate": "2025-01-01T00:00:00Z"}
+        spec = {"id": "urn:ProductSpecification:12345", "lastUpdate": "2025-01-01T00:00:00Z"}
+
+        anti_collision = {"urn:Characteristic:1": {"total_range": {"valueFrom": 1, "valueTo": 20}, "from-11": [20]}}
+        validator._validate_cached_component(component, spec, anti_collision)
+
+        # The stored ranges are used while the component is not updated
+        other_collision = {}
+        validator._validate_cached_component(component, spec, other_collision)
+
+        validator._validate_price_component.assert_called_once_with(component, spec, {
+            "urn:Characteristic:1": {"total_range": {"valueFrom": 1, "valueTo": 20}, "from-1": [10]},
+        }, False)
+
+        self.assertEquals({
+            "urn:Characteristic:1": {"total_range": {"valueFrom": 1, "valueTo": 20}, "from-11": [20], "from-1": [10]},
+        }, anti_collision)
+        self.assertEquals({
+            "urn:Characteristic:1": {"total_range": {"valueFrom": 1, "valueTo": 20}, "from-1": [10]},
+        }, other_collision)
+
+        component["lastUpdate"] = "2025-02-01T00:00:00Z"
+        validator._validate_cached_component(component, spec, {})
+
+        self.assertEquals(2, validator._validate_price_component.call_count)
+
+    def test_validate_cached_component_no_last_update(self):
+        validator = offering_validator.OfferingValidator()
+        validator._validate_price_component = MagicMock()
+
+        component = {"id": "urn:ProductOfferingPrice:1111"}
+        spec = {"id": "urn:ProductSpecification:12345"}
+
+        validator._validate_cached_component(component, spec)
+        validator._validate_cached_component(component, spec)
+
+        self.assertEquals(2, validator._validate_price_component.call_count)
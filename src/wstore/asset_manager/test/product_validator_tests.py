@@ -40,8 +40,8 @@ class ValidatorTestCase(TestCase):
     def _mock_validator_imports(self, module):
         reload(module)
 
-        module.ResourcePlugin = MagicMock()
-        module.ResourcePlugin.objects.get.return_value = self._plugin_instance
+        module.PLUGIN_REGISTRY = MagicMock()
+        module.PLUGIN_REGISTRY.get_plugin.return_value = self._plugin_instance
 
         module.Resource = MagicMock()
         self._asset_instance = MagicMock()
@@ -67,8 +67,8 @@ class ValidatorTestCase(TestCase):
 
         import wstore.asset_manager.resource_plugins.decorators
 
-        wstore.asset_manager.resource_plugins.decorators.ResourcePlugin = MagicMock()
-        wstore.asset_manager.resource_plugins.decorators.ResourcePlugin.objects.get.return_value = self._plugin_instance
+        wstore.asset_manager.resource_plugins.decorators.PLUGIN_REGISTRY = MagicMock()
+        wstore.asset_manager.resource_plugins.decorators.PLUGIN_REGISTRY.get_module.return_value = MagicMock()
 
         # Mock Site
         product_validator.settings.SITE = "http://testlocation.org/"
@@ -83,7 +83,7 @@ class ValidatorTestCase(TestCase):
     def _not_supported(self):
         import wstore.asset_manager.resource_plugins.decorators
 
-        wstore.asset_manager.resource_plugins.decorators.ResourcePlugin.objects.get.side_effect = Exception("Not found")
+        wstore.asset_manager.resource_plugins.decorators.PLUGIN_REGISTRY.get_module.return_value = None
         self._mock_validator_imports(product_validator)
 
     def _inv_media(self):
@@ -117,7 +117,7 @@ class ValidatorTestCase(TestCase):
         validator = product_validator.ProductValidator()
         validator.validate("create", self._provider, BASIC_PRODUCT["product"])
 
-        product_validator.ResourcePlugin.objects.get.assert_called_once_with(name="Widget")
+        product_validator.PLUGIN_REGISTRY.get_plugin.assert_called_once_with("Widget")
         product_validator.Resource.objects.filter.assert_called_once_with(download_link=PRODUCT_LOCATION)
         self.assertFalse(product_validator.Resource.objects.get().has_terms)
         product_validator.Resource.objects.get().save.assert_called_once_with()
@@ -392,7 +392,7 @@ class ValidatorTestCase(TestCase):
         )
 
         # The method did nothing
-        self.assertEquals(0, product_validator.ResourcePlugin.objects.get.call_count)
+        self.assertEquals(0, product_validator.PLUGIN_REGISTRY.get_plugin.call_count)
 
     @parameterized.expand(
         [
@@ -601,7 +601,7 @@ class ValidatorTestCase(TestCase):
         validator = product_validator.ProductValidator()
         validator.validate("create", self._provider, product)
 
-        self.assertEquals(0, product_validator.ResourcePlugin.objects.get.call_count)
+        self.assertEquals(0, product_validator.PLUGIN_REGISTRY.get_plugin.call_count)
         self.assertEquals(0, product_validator.Resource.objects.get.call_count)
         self.assertEquals(0, product_validator.Resource.objects.create.call_count)
 
@@ -52,7 +52,7 @@ class UsageClientTestCase(TestCase):
         method(*args)
 
         # Verify calls
-        usage_client.requests.patch.assert_called_once_with(
+        usage_client.http_client.patch.assert_called_once_with(
             usage_client.settings.USAGE + "/usage/" + BASIC_USAGE["id"],
             json=expected_json,
         )
@@ -33,16 +33,17 @@ class SDRManager:
         self._contract = None
         self._time_stamp = None
 
+    def _get_order(self, order_id):
+        try:
+            return Order.objects.get(order_id=order_id)
+        except:
+            return None
+
     def _get_order_contract(self, order_id, product_id):
         # Get the order
-        order = None
+        order = self._get_order(order_id)
         contract = None
 
-        try:
-            order = Order.objects.get(order_id=order_id)
-        except:
-            pass
-
         try:
             contract = order.get_product_contract(product_id)
         except:
@@ -50,6 +51,16 @@ class SDRManager:
 
         return order, contract
 
+    def _get_customer_organizations(self, customer_name):
+        # Check that the customer exist
+        customer = Organization.objects.filter(name=customer_name)
+
+        if not len(customer):
+            raise ValueError("The specified customer " + customer_name + " does not exist")
+
+        user = User.objects.get(username=customer_name)
+        return [org["organization"] for org in user.userprofile.organizations]
+
     def _get_datetime(self, raw_time):
         try:
             if "+" in raw_time:
@@ -118,20 +129,10 @@ class SDRManager:
         if "relatedParty" not in sdr:
             raise ValueError("Missing required field relatedParty")
 
-        # Check that the customer exist
-        customer_name = sdr["relatedParty"][0]["id"]
-        customer = Organization.objects.filter(name=customer_name)
-
-        if not len(customer):
-            raise ValueError("The specified customer " + customer_name + " does not exist")
-
         # Check if the user making the request belongs to the customer organization
-        user = User.objects.get(username=customer_name)
+        customer_name = sdr["relatedParty"][0]["id"]
 
-        for org in user.userprofile.organizations:
-            if org["organization"] == self._order.owner_organization.pk:
-                break
-        else:
+        if self._order.owner_organization.pk not in self._get_customer_organizations(customer_name):
             raise PermissionDenied("You don't belong to the customer organization")
 
         # Validate that the price mode included in the contract correspond to the one specified in the SDR
@@ -158,6 +159,78 @@ class SDRManager:
 
     def update_usage(self):
         # Save new usage information
+        correlation_number = self._contract.correlation_number
+        self._contract.last_usage = self._time_stamp
+        self._contract.correlation_number += 1
+
+        self._order.update_contract_usage(
+            self._contract.product_id, correlation_number, self._contract.correlation_number, self._time_stamp
+        )
+
+
+class SDRBatchManager(SDRManager):
+    """
+    Validates a batch of SDRs. Orders, contracts and customers are retrieved
+    once per batch, and the usage state of each contract is saved with a single
+    update after the whole batch has been validated
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._orders = {}
+        self._contracts = {}
+        self._customers = {}
+        self._updates = {}
+
+    def _get_order(self, order_id):
+        if order_id not in self._orders:
+            self._orders[order_id] = super()._get_order(order_id)
+
+        return self._orders[order_id]
+
+    def _get_order_contract(self, order_id, product_id):
+        # Contracts are kept so the SDRs of the batch are validated against the
+        # usage state left by the previous ones
+        key = (order_id, product_id)
+        if key not in self._contracts:
+            self._contracts[key] = super()._get_order_contract(order_id, product_id)
+
+        return self._contracts[key]
+
+    def _get_customer_organizations(self, customer_name):
+        if customer_name not in self._customers:
+            try:
+                self._customers[customer_name] = super()._get_customer_organizations(customer_name)
+            except Exception as e:
+                self._customers[customer_name] = e
+
+        organizations = self._customers[customer_name]
+        if isinstance(organizations, Exception):
+            raise organizations
+
+        return organizations
+
+    def update_usage(self, usage_id):
+        key = (self._order.pk, self._contract.product_id)
+        if key not in self._updates:
+            self._updates[key] = (self._order, self._contract, self._contract.correlation_number, [])
+
         self._contract.last_usage = self._time_stamp
         self._contract.correlation_number += 1
-        self._order.save()
+        self._updates[key][3].append(usage_id)
+
+    def save(self):
+        """
+        Stores the usage state of the contracts updated by the batch
+        :return: ids of the SDRs whose contract has been modified concurrently
+        """
+        conflicts = []
+
+        for order, contract, correlation_number, usage_ids in self._updates.values():
+            if not order.update_contract_usage(
+                contract.product_id, correlation_number, contract.correlation_number, contract.last_usage
+            ):
+                conflicts.extend(usage_ids)
+
+        self._updates = {}
+        return conflicts
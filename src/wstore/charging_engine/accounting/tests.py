@@ -27,7 +27,8 @@ from importlib import reload
 
 from django.core.exceptions import PermissionDenied
 from django.test import TestCase
-from mock import MagicMock
+from django.test.utils import override_settings
+from mock import MagicMock, call
 from parameterized import parameterized
 
 from wstore.charging_engine.accounting import sdr_manager, usage_client, views
@@ -273,7 +274,71 @@ class SDRManagerTestCase(TestCase):
         self.assertEquals(2, self._contract.correlation_number)
         self.assertEquals(self._timestamp, self._contract.last_usage)
 
-        self._order.save.assert_called_once_with()
+        self._order.update_contract_usage.assert_called_once_with(self._contract.product_id, 1, 2, self._timestamp)
+
+    def _build_sdr(self, correlation_number, date, customer="test_user"):
+        sdr = deepcopy(BASIC_SDR)
+        sdr["usageCharacteristic"][2]["value"] = str(correlation_number)
+        sdr["date"] = date
+        sdr["relatedParty"] = [{"id": customer}]
+        return sdr
+
+    def test_batch_validation(self):
+        self._contract.product_id = "2"
+        sdr_mng = sdr_manager.SDRBatchManager()
+
+        # SDRs of the same contract are validated against the state left by the previous ones
+        sdr_mng.validate_sdr(self._build_sdr(1, "2015-10-20 17:31:57.100000"))
+        sdr_mng.update_usage("1")
+
+        sdr_mng.validate_sdr(self._build_sdr(2, "2015-10-20 17:32:57.100000"))
+        sdr_mng.update_usage("2")
+
+        for sdr, error in [
+            (self._build_sdr(2, "2015-10-20 17:33:57.100000"), "Invalid correlation number, expected: 3"),
+            (
+                self._build_sdr(3, "2015-10-20 17:30:57.100000"),
+                "The provided timestamp specifies a lower timing than the last SDR received",
+            ),
+        ]:
+            with self.assertRaises(ValueError) as e:
+                sdr_mng.validate_sdr(sdr)
+
+            self.assertEquals(error, str(e.exception))
+
+        # Lookups are made once per batch
+        sdr_manager.Order.objects.get.assert_called_once_with(order_id="1")
+        self._order.get_product_contract.assert_called_once_with("2")
+        sdr_manager.Organization.objects.filter.assert_called_once_with(name="test_user")
+        sdr_manager.User.objects.get.assert_called_once_with(username="test_user")
+
+        self._order.update_contract_usage.return_value = True
+        self.assertEquals([], sdr_mng.save())
+
+        self._order.update_contract_usage.assert_called_once_with(
+            "2", 1, 3, datetime.strptime("2015-10-20 17:32:57.100", "%Y-%m-%d %H:%M:%S.%f")
+        )
+
+    def test_batch_validation_conflict(self):
+        sdr_mng = sdr_manager.SDRBatchManager()
+
+        sdr_mng.validate_sdr(self._build_sdr(1, "2015-10-20 17:31:57.100000"))
+        sdr_mng.update_usage("1")
+
+        self._order.update_contract_usage.return_value = False
+        self.assertEquals(["1"], sdr_mng.save())
+
+    def test_batch_validation_customer_error(self):
+        self._side_cust_not_exists()
+        sdr_mng = sdr_manager.SDRBatchManager()
+
+        for _ in range(2):
+            with self.assertRaises(ValueError) as e:
+                sdr_mng.validate_sdr(self._build_sdr(1, "2015-10-20 17:31:57.100000"))
+
+            self.assertEquals("The specified customer test_user does not exist", str(e.exception))
+
+        sdr_manager.Organization.objects.filter.assert_called_once_with(name="test_user")
 
 
 BASIC_USAGE = {
@@ -297,15 +362,18 @@ class UsageClientTestCase(TestCase):
 
     def setUp(self):
         usage_client.settings.USAGE = "http://example.com"
-        usage_client.requests = MagicMock()
+        usage_client.http_client = MagicMock()
         self._old_inv = usage_client.settings.INVENTORY
         usage_client.settings.INVENTORY = "http://localhost:8080/DSProductInventory"
+        self._old_usage_client = usage_client.settings.USAGE_CLIENT
+        usage_client.settings.USAGE_CLIENT = {"page_size": 100}
 
         self._customer = "test_customer"
         self._product_id = "1"
 
     def tearDown(self):
         usage_client.settings.INVENTORY = self._old_inv
+        usage_client.settings.USAGE_CLIENT = self._old_usage_client
 
     @parameterized.expand(
         [
@@ -314,17 +382,17 @@ class UsageClientTestCase(TestCase):
                 "filtered_by_state",
                 [NON_PRODUCT_USAGE, BASIC_USAGE],
                 [BASIC_USAGE],
-                "&status=guided",
+                {"status": "guided"},
                 "guided",
             ),
             ("product_not_found", [NON_PRODUCT_USAGE], []),
         ]
     )
-    def test_retrieve_usage(self, name, response, exp_resp, extra_query="", state=None):
+    def test_retrieve_usage(self, name, response, exp_resp, extra_query={}, state=None):
         # Create mocks
         mock_response = MagicMock()
         mock_response.json.return_value = response
-        usage_client.requests.get.return_value = mock_response
+        usage_client.http_client.get.return_value = mock_response
         client = usage_client.UsageClient()
 
         cust_usage = client.get_customer_usage(self._customer, self._product_id, state=state)
@@ -333,14 +401,81 @@ class UsageClientTestCase(TestCase):
         self.assertEquals(exp_resp, cust_usage)
 
         # Verify calls
-        usage_client.requests.get.assert_called_once_with(
-            usage_client.settings.USAGE + "/usage?relatedParty.id=" + self._customer + extra_query,
+        params = {
+            "relatedParty.id": self._customer,
+            "usageCharacteristic.value": self._product_id,
+            "offset": 0,
+            "limit": 100,
+        }
+        params.update(extra_query)
+
+        usage_client.http_client.get.assert_called_once_with(
+            usage_client.settings.USAGE + "/usage",
+            params=params,
             headers={"Accept": "application/json"},
         )
 
         mock_response.raise_for_status.assert_called_once_with()
         mock_response.json.assert_called_once_with()
 
+    def test_retrieve_usage_pages(self):
+        usage_client.settings.USAGE_CLIENT = {"page_size": 2}
+
+        pages = [[BASIC_USAGE, NON_PRODUCT_USAGE], [BASIC_USAGE, BASIC_USAGE], []]
+        offsets = []
+
+        def get(url, params=None, headers=None):
+            offsets.append((params["offset"], params["limit"]))
+            return MagicMock(json=MagicMock(return_value=pages[len(offsets) - 1]))
+
+        usage_client.http_client.get.side_effect = get
+        client = usage_client.UsageClient()
+
+        usage = client.iter_customer_usage(self._customer, product_id=self._product_id)
+
+        # Pages are requested as the usage is consumed
+        self.assertEquals(BASIC_USAGE, next(usage))
+        self.assertEquals([(0, 2)], offsets)
+
+        self.assertEquals([BASIC_USAGE, BASIC_USAGE], list(usage))
+        self.assertEquals([(0, 2), (2, 2), (4, 2)], offsets)
+
+    def test_retrieve_products_usage(self):
+        other_usage = {
+            "id": "4",
+            "usageCharacteristic": [{"name": "productId", "value": "2"}],
+        }
+        responses = {"1": [BASIC_USAGE], "2": [NON_PRODUCT_USAGE, other_usage]}
+
+        def get(url, params=None, headers=None):
+            return MagicMock(json=MagicMock(return_value=responses[params["usageCharacteristic.value"]]))
+
+        usage_client.http_client.get.side_effect = get
+        client = usage_client.UsageClient()
+
+        usage = list(client.iter_products_usage(self._customer, ["1", "2", "1"], state="guided"))
+
+        self.assertEquals([("1", BASIC_USAGE), ("2", NON_PRODUCT_USAGE), ("2", other_usage)], usage)
+
+        # A listing filtered by product is made for each of the products
+        self.assertEquals(
+            [
+                call(
+                    usage_client.settings.USAGE + "/usage",
+                    params={
+                        "relatedParty.id": self._customer,
+                        "status": "guided",
+                        "usageCharacteristic.value": product_id,
+                        "offset": 0,
+                        "limit": 100,
+                    },
+                    headers={"Accept": "application/json"},
+                )
+                for product_id in ["1", "2"]
+            ],
+            usage_client.http_client.get.call_args_list,
+        )
+
     def _test_invalid_state(self, method, args, kwargs):
         error = None
         try:
@@ -361,12 +496,12 @@ class UsageClientTestCase(TestCase):
 
     def _test_patch(self, expected_json, method, args):
         mock_response = MagicMock()
-        usage_client.requests.patch.return_value = mock_response
+        usage_client.http_client.patch.return_value = mock_response
 
         method(*args)
 
         # Verify calls
-        usage_client.requests.patch.assert_called_once_with(
+        usage_client.http_client.patch.assert_called_once_with(
             usage_client.settings.USAGE + "/usage/" + BASIC_USAGE["id"],
             json=expected_json,
         )
@@ -443,6 +578,7 @@ class SDRCollectionTestCase(TestCase):
     def setUp(self):
         views.Order = MagicMock()
         views.SDRManager = MagicMock()
+        views.SDRBatchManager = MagicMock()
 
         self._manager_inst = MagicMock()
         views.SDRManager.return_value = self._manager_inst
@@ -537,3 +673,105 @@ class SDRCollectionTestCase(TestCase):
             else:
                 views.UsageClient().update_usage_state.assert_called_once_with("1", "rejected")
                 self.assertEquals(0, self._manager_inst.update_usage.call_count)
+
+    def test_feed_sdr_batch(self):
+        def validate_sdr(sdr):
+            if sdr["id"] == "2":
+                raise ValueError("Value error")
+
+            if sdr["id"] == "3":
+                raise PermissionDenied("Permission denied")
+
+        batch_manager = views.SDRBatchManager.return_value
+        batch_manager.validate_sdr.side_effect = validate_sdr
+        batch_manager.save.return_value = ["4"]
+
+        sdrs = []
+        for id_ in ["1", "2", "3", "4"]:
+            sdr = deepcopy(BASIC_SDR)
+            sdr["id"] = id_
+            sdrs.append(sdr)
+
+        self.request.body = json.dumps(sdrs + ["invalid"])
+
+        collection = views.ServiceRecordBatchCollection(permitted_methods=("POST",))
+        response = collection.create(self.request)
+
+        self._validate_response(
+            response,
+            200,
+            [
+                {"id": "1", "code": 200},
+                {"id": "2", "code": 422, "error": "Value error"},
+                {"id": "3", "code": 403, "error": "Permission denied"},
+                {"id": "4", "code": 409, "error": "The usage state of the contract has been modified concurrently"},
+                {
+                    "id": None,
+                    "code": 500,
+                    "error": "The SDR document could not be processed due to an unexpected error",
+                },
+            ],
+        )
+
+        views.SDRBatchManager.assert_called_once_with()
+        self.assertEquals([call("1"), call("4")], batch_manager.update_usage.call_args_list)
+        batch_manager.save.assert_called_once_with()
+
+        self.assertCountEqual(
+            [call("1", "guided"), call("2", "rejected"), call("3", "rejected")],
+            views.UsageClient().update_usage_state.call_args_list,
+        )
+
+    def test_feed_sdr_batch_state_error(self):
+        def update_usage_state(usage_id, state):
+            if usage_id == "2":
+                raise Exception("Usage API error")
+
+        views.SDRBatchManager.return_value.save.return_value = []
+        views.UsageClient().update_usage_state.side_effect = update_usage_state
+
+        sdrs = []
+        for id_ in ["1", "2", "3"]:
+            sdr = deepcopy(BASIC_SDR)
+            sdr["id"] = id_
+            sdrs.append(sdr)
+
+        self.request.body = json.dumps(sdrs)
+
+        collection = views.ServiceRecordBatchCollection(permitted_methods=("POST",))
+        response = collection.create(self.request)
+
+        # The error is only reported in the result of the failing SDR
+        self._validate_response(
+            response,
+            200,
+            [
+                {"id": "1", "code": 200},
+                {"id": "2", "code": 200, "stateError": "The usage state could not be updated to guided"},
+                {"id": "3", "code": 200},
+            ],
+        )
+        self.assertEquals(3, views.UsageClient().update_usage_state.call_count)
+
+    @override_settings(SDR_BATCH={"max_size": 2})
+    def test_feed_sdr_batch_too_large(self):
+        self.request.body = json.dumps([BASIC_SDR, BASIC_SDR, BASIC_SDR])
+
+        collection = views.ServiceRecordBatchCollection(permitted_methods=("POST",))
+        response = collection.create(self.request)
+
+        self._validate_response(
+            response, 413, {"result": "error", "error": "The request cannot contain more than 2 SDR documents"}
+        )
+        self.assertEquals(0, views.SDRBatchManager.call_count)
+
+    def test_feed_sdr_batch_not_list(self):
+        self.request.body = json.dumps(BASIC_SDR)
+
+        collection = views.ServiceRecordBatchCollection(permitted_methods=("POST",))
+        response = collection.create(self.request)
+
+        self._validate_response(
+            response, 422, {"result": "error", "error": "The request must contain a list of SDR documents"}
+        )
+        self.assertEquals(0, views.SDRBatchManager.call_count)
@@ -20,10 +20,10 @@
 
 from urllib.parse import urljoin, urlparse
 
-import requests
 from django.conf import settings
 
 from wstore.charging_engine.accounting.errors import UsageError
+from wstore.store_commons import http_client
 from wstore.store_commons.utils.url import get_service_url
 
 
@@ -37,20 +37,21 @@ class UsageClient:
         if state not in valid_states:
             raise UsageError("Invalid usage status " + state)
 
-    def _belongs_to_product(self, usage, product_id):
-        belongs = False
-        for char in usage["usageCharacteristic"]:
-            if char["name"].lower() == "productid" and char["value"] == product_id:
-                belongs = True
-                break
+    def _get_product_id(self, usage):
+        for char in usage.get("usageCharacteristic", []):
+            if char["name"].lower() == "productid":
+                return char["value"]
 
-        return belongs
+        return None
+
+    def _belongs_to_product(self, usage, product_id):
+        return self._get_product_id(usage) == product_id
 
     def _create_usage_item(self, url, usage_item):
         # Override the needed headers to avoid spec hrefs to be created with internal host and port
         headers = {"Host": urlparse(settings.SITE).netloc}
 
-        r = requests.post(url, headers=headers, json=usage_item)
+        r = http_client.post(url, headers=headers, json=usage_item)
         r.raise_for_status()
 
         return r.json()
@@ -86,38 +87,76 @@ class UsageClient:
         path = "usageSpecification/" + spec_id
         url = get_service_url("usage", path)
 
-        r = requests.delete(url)
+        r = http_client.delete(url)
         r.raise_for_status()
 
-    def get_customer_usage(self, customer, product_id, state=None):
+    def iter_customer_usage(self, customer, product_id=None, state=None):
         """
-        Retrieves the usage made by a customer filtered by service and status
+        Streams the usage made by a customer filtered by product and status. The
+        usage is requested in pages, so only one of them is kept in memory at a time
         :param customer: username of the customer
-        :param product_id: id of the acquired product being used
+        :param product_id: id of the acquired product being used, all the products if None
         :param state: state of the usage to be retrieved
-        :return: List of customer usages
+        :return: Generator of customer usages
         """
-        # Get customer usage filtered by state
-        path = "usage"
-        url = get_service_url("usage", f"{path}?relatedParty.id={customer}")
+        params = {"relatedParty.id": customer}
 
         if state is not None:
             self._validate_state(state)
-            url += "&status=" + state
+            params["status"] = state
 
-        r = requests.get(url, headers={"Accept": "application/json"})
+        if product_id is not None:
+            params["usageCharacteristic.value"] = product_id
 
-        r.raise_for_status()
+        url = get_service_url("usage", "usage")
+        page_size = getattr(settings, "USAGE_CLIENT", {}).get("page_size", 100)
+        offset = 0
+
+        while True:
+            params.update({"offset": offset, "limit": page_size})
+
+            r = http_client.get(url, params=params, headers={"Accept": "application/json"})
+            r.raise_for_status()
+
+            page = r.json()
+            for usage_doc in page:
+                # The value filter may match other characteristics, so the product is checked
+                if product_id is None or self._belongs_to_product(usage_doc, product_id):
+                    yield usage_doc
+
+            if len(page) < page_size:
+                break
 
-        raw_usage = r.json()
-        # Filter only the usage belonging to the specified product
-        return [usage_doc for usage_doc in raw_usage if self._belongs_to_product(usage_doc, product_id)]
+            offset += page_size
+
+    def get_customer_usage(self, customer, product_id, state=None):
+        """
+        Retrieves the usage made by a customer filtered by service and status
+        :param customer: username of the customer
+        :param product_id: id of the acquired product being used
+        :param state: state of the usage to be retrieved
+        :return: List of customer usages
+        """
+        return list(self.iter_customer_usage(customer, product_id=product_id, state=state))
+
+    def iter_products_usage(self, customer, product_ids, state=None):
+        """
+        Streams the usage made by a customer of several products, using a
+        listing filtered by the server for each of the products
+        :param customer: username of the customer
+        :param product_ids: ids of the acquired products being used
+        :param state: state of the usage to be retrieved
+        :return: Generator of (product id, usage) tuples
+        """
+        for product_id in dict.fromkeys(product_ids):
+            for usage_doc in self.iter_customer_usage(customer, product_id=product_id, state=state):
+                yield product_id, usage_doc
 
     def _patch_usage(self, usage_id, patch):
         path = "usage/" + str(usage_id)
         url = get_service_url("usage", path)
 
-        r = requests.patch(url, json=patch)
+        r = http_client.patch(url, json=patch)
         r.raise_for_status()
 
     def update_usage_state(self, usage_id, state):
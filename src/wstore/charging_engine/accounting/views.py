@@ -20,15 +20,21 @@
 
 
 import json
+from functools import partial
+from logging import getLogger
 
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
 
 from wstore.asset_manager.resource_plugins.decorators import on_usage_refreshed
-from wstore.charging_engine.accounting.sdr_manager import SDRManager
+from wstore.charging_engine.accounting.sdr_manager import SDRBatchManager, SDRManager
 from wstore.charging_engine.accounting.usage_client import UsageClient
 from wstore.ordering.models import Order
 from wstore.store_commons.resource import Resource
-from wstore.store_commons.utils.http import build_response, supported_request_mime_types
+from wstore.store_commons.utils.concurrency import fetch_all
+from wstore.store_commons.utils.http import JsonResponse, build_response, supported_request_mime_types
+
+logger = getLogger("wstore.default_logger")
 
 
 class ServiceRecordCollection(Resource):
@@ -73,6 +79,69 @@ class ServiceRecordCollection(Resource):
         return response
 
 
+class ServiceRecordBatchCollection(Resource):
+    def _update_usage_state(self, usage_client, result):
+        state = "guided" if result["code"] == 200 else "rejected"
+        try:
+            usage_client.update_usage_state(result["id"], state)
+        except Exception as e:
+            # The SDR has already been processed, the error is only reported in its result
+            logger.error(f"Error setting usage {result['id']} as {state}: {str(e)}")
+            result["stateError"] = f"The usage state could not be updated to {state}"
+
+    # This method is used to load a list of SDR documents at once, the
+    # result of each of them is included in the response
+    @supported_request_mime_types(("application/json",))
+    def create(self, request):
+        try:
+            data = json.loads(request.body)
+        except:
+            return build_response(request, 400, "The request does not contain a valid JSON object")
+
+        if not isinstance(data, list):
+            return build_response(request, 422, "The request must contain a list of SDR documents")
+
+        max_size = getattr(settings, "SDR_BATCH", {}).get("max_size", 500)
+        if len(data) > max_size:
+            return build_response(request, 413, f"The request cannot contain more than {max_size} SDR documents")
+
+        results = []
+        sdr_manager = SDRBatchManager()
+        for sdr in data:
+            result = {"id": sdr.get("id") if isinstance(sdr, dict) else None, "code": 200}
+
+            try:
+                sdr_manager.validate_sdr(sdr)
+            except PermissionDenied as e:
+                result.update({"code": 403, "error": str(e)})
+            except ValueError as e:
+                result.update({"code": 422, "error": str(e)})
+            except:
+                result.update(
+                    {"code": 500, "error": "The SDR document could not be processed due to an unexpected error"}
+                )
+            else:
+                sdr_manager.update_usage(result["id"])
+
+            results.append(result)
+
+        conflicts = set(sdr_manager.save())
+
+        updates = []
+        usage_client = UsageClient()
+        for result in results:
+            if result["code"] == 200 and result["id"] in conflicts:
+                # The SDR is kept as received, so it can be sent again
+                result.update({"code": 409, "error": "The usage state of the contract has been modified concurrently"})
+            elif result["id"] is not None:
+                updates.append(partial(self._update_usage_state, usage_client, result))
+
+        # The usage states are updated in parallel, errors are reported per SDR
+        fetch_all(updates)
+
+        return JsonResponse(200, results)
+
+
 class SDRRefreshCollection(Resource):
     @supported_request_mime_types(("application/json",))
     def create(self, request):
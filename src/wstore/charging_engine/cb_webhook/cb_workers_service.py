@@ -21,25 +21,57 @@
 import queue
 import time
 import threading
+import zlib
 from logging import getLogger
+from uuid import uuid4
+
 import requests
 import settings
+from pymongo.errors import OperationFailure, PyMongoError
 
 from wstore.ordering.ordering_management import OrderingManager
+from wstore.store_commons import http_client
 from wstore.store_commons.database import get_database_connection
 
 logger = getLogger("wstore.charging_engine.cb_workers_service")
 
+# Error returned by MongoDB when change streams are not supported (standalone servers)
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+# Changes that make a task available to be claimed: new tasks and tasks released for retry
+AVAILABLE_TASKS_PIPELINE = [
+    {
+        "$match": {
+            "$or": [
+                {"operationType": "insert"},
+                {"updateDescription.updatedFields.in_queue": False},
+            ]
+        }
+    }
+]
+
+
+def _get_options():
+    return getattr(settings, "CB_WEBHOOK", {})
+
 
 class CBWorkersService:
 
     def __init__(self):
         self.om = OrderingManager()
         self.workers = []
-        self.num_workers = 3
-        self.cb_queue = queue.Queue(maxsize=100)
+        self.num_workers = _get_options().get("workers", 3)
         self.db = get_database_connection()
 
+        # Each worker has its own queue. Tasks of the same order are always routed to the
+        # same worker, so they are processed serially instead of competing for the order lock
+        self.cb_queues = [queue.Queue(maxsize=100) for _ in range(self.num_workers)]
+        self.lock_retries = 0
+
+        # Set when new tasks may be available, so the carrier does not need to poll
+        self._wakeup = threading.Event()
+        self._watching = False
+
     def listen(self):
         payload = {
             "callback": f"{settings.LOCAL_SITE}charging/webhook/customerBill/notify",
@@ -48,7 +80,7 @@ class CBWorkersService:
         max_retries = 10
         for attempt in range(1, max_retries + 1):
             try:
-                result = requests.post(f"{settings.BILLING}/hub", json=payload, verify=settings.VERIFY_REQUESTS)
+                result = http_client.post(f"{settings.BILLING}/hub", json=payload, verify=settings.VERIFY_REQUESTS)
                 if result.status_code == 201 or result.status_code == 409:
                     logger.info(f"start listening to {settings.BILLING}")
                     return
@@ -59,16 +91,22 @@ class CBWorkersService:
                 time.sleep(5)
         raise RuntimeError("customerBill API is not available after 10 attempts, charging cannot start")
 
-    def _worker_loop(self):
+    def _worker_loop(self, cb_queue):
+        options = _get_options()
+
         while True:
-            task = self.cb_queue.get()
+            task = cb_queue.get()
             logger.info(f"[{threading.current_thread().name}] Processing {task['cb_id']}")
 
             result = self.om.complete_cb_webhook(task['cb_id'])
 
             if result and result.get("locked", False):
+                # The order is being processed by another process, wait before retrying
+                self.lock_retries += 1
+                time.sleep(options.get("lock_retry_delay", 0.2))
+
                 try:
-                    self.cb_queue.put_nowait(task)
+                    cb_queue.put_nowait(task)
                     logger.debug(f"[{threading.current_thread().name}] Re-enqueued {task['cb_id']} for retry")
                 except queue.Full:
                     self.db.wstore_cb_queue.update_one(
@@ -80,18 +118,132 @@ class CBWorkersService:
                 self.db.wstore_cb_queue.delete_one({"_id": task["_id"]})
                 logger.info(f"[{threading.current_thread().name}] Completed {task['cb_id']}")
 
+    def _get_order_keys(self, tasks):
+        # Orders of the claimed customer bills, retrieved with a single query
+        cb_ids = set(task["cb_id"] for task in tasks)
+        keys = {}
+
+        for order in self.db.wstore_order.find(
+            {"contracts.customer_bill.id": {"$in": list(cb_ids)}}, {"contracts.customer_bill.id": 1}
+        ):
+            for contract in order.get("contracts", []):
+                customer_bill = contract.get("customer_bill") or {}
+
+                if customer_bill.get("id") in cb_ids:
+                    keys[customer_bill["id"]] = str(order["_id"])
+
+        return keys
+
+    def _get_queue(self, key):
+        return self.cb_queues[zlib.crc32(key.encode("utf-8")) % self.num_workers]
+
+    def _route(self, tasks):
+        try:
+            keys = self._get_order_keys(tasks)
+        except PyMongoError as e:
+            logger.warning(f"Error retrieving the orders of customer bill tasks: {e}")
+            keys = {}
+
+        routed = 0
+        overflow = []
+        for task in tasks:
+            # Unknown orders are routed by customer bill, they fail anyway when processed
+            try:
+                self._get_queue(keys.get(task["cb_id"], task["cb_id"])).put_nowait(task)
+                routed += 1
+                logger.debug(f"Carrier moved {task['cb_id']} to queue")
+            except queue.Full:
+                overflow.append(task["_id"])
+
+        if len(overflow) > 0:
+            # The carrier never blocks on a full queue, the tasks are released to be claimed again
+            self.db.wstore_cb_queue.update_many({"_id": {"$in": overflow}}, {"$set": {"in_queue": False}})
+            logger.warning(f"Queue full, unmarked {len(overflow)} customer bill tasks for retry")
+
+        return routed
+
+    def _claim_batch(self, size):
+        # Tasks are claimed in bulk with a claim token instead of one find_one_and_update
+        # per task. Tasks claimed by other processes in between are not returned
+        candidates = [
+            task["_id"]
+            for task in self.db.wstore_cb_queue.find(
+                {"in_queue": {"$ne": True}}, {"_id": 1}, sort=[("_id", 1)], limit=size
+            )
+        ]
+
+        if len(candidates) == 0:
+            return []
+
+        claim = uuid4().hex
+        self.db.wstore_cb_queue.update_many(
+            {"_id": {"$in": candidates}, "in_queue": {"$ne": True}},
+            {"$set": {"in_queue": True, "claim": claim}}
+        )
+        return list(self.db.wstore_cb_queue.find({"claim": claim}, sort=[("_id", 1)]))
+
+    def _watch_loop(self):
+        options = _get_options()
+
+        while True:
+            try:
+                with self.db.wstore_cb_queue.watch(AVAILABLE_TASKS_PIPELINE) as stream:
+                    self._watching = True
+                    logger.info("Watching customer bill queue changes")
+
+                    for _ in stream:
+                        self._wakeup.set()
+
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    logger.info("Change streams not supported by the database, polling the customer bill queue")
+                    self._watching = False
+                    self._wakeup.set()
+                    return
+
+                logger.warning(f"Customer bill queue change stream failed: {e}")
+            except PyMongoError as e:
+                logger.warning(f"Customer bill queue change stream failed: {e}")
+
+            # Poll until the stream can be opened again
+            self._watching = False
+            self._wakeup.set()
+            time.sleep(options.get("max_poll_interval", 10))
+
     def _carrier_loop(self):
+        options = _get_options()
+        min_interval = options.get("min_poll_interval", 0.5)
+        max_interval = options.get("max_poll_interval", 10)
+        interval = min_interval
+
         while True:
-            task = self.db.wstore_cb_queue.find_one_and_update(
-                {"in_queue": {"$ne": True}},
-                {"$set": {"in_queue": True}},
-                sort=[("_id", 1)]
-            )
-            if task:
-                self.cb_queue.put(task)
-                logger.debug(f"Carrier moved {task['cb_id']} to queue")
+            self._wakeup.clear()
+
+            # The tasks of a batch may all be routed to the same worker, so the batch
+            # cannot be larger than the free space of the fullest queue
+            free = min(cb_queue.maxsize - cb_queue.qsize() for cb_queue in self.cb_queues)
+            if free <= 0:
+                # Wait for the workers to make room before claiming more tasks
+                time.sleep(min_interval)
+                continue
+
+            try:
+                tasks = self._claim_batch(min(free, options.get("batch_size", 20)))
+            except PyMongoError as e:
+                logger.error(f"Error claiming customer bill tasks: {e}")
+                tasks = []
+
+            if len(tasks) > 0 and self._route(tasks) > 0:
+                interval = min_interval
+                continue
+
+            if self._watching:
+                # The change stream wakes up the carrier, waiting with a timeout just
+                # in case a change is missed
+                self._wakeup.wait(options.get("watch_timeout", 60))
             else:
-                time.sleep(0.5)
+                self._wakeup.wait(interval)
+                interval = min(interval * 2, max_interval)
 
     def start(self):
         recovered = self.db.wstore_cb_queue.update_many(
@@ -101,12 +253,16 @@ class CBWorkersService:
         if recovered.modified_count > 0:
             logger.info(f"Recovered {recovered.modified_count} pending items from previous crash")
 
-        for i in range(self.num_workers):
-            worker = threading.Thread(target=self._worker_loop, name=f"CB_Worker-{i}", daemon=True)
+        for i, cb_queue in enumerate(self.cb_queues):
+            worker = threading.Thread(target=self._worker_loop, args=(cb_queue,), name=f"CB_Worker-{i}", daemon=True)
             worker.start()
             self.workers.append(worker)
             logger.info(f"Started {worker.name}")
 
+        watcher = threading.Thread(target=self._watch_loop, name="CB_Watcher", daemon=True)
+        watcher.start()
+        logger.info(f"Started {watcher.name}")
+
         carrier = threading.Thread(target=self._carrier_loop, name="CB_Carrier", daemon=True)
         carrier.start()
         logger.info(f"Started {carrier.name}")
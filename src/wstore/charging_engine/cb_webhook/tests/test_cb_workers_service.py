@@ -22,15 +22,20 @@ import queue
 from django.test import TestCase
 from mock import MagicMock, patch
 from bson import ObjectId
+from pymongo.errors import OperationFailure
 
-from wstore.charging_engine.cb_webhook.cb_workers_service import CBWorkersService
+from wstore.charging_engine.cb_webhook.cb_workers_service import (
+    AVAILABLE_TASKS_PIPELINE,
+    CHANGE_STREAM_UNSUPPORTED,
+    CBWorkersService,
+)
 
 
 class CBWorkersServiceTestCase(TestCase):
 
     @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
     @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
-    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.requests.post')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.http_client.post')
     def test_listen_registers_webhook(self, mock_post, mock_om, mock_db):
         mock_post.return_value = MagicMock(status_code=201)
 
@@ -57,9 +62,9 @@ class CBWorkersServiceTestCase(TestCase):
         service = CBWorkersService()
         task = {"_id": ObjectId(), "cb_id": "cb-12345"}
 
-        service.cb_queue.put(task)
+        service.cb_queues[0].put(task)
 
-        task_result = service.cb_queue.get()
+        task_result = service.cb_queues[0].get()
         result = service.om.complete_cb_webhook(task_result['cb_id'])
 
         if not (result and result.get("locked", False)):
@@ -78,9 +83,9 @@ class CBWorkersServiceTestCase(TestCase):
         service = CBWorkersService()
         task = {"_id": ObjectId(), "cb_id": "cb-12345"}
 
-        service.cb_queue.put(task)
+        service.cb_queues[0].put(task)
 
-        task_result = service.cb_queue.get()
+        task_result = service.cb_queues[0].get()
         result = service.om.complete_cb_webhook(task_result['cb_id'])
 
         self.assertEqual(result, {"locked": True})
@@ -123,3 +128,185 @@ class CBWorkersServiceTestCase(TestCase):
 
         self.assertIsNotNone(result)
         self.assertEqual(result["cb_id"], "cb-12345")
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.uuid4')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_claim_batch(self, mock_om, mock_db, mock_uuid):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+        mock_uuid.return_value.hex = "claim-1"
+
+        ids = [ObjectId(), ObjectId()]
+        tasks = [{"_id": ids[0], "cb_id": "cb-1"}, {"_id": ids[1], "cb_id": "cb-2"}]
+        mock_db_instance.wstore_cb_queue.find.side_effect = [[{"_id": ids[0]}, {"_id": ids[1]}], tasks]
+
+        service = CBWorkersService()
+        result = service._claim_batch(10)
+
+        self.assertEqual(result, tasks)
+        mock_db_instance.wstore_cb_queue.find.assert_any_call(
+            {"in_queue": {"$ne": True}}, {"_id": 1}, sort=[("_id", 1)], limit=10
+        )
+        mock_db_instance.wstore_cb_queue.update_many.assert_called_once_with(
+            {"_id": {"$in": ids}, "in_queue": {"$ne": True}},
+            {"$set": {"in_queue": True, "claim": "claim-1"}}
+        )
+        mock_db_instance.wstore_cb_queue.find.assert_called_with({"claim": "claim-1"}, sort=[("_id", 1)])
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_claim_batch_empty(self, mock_om, mock_db):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+        mock_db_instance.wstore_cb_queue.find.return_value = []
+
+        service = CBWorkersService()
+
+        self.assertEqual(service._claim_batch(10), [])
+        mock_db_instance.wstore_cb_queue.update_many.assert_not_called()
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_watch_wakes_up_carrier(self, mock_om, mock_db):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+
+        service = CBWorkersService()
+
+        stream = MagicMock()
+        stream.__iter__.side_effect = lambda: self._changes(service)
+        mock_db_instance.wstore_cb_queue.watch.return_value.__enter__.return_value = stream
+
+        # The loop is stopped with an error not handled by the service
+        with self.assertRaises(KeyboardInterrupt):
+            service._watch_loop()
+
+        self.assertTrue(service._wakeup.is_set())
+        mock_db_instance.wstore_cb_queue.watch.assert_called_once_with(AVAILABLE_TASKS_PIPELINE)
+
+    def _changes(self, service):
+        self.assertTrue(service._watching)
+        yield {"operationType": "insert"}
+        raise KeyboardInterrupt()
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_watch_not_supported(self, mock_om, mock_db):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+        mock_db_instance.wstore_cb_queue.watch.side_effect = OperationFailure(
+            "The $changeStream stage is only supported on replica sets", code=CHANGE_STREAM_UNSUPPORTED
+        )
+
+        service = CBWorkersService()
+        service._watch_loop()
+
+        self.assertFalse(service._watching)
+        self.assertTrue(service._wakeup.is_set())
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_route_tasks_by_order(self, mock_om, mock_db):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+
+        orders = [ObjectId() for _ in range(20)]
+        tasks = [{"_id": ObjectId(), "cb_id": f"cb-{i}"} for i in range(60)]
+        mock_db_instance.wstore_order.find.return_value = [
+            {
+                "_id": order,
+                "contracts": [
+                    {"customer_bill": {"id": f"cb-{i}"}} for i in range(j, 60, 20)
+                ] + [{"customer_bill": None}]
+            }
+            for j, order in enumerate(orders)
+        ]
+
+        service = CBWorkersService()
+        service._route(tasks)
+
+        mock_db_instance.wstore_order.find.assert_called_once()
+        self.assertEqual(
+            set(task["cb_id"] for task in tasks),
+            set(mock_db_instance.wstore_order.find.call_args[0][0]["contracts.customer_bill.id"]["$in"]),
+        )
+
+        # Tasks of the same order are in the same queue in arrival order
+        routed = {}
+        for index, cb_queue in enumerate(service.cb_queues):
+            while not cb_queue.empty():
+                routed.setdefault(index, []).append(cb_queue.get()["cb_id"])
+
+        self.assertEqual(60, sum(len(cb_ids) for cb_ids in routed.values()))
+        self.assertTrue(len(routed) > 1)
+
+        for j in range(20):
+            cb_ids = [f"cb-{i}" for i in range(j, 60, 20)]
+            queues = [index for index, routed_ids in routed.items() if cb_ids[0] in routed_ids]
+            self.assertEqual(cb_ids, [cb_id for cb_id in routed[queues[0]] if cb_id in cb_ids])
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_route_unknown_order(self, mock_om, mock_db):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+        mock_db_instance.wstore_order.find.return_value = []
+
+        service = CBWorkersService()
+        task = {"_id": ObjectId(), "cb_id": "cb-12345"}
+        service._route([task])
+
+        self.assertEqual(task, service._get_queue("cb-12345").get_nowait())
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_route_queue_full(self, mock_om, mock_db):
+        mock_db_instance = MagicMock()
+        mock_db.return_value = mock_db_instance
+        mock_db_instance.wstore_order.find.return_value = []
+
+        service = CBWorkersService()
+        cb_queue = service._get_queue("cb-12345")
+        for _ in range(cb_queue.maxsize - 1):
+            cb_queue.put_nowait({})
+
+        tasks = [{"_id": ObjectId(), "cb_id": "cb-12345"} for _ in range(3)]
+        routed = service._route(tasks)
+
+        # The tasks that do not fit are released instead of blocking the carrier
+        self.assertEqual(1, routed)
+        mock_db_instance.wstore_cb_queue.update_many.assert_called_once_with(
+            {"_id": {"$in": [tasks[1]["_id"], tasks[2]["_id"]]}}, {"$set": {"in_queue": False}}
+        )
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_carrier_claim_size(self, mock_om, mock_db):
+        service = CBWorkersService()
+        for _ in range(95):
+            service.cb_queues[0].put_nowait({})
+
+        service._claim_batch = MagicMock(side_effect=StopIteration)
+
+        with self.assertRaises(StopIteration):
+            service._carrier_loop()
+
+        # The claim fits in the fullest queue
+        service._claim_batch.assert_called_once_with(5)
+
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.time.sleep')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.get_database_connection')
+    @patch('wstore.charging_engine.cb_webhook.cb_workers_service.OrderingManager')
+    def test_carrier_queue_full(self, mock_om, mock_db, mock_sleep):
+        service = CBWorkersService()
+        while not service.cb_queues[0].full():
+            service.cb_queues[0].put_nowait({})
+
+        service._claim_batch = MagicMock()
+        mock_sleep.side_effect = StopIteration
+
+        with self.assertRaises(StopIteration):
+            service._carrier_loop()
+
+        service._claim_batch.assert_not_called()
@@ -22,17 +22,25 @@
 
 import requests
 import datetime
+import uuid
 
 from decimal import Decimal
+from functools import partial
 from logging import getLogger
 
 from django.conf import settings
+from wstore.store_commons import http_client
 from wstore.store_commons.utils.url import get_service_url
+from wstore.store_commons.utils.concurrency import fetch_all
 from wstore.store_commons.utils.party import get_operator_party_roles, normalize_party_ref
 
 
 logger = getLogger("wstore.default_logger")
 
+# Header used to identify write requests, so the billing API can discard retries
+# of a request already processed instead of creating a duplicated resource
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
 class BillingClient:
     def __init__(self):
         pass
@@ -40,7 +48,7 @@ class BillingClient:
     def get_billing_account(self, account_id):
         url = get_service_url("account", f"billingAccount/{account_id}")
 
-        response = requests.get(url, verify=settings.VERIFY_REQUESTS)
+        response = http_client.get(url, verify=settings.VERIFY_REQUESTS)
         response.raise_for_status()
 
         return response.json()
@@ -57,12 +65,55 @@ class BillingClient:
         url = get_service_url("billing", f"appliedCustomerBillingRate/{rate_id}")
 
         try:
-            response = requests.patch(url, json=data, verify=settings.VERIFY_REQUESTS)
+            response = http_client.patch(url, json=data, verify=settings.VERIFY_REQUESTS)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.error("Error updating customer rate: " + str(e))
             raise
 
+    def _send_write(self, method, url, data, idempotency_key):
+        """
+        Sends a write request to the billing API, retrying it with the same idempotency
+        key up to HTTP_CLIENT_OPTIONS["write_retries"] times. PATCH requests are retried on
+        connection errors and server errors, while POST requests, which would duplicate the
+        resource if the failed attempt was processed, are only retried when the connection
+        could not be established
+        """
+        retries = getattr(settings, "HTTP_CLIENT_OPTIONS", {}).get("write_retries", 2)
+        attempt = 0
+
+        while True:
+            try:
+                response = getattr(http_client, method)(
+                    url, json=data, headers={IDEMPOTENCY_HEADER: idempotency_key}, verify=settings.VERIFY_REQUESTS
+                )
+                response.raise_for_status()
+                return response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+                if method == "post":
+                    # Only a connect timeout guarantees the request was not sent
+                    retryable = isinstance(e, requests.exceptions.ConnectTimeout)
+                else:
+                    retryable = not isinstance(e, requests.exceptions.HTTPError) or (
+                        e.response is not None and e.response.status_code >= 500
+                    )
+
+                if not retryable or attempt >= retries:
+                    raise
+
+                attempt += 1
+                logger.warning(f"Retrying {method} {url} ({attempt}/{retries}): {str(e)}")
+
+    def _set_acbr_cb(self, acbr, data, patched):
+        url = get_service_url("billing", f"appliedCustomerBillingRate/{acbr['id']}")
+        try:
+            self._send_write("patch", url, data, str(uuid.uuid4()))
+        except requests.exceptions.HTTPError as e:
+            logger.error("Error updating customer rate: " + str(e))
+            raise
+
+        patched.append(acbr["id"])
+
     def set_acbrs_cb(self, batch_acbr, customer_bill_id):
 
         data = {
@@ -72,17 +123,26 @@ class BillingClient:
                 "href": customer_bill_id
             }
         }
-        # TODO: rollback for acbrs in case an error appears or some way to make it transactional
-        for acbr in batch_acbr:
-            url = get_service_url("billing", f"appliedCustomerBillingRate/{acbr['id']}")
-            try:
-                response = requests.patch(url, json=data, verify=settings.VERIFY_REQUESTS)
-                response.raise_for_status()
-            except requests.exceptions.HTTPError as e:
-                logger.error("Error updating customer rate: " + str(e))
-                raise
 
-    def create_customer_rate(self, name, description, rate_type, currency, tax_rate, tax, tax_included, tax_excluded, billing_account, product_id, coverage_period=None, party=[], message= None):
+        # The rates are updated in parallel, if any of them fails the ones already
+        # updated are set as not billed again, removing the reference to the bill.
+        # The updates in progress are waited for, so all the updated rates are known
+        patched = []
+        try:
+            fetch_all([partial(self._set_acbr_cb, acbr, data, patched) for acbr in batch_acbr], wait_started=True)
+        except Exception:
+            for rate_id in patched:
+                url = get_service_url("billing", f"appliedCustomerBillingRate/{rate_id}")
+                try:
+                    response = http_client.patch(
+                        url, json={"isBilled": False, "bill": None}, verify=settings.VERIFY_REQUESTS
+                    )
+                    response.raise_for_status()
+                except Exception as e:
+                    logger.error(f"Error reverting customer rate {rate_id}: {str(e)}")
+            raise
+
+    def create_customer_rate(self, name, description, rate_type, currency, tax_rate, tax, tax_included, tax_excluded, billing_account, product_id, coverage_period=None, party=[], message= None, idempotency_key=None):
         raw_rate = Decimal(str(tax_rate))
         decimal_rate = raw_rate / Decimal("100") if raw_rate > Decimal("1") else raw_rate
         data = {
@@ -125,17 +185,33 @@ class BillingClient:
 
         url = get_service_url("billing", "appliedCustomerBillingRate")
 
+        if idempotency_key is None:
+            idempotency_key = str(uuid.uuid4())
+
         try:
-            response = requests.post(url, json=data, verify=settings.VERIFY_REQUESTS)
-            response.raise_for_status()
+            response = self._send_write("post", url, data, idempotency_key)
         except requests.exceptions.HTTPError as e:
             logger.error("Error creating customer rate: " + str(e))
             raise
 
         return response.json()
 
+    def _create_tracked_rate(self, created, **kwargs):
+        new_rate = self.create_customer_rate(**kwargs)
+        created.append(new_rate)
+        return new_rate
+
+    def delete_customer_rates(self, rates):
+        for rate in rates:
+            url = get_service_url("billing", f"appliedCustomerBillingRate/{rate['id']}")
+            try:
+                response = http_client.delete(url, verify=settings.VERIFY_REQUESTS)
+                response.raise_for_status()
+            except Exception as e:
+                logger.error(f"Error deleting customer rate {rate['id']}: {str(e)}")
+
     def create_batch_customer_rates(self, acbr_models, party, product, message=None):
-        created_rates = []
+        rates = []
         recurring = False
         for acbr_model in acbr_models:
             rate_type = acbr_model.get("appliedBillingRateType") or acbr_model["type"] # error if rate["type"] is called and it doesn't exist
@@ -146,21 +222,32 @@ class BillingClient:
                 recurring = True
                 continue
 
-            currency = acbr_model["taxIncludedAmount"]["unit"]
-            tax_rate = acbr_model["appliedTax"][0]["taxRate"]
-            tax = acbr_model["appliedTax"][0]["taxAmount"]["value"]
-            tax_included = acbr_model["taxIncludedAmount"]["value"]
-            tax_excluded = acbr_model["taxExcludedAmount"]["value"]
-            billing_account = acbr_model["billingAccount"]
-
-            coverage_period = acbr_model["periodCoverage"] if "periodCoverage" in acbr_model else None
-
-            new_rate = self.create_customer_rate(
-                acbr_model["name"], acbr_model["description"],
-                rate_type, currency, tax_rate, tax, tax_included, tax_excluded,
-                billing_account, product["id"], coverage_period=coverage_period, party=party, message= message)
-
-            created_rates.append(new_rate)
+            rates.append({
+                "name": acbr_model["name"],
+                "description": acbr_model["description"],
+                "rate_type": rate_type,
+                "currency": acbr_model["taxIncludedAmount"]["unit"],
+                "tax_rate": acbr_model["appliedTax"][0]["taxRate"],
+                "tax": acbr_model["appliedTax"][0]["taxAmount"]["value"],
+                "tax_included": acbr_model["taxIncludedAmount"]["value"],
+                "tax_excluded": acbr_model["taxExcludedAmount"]["value"],
+                "billing_account": acbr_model["billingAccount"],
+                "product_id": product["id"],
+                "coverage_period": acbr_model["periodCoverage"] if "periodCoverage" in acbr_model else None,
+                "party": party,
+                "message": message,
+                # The key is kept for the retries of the rate
+                "idempotency_key": str(uuid.uuid4()),
+            })
+
+        # The rates are created in parallel, if any of them fails the ones
+        # already created are removed so the batch is not partially written
+        created = []
+        try:
+            created_rates = fetch_all([partial(self._create_tracked_rate, created, **rate) for rate in rates])
+        except Exception:
+            self.delete_customer_rates(created)
+            raise
 
         logger.info('--BATCH RATES-- %s, recurring payment %s', created_rates, recurring)
 
@@ -222,7 +309,12 @@ class BillingClient:
             return {}
 
         created_cb = self._create_cb_api(cb_model)
-        self.set_acbrs_cb(created_acbrs, created_cb["id"])
+        try:
+            self.set_acbrs_cb(created_acbrs, created_cb["id"])
+        except Exception:
+            # The bill has no rates, so it is removed
+            self.delete_customer_bill(created_cb["id"])
+            raise
 
         cb = {}
         cb["id"] = created_cb["id"]
@@ -233,6 +325,14 @@ class BillingClient:
         logger.info("---CUSTOMER BILL EXTRA DATA--- %s", cb)
         return cb
 
+    def delete_customer_bill(self, bill_id):
+        url = get_service_url("billing", f"customerBill/{bill_id}")
+        try:
+            response = http_client.delete(url, verify=settings.VERIFY_REQUESTS)
+            response.raise_for_status()
+        except Exception as e:
+            logger.error(f"Error deleting customer bill {bill_id}: {str(e)}")
+
     def set_customer_bill(self, state, billId):
         logger.info("set_customer_bill")
         if state not in ["new", "sent", "partiallySettled", "settled"]:
@@ -243,7 +343,7 @@ class BillingClient:
         url = get_service_url("billing", f"customerBill/{billId}")
 
         try:
-            response = requests.patch(url, json=data, verify=settings.VERIFY_REQUESTS)
+            response = http_client.patch(url, json=data, verify=settings.VERIFY_REQUESTS)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.error("Error patching customer bill: " + str(e) + " data:" + str(data))
@@ -254,7 +354,7 @@ class BillingClient:
         url = get_service_url("billing", "customerBill")
 
         try:
-            response = requests.post(url, json=cb_model, verify=settings.VERIFY_REQUESTS)
+            response = http_client.post(url, json=cb_model, verify=settings.VERIFY_REQUESTS)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.error("Error creating customer bill: " + str(e))
@@ -56,20 +56,28 @@ class CDRManager(object):
             "order": order.order_id + " " + contract.item_id,
         }
 
-    def _generate_cdr_part(self, part, event, description):
+    def _allocate_correlation_numbers(self, count):
         # Create connection for raw database access
         db = get_database_connection()
 
-        # Take and increment the correlation number using
-        # the mongoDB atomic access in order to avoid race
-        # problems
-        corr_number = db.wstore_organization.find_and_modify(
-            query={"_id": self._offering.owner_organization.pk},
-            update={"$inc": {"correlation_number": 1}},
+        # Reserve a contiguous range of correlation numbers for all the CDRs
+        # with a single atomic increment, in order to avoid race problems
+        first = db.wstore_organization.find_one_and_update(
+            {"_id": self._offering.owner_organization.pk},
+            {"$inc": {"correlation_number": count}},
         )["correlation_number"]
 
+        return range(first, first + count)
+
+    def _set_correlation_numbers(self, cdrs):
+        if len(cdrs) == 0:
+            return
+
+        for cdr, corr_number in zip(cdrs, self._allocate_correlation_numbers(len(cdrs))):
+            cdr["correlation"] = str(corr_number)
+
+    def _generate_cdr_part(self, part, event, description):
         cdr_part = {
-            "correlation": str(corr_number),
             "cost_value": str(part["value"]),
             "tax_value": str(Decimal(part["value"]) - Decimal(part["duty_free"])),
             "event": event,
@@ -122,6 +130,8 @@ class CDRManager(object):
 
                 cdrs.append(self._generate_cdr_part(use_part, "Pay per use event", description))
 
+        self._set_correlation_numbers(cdrs)
+
         # Send the created CDRs to the Revenue Sharing System
         r = RSSAdaptorThread(cdrs)
         r.start()
@@ -138,6 +148,7 @@ class CDRManager(object):
 
         description = "Refund event: " + str(price) + " " + self._cdr_info["cost_currency"]
         cdrs = [self._generate_cdr_part(aggregated_part, "Refund event", description)]
+        self._set_correlation_numbers(cdrs)
 
         # Send the created CDRs to the Revenue Sharing System
         r = RSSAdaptorThread(cdrs)
@@ -18,7 +18,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import requests
 import json
 from datetime import datetime, timezone
 
@@ -28,6 +27,7 @@ from wstore.charging_engine.pricing_engine import PriceEngine
 
 from wstore.charging_engine.engines.engine import Engine
 from wstore.ordering.inventory_client import InventoryClient
+from wstore.store_commons import http_client
 
 
 logger = getLogger("wstore.default_logger")
@@ -87,7 +87,7 @@ class DomeEngine(Engine):
         url = settings.DOME_BILLING_URL + "/billing/instantBill"
 
         logger.debug({"product": product, "date": start_date})
-        resp = requests.post(url, json={"product": product, "date": start_date})
+        resp = http_client.post(url, json={"product": product, "date": start_date})
         resp.raise_for_status()
         instant = resp.json()
         acbrs = instant[0]["acbrs"]
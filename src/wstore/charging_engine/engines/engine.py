@@ -21,6 +21,7 @@
 import uuid
 import requests
 import json
+from functools import partial
 
 from django.db.utils import DatabaseError
 from django.conf import settings
@@ -30,6 +31,7 @@ from wstore.charging_engine.payment_client.payment_client import PaymentClient
 from wstore.charging_engine.charging.billing_client import BillingClient
 from wstore.ordering.inventory_client import InventoryClient
 from wstore.ordering.models import Order
+from wstore.store_commons.utils.concurrency import fetch_all
 
 logger = getLogger("wstore.default_logger")
 
@@ -37,11 +39,6 @@ class Engine:
     def __init__(self, order: Order):
         self._order = order
 
-    def _get_item(self, item_id, raw_order):
-        items = [item for item in raw_order["productOrderItem"] if item["id"] == item_id]
-
-        return items[0] if items else None
-
     def end_charging(self, transactions, free_contracts, concept):
         # set the order as paid
         # Update renovation dates
@@ -51,69 +48,127 @@ class Engine:
     def execute_billing(self, item, raw_order):
         pass
 
+    def _index_items(self, raw_order):
+        # If an item id is repeated the first item is used
+        items = {}
+        for item in raw_order["productOrderItem"]:
+            items.setdefault(item["id"], item)
+
+        return items
+
+    def _process_contract(self, contract, item, raw_order, related_contract, created):
+        """
+        Creates the inventory product, the ACBRs and the customer bill of a contract. The
+        contract is not modified, the values to be set are returned so they are only applied
+        when all the contracts of the order have been processed. The created resources are
+        registered in created so they can be rolled back if the order fails
+        """
+        billing_client = BillingClient()
+        inventory_client = InventoryClient()
+
+        logger.debug(f"contract: {contract.product_id}")
+
+        acbr_models, cb_model, product_model = self.execute_billing(item, raw_order)
+
+        # attributes that needs to be set after the payments
+        result = {
+            "prd_after_paid": {"product_price": product_model.pop("productPrice", []), "product_characteristic": product_model.pop("productCharacteristic", [])},
+            "transaction": None,
+        }
+
+        # TODO: reset product to created and before this method, terminate cb and acbrs (I think it is not needed based on what Stefania said in dc).
+        if related_contract is None:
+            created_product = inventory_client.create_product(product_model)
+            created["products"].append(created_product["id"])
+        else:
+            created_product = inventory_client.get_product(contract.product_id)
+
+        result["product_id"] = created_product["id"]
+
+        if len(acbr_models) > 0:
+            logger.info("Received acbr models " + json.dumps(acbr_models))
+            logger.info("Received cb models " + json.dumps(cb_model))
+
+            seller_id = None
+            curated_party = created_product["relatedParty"]
+            for party in curated_party:
+                if party.get("role", "").lower() == "seller":
+                    seller_id = party["id"]
+
+            logger.info("creating acbrs")
+            # Create the Billing rates as not billed
+
+            #TODO: if related_contract exists, set another name in acbrs.
+            message = None if related_contract is None else "INITIAL MODIFICATION PAYMENT"
+            created_acbrs, recurring = billing_client.create_batch_customer_rates(acbr_models, curated_party, created_product, message)
+            created["rates"].extend(created_acbrs)
+
+            # created_cb is {} if there is no billable rates
+            logger.info("creating customer bills")
+            created_cb = billing_client.create_customer_bill(created_acbrs, cb_model)
+            if "id" not in created_cb:
+                created_cb["id"] = str(uuid.uuid4())
+                created_cb["internal"] = True
+            else:
+                created["bills"].append(created_cb["id"])
+
+            result["applied_rates"] = [ n_rate["id"] for n_rate in created_acbrs ]
+            result["customer_bill"] = created_cb
+
+            result["transaction"] = {
+                "item": contract.item_id,
+                "provider": seller_id,
+                "billId": created_cb["id"],
+                "price": created_cb.get("taxIncludedAmount", 0),
+                "duty_free": created_cb.get("taxExcludedAmount", 0),
+                "description": '',
+                "currency": created_cb.get("unit", "EUR"),
+                "recurring": recurring, # related_model is not used apart from local_engine_v1 so we can replace it with recurring: Boolean
+            }
+
+        return result
+
+    def _rollback_contracts(self, created):
+        # Resources created for an order whose charging failed will never be paid
+        billing_client = BillingClient()
+        for bill_id in created["bills"]:
+            billing_client.delete_customer_bill(bill_id)
+
+        billing_client.delete_customer_rates(created["rates"])
+
+        inventory_client = InventoryClient()
+        for product_id in created["products"]:
+            try:
+                inventory_client.patch_product(product_id, {"status": "terminated"})
+            except Exception as e:
+                logger.error(f"Error rolling back product {product_id}: {str(e)}")
+
     def process_initial_charging(self, raw_order, related_contract= None):
         try:
-            # The billing engine processes the products one by one
+            # The contracts are processed in parallel, but they are only updated once
+            # all of them have been processed, so a failure leaves them untouched
             transactions = []
-            billing_client = BillingClient()
-            inventory_client = InventoryClient()
             contracts = self._order.contracts if related_contract is None else related_contract
-            for contract in contracts:
-
-                logger.debug(f"contract: {contract.product_id}")
-
-                # TODO: In the future I will transform this _get_item that is O(n^2) to a hashmap o Dict in this case that is O(1) complexity
-                item = self._get_item(contract.item_id, raw_order)
-
-                acbr_models, cb_model, product_model = self.execute_billing(item, raw_order)
-                logger.info("triple s")
-                # attributes that needs to be set after the payments
-                contract.prd_after_paid = {"product_price": product_model.pop("productPrice", []), "product_characteristic": product_model.pop("productCharacteristic", [])}
-                # TODO: reset product to created and before this method, terminate cb and acbrs (I think it is not needed based on what Stefania said in dc).
-                created_product = inventory_client.create_product(product_model) if related_contract is None else inventory_client.get_product(contract.product_id)
-                contract.product_id = created_product["id"]
-
-                if len(acbr_models) > 0:
-                    logger.info("Received acbr models " + json.dumps(acbr_models))
-                    logger.info("Received cb models " + json.dumps(cb_model))
-
-                    seller_id = None
-                    curated_party = created_product["relatedParty"]
-                    for party in curated_party:
-                        if party.get("role", "").lower() == "seller":
-                            seller_id = party["id"]
-
-
-                    logger.info("setting curated party")
-
-                    logger.info("creating acbrs")
-                    # Create the Billing rates as not billed
-
-                    #TODO: if related_contract exists, set another name in acbrs.
-                    message = None if related_contract is None else "INITIAL MODIFICATION PAYMENT"
-                    created_acbrs, recurring = billing_client.create_batch_customer_rates(acbr_models, curated_party, created_product, message)
-
-                    # created_cb is {} if there is no billable rates
-                    logger.info("creating customer bills")
-                    created_cb = billing_client.create_customer_bill(created_acbrs, cb_model)
-                    if "id" not in created_cb:
-                        created_cb["id"] = str(uuid.uuid4())
-                        created_cb["internal"] = True
-
-                    contract.applied_rates = [ n_rate["id"] for n_rate in created_acbrs ]
-                    contract.customer_bill = created_cb
-
-                    transactions.append({
-                        "item": contract.item_id,
-                        "provider": seller_id,
-                        "billId": created_cb["id"],
-                        "price": created_cb.get("taxIncludedAmount", 0),
-                        "duty_free": created_cb.get("taxExcludedAmount", 0),
-                        "description": '',
-                        "currency": created_cb.get("unit", "EUR"),
-                        "recurring": recurring, # related_model is not used apart from local_engine_v1 so we can replace it with recurring: Boolean
-                    })
+            items = self._index_items(raw_order)
+            created = {"products": [], "rates": [], "bills": []}
+
+            try:
+                results = fetch_all([
+                    partial(self._process_contract, contract, items.get(contract.item_id), raw_order, related_contract, created)
+                    for contract in contracts
+                ])
+            except Exception:
+                self._rollback_contracts(created)
+                raise
+
+            for contract, result in zip(contracts, results):
+                contract.prd_after_paid = result["prd_after_paid"]
+                contract.product_id = result["product_id"]
 
+                if result["transaction"] is not None:
+                    contract.applied_rates = result["applied_rates"]
+                    contract.customer_bill = result["customer_bill"]
+                    transactions.append(result["transaction"])
 
             if len(transactions) == 0:
                 logger.info("No transactions to process")
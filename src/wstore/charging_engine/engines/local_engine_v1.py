@@ -454,21 +454,21 @@ class LocalEngineV1:
         logger.info(f"Resolving usage charges for order {self._order.order_id}")
 
         transactions = []
-        usage_client = UsageClient()
-        for contract in contracts:
-            logger.debug(f"Appending transactions for contract {contract.item_id}")
-            if "pay_per_use" not in contract.pricing_model:
-                continue
+        usage_contracts = [contract for contract in contracts if "pay_per_use" in contract.pricing_model]
+
+        # The usage of each product is retrieved filtered by the server and
+        # grouped by product as it is streamed
+        usage = {contract.product_id: [] for contract in usage_contracts}
+        for product_id, usage_document in UsageClient().iter_products_usage(
+            self._order.owner_organization.name, list(usage), state="Guided"
+        ):
+            usage[product_id].extend(self._parse_raw_accounting([usage_document]))
 
+        for contract in usage_contracts:
+            logger.debug(f"Appending transactions for contract {contract.item_id}")
             related_model = {"pay_per_use": contract.pricing_model["pay_per_use"]}
 
-            accounting = self._parse_raw_accounting(
-                usage_client.get_customer_usage(
-                    self._order.owner_organization.name,
-                    contract.product_id,
-                    state="Guided",
-                )
-            )
+            accounting = usage[contract.product_id]
 
             if (
                 "alteration" in contract.pricing_model
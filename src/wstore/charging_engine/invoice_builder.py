@@ -18,18 +18,18 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import codecs
 import os
-import subprocess
 from copy import deepcopy
 from datetime import datetime
 from decimal import Decimal
 from logging import getLogger
+from uuid import uuid4
 
 from bson.objectid import ObjectId
 from django.conf import settings
 from django.template import Context, loader
 
+from wstore.charging_engine.invoice_renderer import enqueue_invoice
 from wstore.ordering.models import Offering
 
 logger = getLogger("wstore.default_logger")
@@ -196,15 +196,6 @@ class InvoiceBuilder:
         else:
             context["deduction"] = False
 
-    def _avoid_existing_name(self, name, ix):
-        new_name = name + "_" + str(ix) + ".pdf"
-        path = os.path.join(settings.BILL_ROOT, new_name)
-
-        if os.path.exists(path):
-            path, new_name = self._avoid_existing_name(name, ix + 1)
-
-        return path, new_name
-
     def generate_invoice(self, contract, transaction, type_):
         """
         Create a PDF invoice based on the price components used to charge the user
@@ -259,24 +250,13 @@ class InvoiceBuilder:
         # Render the invoice template
         bill_code = bill_template.render(Context(context))
 
-        # Create the bill code file
+        # The PDF file is compiled in background, its name is unique so the
+        # returned URL is valid as soon as the invoice is available
         invoice_id = str(self._order.pk) + "_" + contract.item_id + "_" + date
-        raw_invoice_path = os.path.join(settings.BILL_ROOT, invoice_id + ".html")
-
-        f = codecs.open(raw_invoice_path, "wb", "utf-8")
-        f.write(bill_code)
-        f.close()
-
-        invoice_path, invoice_name = self._avoid_existing_name(invoice_id, 0)
-
-        # Compile the bill file
-        subprocess.call([settings.BASEDIR + "/create_invoice.sh", raw_invoice_path, invoice_path])
+        invoice_name = invoice_id + "_" + uuid4().hex + ".pdf"
 
-        # Remove temporal files
-        for file_ in os.listdir(settings.BILL_ROOT):
-            if not file_.endswith(".pdf"):
-                os.remove(os.path.join(settings.BILL_ROOT, file_))
+        enqueue_invoice(bill_code, invoice_name)
 
-        logger.info(f"Invoice {invoice_id} created at {invoice_path}")
+        logger.info(f"Invoice {invoice_id} queued as {invoice_name}")
 
         return os.path.join(settings.MEDIA_URL, "bills/" + invoice_name)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import codecs
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+
+from django.conf import settings
+from pymongo import ReturnDocument
+
+from wstore.store_commons.database import get_database_connection
+
+logger = getLogger("wstore.default_logger")
+
+# Invoices are rendered to HTML when the customer is charged and stored in this
+# collection, the PDF files are generated afterwards by the InvoiceRenderer workers
+JOBS_COLLECTION = "wstore_invoice_job"
+
+PENDING = "pending"
+RENDERING = "rendering"
+FAILED = "failed"
+
+SCRATCH_DIR = ".scratch"
+
+_wakeup = threading.Event()
+
+
+def _get_options():
+    return getattr(settings, "INVOICE_RENDERER", {})
+
+
+def enqueue_invoice(bill_code, invoice_name):
+    """
+    Stores a rendered invoice to be compiled as BILL_ROOT/invoice_name by the background workers
+    """
+    now = datetime.now(timezone.utc)
+    get_database_connection()[JOBS_COLLECTION].insert_one(
+        {
+            "name": invoice_name,
+            "html": bill_code,
+            "state": PENDING,
+            "attempts": 0,
+            "next_attempt": now,
+            "created_at": now,
+        }
+    )
+
+    _wakeup.set()
+
+
+def is_invoice_pending(invoice_name):
+    """
+    Returns whether the given invoice is still to be generated
+    """
+    job = get_database_connection()[JOBS_COLLECTION].find_one({"name": invoice_name, "state": {"$ne": FAILED}})
+    return job is not None
+
+
+class InvoiceRenderer:
+    """
+    Bounded pool of threads compiling the pending invoices into PDF files.
+    Every job is compiled in its own scratch directory and moved to BILL_ROOT
+    once complete, so concurrent jobs (of this or other processes) never see
+    partial files of each other
+    """
+
+    def __init__(self):
+        self._db = get_database_connection()
+        self._workers = []
+
+    def _claim(self):
+        return self._db[JOBS_COLLECTION].find_one_and_update(
+            {"state": PENDING, "next_attempt": {"$lte": datetime.now(timezone.utc)}},
+            {"$set": {"state": RENDERING, "claimed_at": datetime.now(timezone.utc)}},
+            sort=[("next_attempt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _compile(self, job):
+        scratch_root = os.path.join(settings.BILL_ROOT, SCRATCH_DIR)
+        os.makedirs(scratch_root, exist_ok=True)
+
+        # The scratch directory is in the same file system as BILL_ROOT so the
+        # final PDF can be moved atomically
+        scratch = tempfile.mkdtemp(prefix="invoice_", dir=scratch_root)
+        try:
+            raw_invoice_path = os.path.join(scratch, "invoice.html")
+            pdf_path = os.path.join(scratch, "invoice.pdf")
+
+            with codecs.open(raw_invoice_path, "wb", "utf-8") as f:
+                f.write(job["html"])
+
+            # wkhtmltopdf may return an error code for missing resources even if
+            # the PDF has been generated, so the file is checked instead
+            subprocess.run(
+                [settings.BASEDIR + "/create_invoice.sh", raw_invoice_path, pdf_path],
+                timeout=_get_options().get("render_timeout", 120),
+            )
+
+            if not os.path.exists(pdf_path):
+                raise ValueError("The PDF file has not been generated")
+
+            os.replace(pdf_path, os.path.join(settings.BILL_ROOT, job["name"]))
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def _retry_later(self, job, error):
+        options = _get_options()
+        attempts = job["attempts"] + 1
+
+        update = {"attempts": attempts, "last_error": str(error), "state": PENDING}
+        if attempts >= options.get("max_attempts", 5):
+            logger.error(f"Giving up generating invoice {job['name']}: {error}")
+            update["state"] = FAILED
+        else:
+            delay = options.get("retry_delay", 60) * attempts
+            update["next_attempt"] = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            logger.warning(f"Error generating invoice {job['name']}, retrying in {delay}s: {error}")
+
+        self._db[JOBS_COLLECTION].update_one({"_id": job["_id"]}, {"$set": update})
+
+    def process_job(self):
+        """
+        Compiles a pending invoice. Returns False if there were no invoices to be processed
+        """
+        job = self._claim()
+        if job is None:
+            return False
+
+        try:
+            self._compile(job)
+        except Exception as e:
+            self._retry_later(job, e)
+        else:
+            self._db[JOBS_COLLECTION].delete_one({"_id": job["_id"]})
+            logger.info(f"Invoice {job['name']} created")
+
+        return True
+
+    def recover(self):
+        # Invoices claimed long ago were being compiled by a process that stopped
+        stale = datetime.now(timezone.utc) - timedelta(seconds=_get_options().get("claim_timeout", 600))
+        recovered = self._db[JOBS_COLLECTION].update_many(
+            {"state": RENDERING, "claimed_at": {"$lt": stale}}, {"$set": {"state": PENDING}}
+        )
+
+        if recovered.modified_count > 0:
+            logger.info(f"Recovered {recovered.modified_count} invoice jobs")
+
+    def _worker_loop(self):
+        while True:
+            try:
+                processed = self.process_job()
+            except Exception as e:
+                logger.error(f"Error processing invoice jobs: {e}")
+                processed = False
+
+            if processed:
+                continue
+
+            try:
+                self.recover()
+            except Exception as e:
+                logger.error(f"Error recovering invoice jobs: {e}")
+
+            _wakeup.wait(_get_options().get("poll_interval", 5))
+            _wakeup.clear()
+
+    def start(self):
+        for i in range(_get_options().get("workers", 2)):
+            worker = threading.Thread(target=self._worker_loop, name=f"Invoice_Worker_{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
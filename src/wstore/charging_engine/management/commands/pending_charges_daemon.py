@@ -19,14 +19,30 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
 from wstore.admin.users.notification_handler import NotificationsHandler
 from wstore.asset_manager.resource_plugins.decorators import on_product_suspended
 from wstore.ordering.inventory_client import InventoryClient
 from wstore.ordering.models import Order
+from wstore.store_commons.database import get_database_connection
+from wstore.store_commons.utils.concurrency import run_in_worker
+
+# Progress of the last run, so an interrupted run can be resumed
+CHECKPOINT_COLLECTION = "wstore_charges_daemon"
+CHECKPOINT_ID = "pending_charges"
+
+# Contracts are notified when there is less than this remaining
+NOTIFICATION_DAYS = 7
+
+# Usage payments are renovated every 30 days
+USAGE_PERIOD_DAYS = 30
 
 
 class Command(BaseCommand):
@@ -35,7 +51,7 @@ class Command(BaseCommand):
 
         timed = renovation_date - now
 
-        if timed.days < 7:
+        if timed.days < NOTIFICATION_DAYS:
             handler = NotificationsHandler()
 
             if timed.days < 0:
@@ -72,25 +88,103 @@ class Command(BaseCommand):
             if last_charge is None:
                 last_charge = order.date
 
-            # Usage payments are renovated every 30 days
-            self._check_renovation_date(last_charge + timedelta(days=30), order, contract)
+            self._check_renovation_date(last_charge + timedelta(days=USAGE_PERIOD_DAYS), order, contract)
         except:
             pass
 
+    def _get_due_filter(self, now):
+        """
+        Filter of the orders that may have a contract to be notified or suspended.
+        Subscriptions are selected using the index on their renovation date, while
+        usage contracts are discarded if they have been charged recently
+        """
+        limit = now + timedelta(days=NOTIFICATION_DAYS)
+        last_usage = limit - timedelta(days=USAGE_PERIOD_DAYS)
+
+        return {
+            "$or": [
+                {
+                    "contracts": {
+                        "$elemMatch": {
+                            "terminated": False,
+                            "pricing_model.subscription.renovation_date": {"$lt": limit},
+                        }
+                    }
+                },
+                {
+                    "contracts": {
+                        "$elemMatch": {
+                            "terminated": False,
+                            "pricing_model.pay_per_use": {"$exists": True},
+                            "charges": {"$not": {"$elemMatch": {"concept": "usage", "date": {"$gte": last_usage}}}},
+                        }
+                    }
+                },
+            ]
+        }
+
+    def _process_order(self, order_id):
+        try:
+            order = Order.objects.get(pk=order_id)
+        except Exception:
+            return
+
+        for contract in order.get_contracts():
+            if "pay_per_use" in contract.pricing_model and not contract.terminated:
+                self._process_usage_item(order, contract)
+
+            if "subscription" in contract.pricing_model and not contract.terminated:
+                # Validate renovation date
+                for item in contract.pricing_model["subscription"]:
+                    self._process_subscription_item(order, contract, item)
+
+    def add_arguments(self, parser):
+        parser.add_argument("--restart", action="store_true", help="Ignore the progress of an interrupted run")
+
     def handle(self, *args, **options):
         """
         Periodic task in charge of checking recurring and usage payments dates
         in order to notify customers and suspend services if needed
         :return:
         """
+        config = getattr(settings, "PENDING_CHARGES", {})
+        batch_size = config.get("batch_size", 500)
+
+        db = get_database_connection()
+        checkpoints = db[CHECKPOINT_COLLECTION]
+        start = time.monotonic()
+
+        query = self._get_due_filter(datetime.utcnow())
+
+        checkpoint = None if options.get("restart") else checkpoints.find_one({"_id": CHECKPOINT_ID})
+        if checkpoint is not None:
+            self.stdout.write(f"Resuming pending charges check after order {checkpoint['last_order']}\n")
+            query = {"$and": [query, {"_id": {"$gt": checkpoint["last_order"]}}]}
+
+        # Only the ids of the due orders are read, the full orders are loaded
+        # by the workers as they are processed
+        cursor = db.wstore_order.find(query, {"_id": 1}, batch_size=batch_size).sort("_id", 1)
+
+        processed = 0
+        with ThreadPoolExecutor(max_workers=config.get("workers", 4)) as executor:
+            batch = []
+            for order in cursor:
+                batch.append(order["_id"])
+
+                if len(batch) == batch_size:
+                    processed += self._process_batch(executor, checkpoints, batch)
+                    batch = []
+
+            if len(batch) > 0:
+                processed += self._process_batch(executor, checkpoints, batch)
+
+        # The run has finished, the next one starts from the beginning
+        checkpoints.delete_one({"_id": CHECKPOINT_ID})
+
+        self.stdout.write(f"Checked {processed} orders in {time.monotonic() - start:.2f}s\n")
 
-        # Check contracts
-        for order in Order.objects.all():
-            for contract in order.get_contracts():
-                if "pay_per_use" in contract.pricing_model and not contract.terminated:
-                    self._process_usage_item(order, contract)
+    def _process_batch(self, executor, checkpoints, batch):
+        list(executor.map(partial(run_in_worker, self._process_order), batch))
 
-                if "subscription" in contract.pricing_model and not contract.terminated:
-                    # Validate renovation date
-                    for item in contract.pricing_model["subscription"]:
-                        self._process_subscription_item(order, contract, item)
+        checkpoints.update_one({"_id": CHECKPOINT_ID}, {"$set": {"last_order": batch[-1]}}, upsert=True)
+        return len(batch)
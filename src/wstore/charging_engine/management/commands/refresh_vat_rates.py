@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wstore.charging_engine.vat_rates import refresh_vat_rates
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument("args", nargs="*")
+
+    def handle(self, *args, **options):
+        """
+        Downloads the EU VAT rates used when calculating prices. The ISO codes of
+        the countries to be refreshed can be provided, all by default
+        """
+        updated = refresh_vat_rates(list(args) or None)
+
+        if len(updated) == 0:
+            raise CommandError("It has not been possible to refresh the VAT rates")
+
+        self.stdout.write("VAT rates refreshed for: " + ", ".join(updated) + "\n")
@@ -20,9 +20,12 @@
 
 
 from datetime import datetime
+from io import StringIO
+from importlib import reload
 
 from django.test import TestCase
 from mock import MagicMock, call
+from parameterized import parameterized
 
 from wstore.charging_engine.management.commands import pending_charges_daemon
 
@@ -44,8 +47,19 @@ class ChargesDaemonTestCase(TestCase):
         # Mock orders
         pending_charges_daemon.Order = MagicMock()
 
+        self._orders = MagicMock()
+        self._checkpoints = MagicMock()
+        self._checkpoints.find_one.return_value = None
+        pending_charges_daemon.get_database_connection = MagicMock(
+            return_value=MagicMock(wstore_order=self._orders, __getitem__=lambda db, name: self._checkpoints)
+        )
+        self._orders.find.return_value.sort.return_value = [{"_id": "order1"}]
+
         pending_charges_daemon.on_product_suspended = MagicMock()
 
+    def tearDown(self):
+        reload(pending_charges_daemon)
+
     def _build_contract(self, pricing, id_):
         contract = MagicMock()
         contract.terminated = False
@@ -76,11 +90,11 @@ class ChargesDaemonTestCase(TestCase):
 
         order = MagicMock()
         order.get_contracts.return_value = [contract1] + contracts
-        pending_charges_daemon.Order.objects.all.return_value = [order]
+        pending_charges_daemon.Order.objects.get.return_value = order
 
         # Execute commands
-        command = pending_charges_daemon.Command()
-        command.handle()
+        command = pending_charges_daemon.Command(stdout=StringIO())
+        command.handle(restart=False)
 
         # Validate calls
         self.assertEquals([call(), call()], pending_charges_daemon.NotificationsHandler.call_args_list)
@@ -97,6 +111,12 @@ class ChargesDaemonTestCase(TestCase):
 
         pending_charges_daemon.on_product_suspended.assert_called_once_with(order, contracts[2])
 
+        pending_charges_daemon.Order.objects.get.assert_called_once_with(pk="order1")
+        self._checkpoints.update_one.assert_called_once_with(
+            {"_id": "pending_charges"}, {"$set": {"last_order": "order1"}}, upsert=True
+        )
+        self._checkpoints.delete_one.assert_called_once_with({"_id": "pending_charges"})
+
     def test_subscription_renovation(self):
         # Not expired
         contract1 = self._build_subscription_contract(datetime(2016, 3, 1), "1")
@@ -120,3 +140,51 @@ class ChargesDaemonTestCase(TestCase):
         contract3 = self._build_usage_contract(datetime(2015, 12, 31), "3")
 
         self._test_charging_daemon([contract1, contract2, contract3])
+
+    @parameterized.expand(
+        [
+            ("new_run", None, False),
+            ("resumed", {"last_order": "order1"}, False),
+            ("restart", {"last_order": "order1"}, True),
+        ]
+    )
+    def test_due_orders_query(self, name, checkpoint, restart):
+        self._checkpoints.find_one.return_value = checkpoint
+        self._orders.find.return_value.sort.return_value = []
+
+        command = pending_charges_daemon.Command(stdout=StringIO())
+        command.handle(restart=restart)
+
+        due = {
+            "$or": [
+                {
+                    "contracts": {
+                        "$elemMatch": {
+                            "terminated": False,
+                            "pricing_model.subscription.renovation_date": {"$lt": datetime(2016, 2, 15)},
+                        }
+                    }
+                },
+                {
+                    "contracts": {
+                        "$elemMatch": {
+                            "terminated": False,
+                            "pricing_model.pay_per_use": {"$exists": True},
+                            "charges": {
+                                "$not": {"$elemMatch": {"concept": "usage", "date": {"$gte": datetime(2016, 1, 16)}}}
+                            },
+                        }
+                    }
+                },
+            ]
+        }
+
+        if checkpoint is not None and not restart:
+            due = {"$and": [due, {"_id": {"$gt": "order1"}}]}
+
+        self._orders.find.assert_called_once_with(due, {"_id": 1}, batch_size=500)
+        self._orders.find().sort.assert_called_once_with("_id", 1)
+
+        self.assertEquals(0, pending_charges_daemon.Order.objects.get.call_count)
+        self.assertEquals(0, self._checkpoints.update_one.call_count)
+        self._checkpoints.delete_one.assert_called_once_with({"_id": "pending_charges"})
@@ -36,3 +36,12 @@ class ReportSemiPaid(models.Model):
     failed = models.JSONField(default=[])  # List
     success = models.JSONField(default=[])  # List
     errors = models.JSONField(default={})  # Dict
+
+
+class VatRate(models.Model):
+    _id = models.ObjectIdField()
+    country = models.CharField(max_length=2)  # ISO code used by the EU VAT service (EL for Greece)
+    category = models.CharField(max_length=50)  # Rate type, e.g. standard
+    valid_from = models.DateTimeField()  # Date the rate applies from (situationOn)
+    rate = models.CharField(max_length=20)  # Decimal percentage
+    updated_at = models.DateTimeField()
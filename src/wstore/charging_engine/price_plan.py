@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_right
+from decimal import Decimal
+
+PERIOD_ONETIME = "onetime"
+PERIOD_MONTH = "month"
+
+
+class PriceComponent:
+    """
+    Price component (non bundle productOfferingPrice) with the values used
+    during pricing already extracted from its JSON representation
+    """
+
+    def __init__(self, pricing):
+        self.pricing = pricing
+        self.price_type = pricing.get("priceType", "")
+        self.price = Decimal(str(pricing["price"]["value"])) if "price" in pricing else None
+        self.name = pricing.get("name", "empty name")
+        self.description = pricing.get("description", "empty description")
+        self.usage_spec_id = pricing.get("usageSpecId")
+        self.unit = pricing.get("unitOfMeasure", {}).get("units")
+
+        self.period = PERIOD_ONETIME
+        if "recurringChargePeriodType" in pricing and "recurringChargePeriodLength" in pricing:
+            self.period = "{} {}".format(pricing["recurringChargePeriodLength"], pricing["recurringChargePeriodType"])
+
+        if self.price_type.lower() == "usage":
+            self.period = PERIOD_MONTH
+
+        # Conditions on the product characteristics that make the component applicable
+        self.valid = True
+        self.conditions = {}
+
+        value = None
+        for val in pricing.get("prodSpecCharValueUse", []):
+            value = None
+            char_values = val.get("productSpecCharacteristicValue", [])
+
+            if len(char_values) > 0:
+                if char_values[0].get("value") is not None:
+                    value = ("normal", char_values[0]["value"])
+                elif char_values[0].get("valueFrom") is not None and char_values[0].get("valueTo") is not None:
+                    value = ("tailored", char_values[0]["valueFrom"], char_values[0]["valueTo"])
+
+            self.conditions[val["name"].lower()] = value
+
+        if len(self.conditions) > 0 and value is None:
+            # Invalid price component, every price component should have value or (valueFrom, valueTo)
+            self.valid = False
+
+
+class IntervalTable:
+    """
+    Ranges of a tailored characteristic sorted by their lower bound, so the
+    ranges including a value can be found with a binary search
+    """
+
+    def __init__(self, intervals):
+        self._intervals = intervals
+
+        try:
+            self._intervals = sorted(intervals, key=lambda interval: interval[0])
+            self._starts = [interval[0] for interval in self._intervals]
+
+            # Running maximum of the upper bounds, used to stop the search early
+            self._max_ends = []
+            for interval in self._intervals:
+                end = interval[1]
+                if len(self._max_ends) > 0 and self._max_ends[-1] > end:
+                    end = self._max_ends[-1]
+
+                self._max_ends.append(end)
+
+            self._sorted = True
+        except TypeError:
+            # Bounds of different types cannot be sorted, fallback to a linear scan
+            self._sorted = False
+
+    def find(self, value):
+        if not self._sorted:
+            return [key for start, end, key in self._intervals if start <= value <= end]
+
+        found = []
+        for i in range(bisect_right(self._starts, value) - 1, -1, -1):
+            if self._max_ends[i] < value:
+                break
+
+            if self._intervals[i][1] >= value:
+                found.append(self._intervals[i][2])
+
+        return found
+
+
+class PricePlan:
+    """
+    Compiled representation of a productOfferingPrice, including its resolved
+    bundle tree and lookup tables to select the components applicable to a
+    product from its characteristics
+    """
+
+    def __init__(self, pricing, components):
+        self.id = pricing.get("id")
+        self.last_update = pricing.get("lastUpdate")
+        self.pricing = pricing
+        self.components = [PriceComponent(component) for component in components]
+
+        # Hash table for "normal" characteristic values and sorted interval
+        # tables for "tailored" ones
+        self._normal = {}
+        tailored = {}
+        for index, component in enumerate(self.components):
+            if not component.valid:
+                continue
+
+            for name, condition in component.conditions.items():
+                if condition is None:
+                    continue
+
+                if condition[0] == "normal":
+                    self._normal.setdefault((name, str(condition[1])), []).append(index)
+                else:
+                    tailored.setdefault(name, []).append((condition[1], condition[2], index))
+
+        self._tailored = {name: IntervalTable(intervals) for name, intervals in tailored.items()}
+
+    def get_applicable_components(self, spec_chars):
+        """
+        Returns the components to be applied given the characteristics of the product,
+        as a list of (component, tailored value) tuples in the order of the plan
+        """
+        found = [0] * len(self.components)
+        tail_values = {}
+
+        for spec_char in spec_chars:
+            name = spec_char["name"].lower()
+
+            for index in self._normal.get((name, str(spec_char["value"])), []):
+                found[index] += 1
+
+            if name in self._tailored:
+                for index in self._tailored[name].find(spec_char["value"]):
+                    found[index] += 1
+                    tail_values[index] = Decimal(str(spec_char["value"]))
+
+        return [
+            (component, tail_values.get(index))
+            for index, component in enumerate(self.components)
+            if component.valid and len(component.conditions) == found[index]
+        ]
+
+
+class UsageIndex:
+    """
+    Usage records aggregated by usage specification and characteristic, so
+    usage price components are valued without scanning the whole usage list
+    """
+
+    def __init__(self, usage):
+        self.empty = len(usage) == 0
+        self._totals = {}
+
+        for usage_item in usage:
+            if "usageSpecification" not in usage_item or "id" not in usage_item["usageSpecification"]:
+                continue
+
+            spec_id = usage_item["usageSpecification"]["id"]
+            for usage_char in usage_item.get("usageCharacteristic", []):
+                key = (spec_id, usage_char["name"])
+                self._totals[key] = self._totals.get(key, Decimal("0")) + Decimal(str(usage_char["value"]))
+
+    def get_total(self, usage_spec_id, unit):
+        return self._totals.get((usage_spec_id, unit), Decimal("0"))
@@ -18,189 +18,125 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from logging import getLogger
-import requests
+import json
+import time
 from decimal import ROUND_HALF_UP, Decimal
-from datetime import datetime
-from zeep import Client, Settings
+from functools import partial
+from logging import getLogger
 
 from django.conf import settings
 
+from wstore.charging_engine.price_plan import PERIOD_MONTH, PERIOD_ONETIME, PricePlan, UsageIndex
+from wstore.charging_engine.vat_rates import VAT_RATES
+from wstore.store_commons import http_client
+from wstore.store_commons.utils.cache import LRUCache
+from wstore.store_commons.utils.concurrency import fetch_all, get_deadline
 from wstore.store_commons.utils.url import get_service_url
 
-WSDL_URL = "https://ec.europa.eu/taxation_customs/tedb/ws/VatRetrievalService.wsdl"
-ENDPOINT_URL = "https://ec.europa.eu/taxation_customs/tedb/ws/"
 logger = getLogger("wstore.default_logger")
 
+
+def _get_price_plan_cache():
+    options = getattr(settings, "PRICE_PLAN_CACHE", {})
+    return LRUCache(options.get("max_entries", 1000), max_size=options.get("max_size", 50 * 1024 * 1024))
+
+
+# Compiled price plans of the process, keyed by productOfferingPrice id
+PRICE_PLAN_CACHE = _get_price_plan_cache()
+
+
 class PriceEngine:
     # Period constants
-    PERIOD_ONETIME = "onetime"
-    PERIOD_MONTH = "month"
+    PERIOD_ONETIME = PERIOD_ONETIME
+    PERIOD_MONTH = PERIOD_MONTH
+
     def download_pricing(self, pop_id):
         price_url = get_service_url("catalog", "/productOfferingPrice/{}".format(pop_id))
-        request = requests.get(price_url, verify=settings.VERIFY_REQUESTS)
+        request = http_client.get(price_url, verify=settings.VERIFY_REQUESTS)
         pricing = request.json()
         return pricing
 
-    def _process_usage_value(self, component, usage):
-        for usage_item in usage:
-            if (
-                "usageSpecification" in usage_item
-                and "id" in usage_item["usageSpecification"]
-                and "usageSpecId" in component
-                and usage_item["usageSpecification"]["id"] == component["usageSpecId"]
-            ):
-                for usage_char in usage_item["usageCharacteristic"]:
-                    if usage_char["name"] == component["unitOfMeasure"]["units"]:
-                        return Decimal(str(usage_char["value"])) * Decimal(str(component["price"]["value"]))
-
-        return Decimal("0")
-
-    def _process_price_component(self, component, spec_chars, aggregated, usage):
-        # Check if the component needs to be applied
-        tail_value = None
-        if "prodSpecCharValueUse" in component:
-            conditions = {}
-            logger.debug(f"prodSpecCharValueUse:{component['prodSpecCharValueUse']}")
-
-            for val in component["prodSpecCharValueUse"]:
-                value = None
-                # CHECK
-                if "productSpecCharacteristicValue" in val and len(val["productSpecCharacteristicValue"]) > 0:
-                    if val["productSpecCharacteristicValue"][0].get("value") != None:
-                        logger.debug("normal")
-                        value = {
-                            "name": "normal", 
-                            "value": val["productSpecCharacteristicValue"][0]["value"]}
-                    elif val["productSpecCharacteristicValue"][0].get("valueFrom") != None and val["productSpecCharacteristicValue"][0].get("valueTo") !=None:
-                        logger.debug("tailored")
-                        value = {
-                            "name": "tailored",
-                            "valueFrom": val["productSpecCharacteristicValue"][0]["valueFrom"],
-                            "valueTo": val["productSpecCharacteristicValue"][0]["valueTo"]
-                            }
-
-                conditions[val["name"].lower()] = value
-
-            if value == None: # invalid price component, every price component should have value or (valueFrom, valueTo)
-                return
-
-            found = 0
-            for spec_char in spec_chars:
-                if spec_char["name"].lower() in conditions:
-                    condition = conditions[spec_char["name"].lower()]
-                    if condition["name"] == "tailored" and spec_char["value"] >= condition["valueFrom"] and spec_char["value"] <= condition["valueTo"]: # integer numbers
-                        logger.debug("found tailored")
-                        found += 1
-                        tail_value = Decimal(str(spec_char["value"]))
-                        continue
-
-                    if condition["name"] == "normal" and str(condition["value"]) == str(spec_char["value"]):
-                        logger.debug("found tailored")
-                        found += 1
-
-            if len(conditions) != found:
-                # The component is not processed
-                return
-
-        if component["priceType"] not in aggregated:
-            aggregated[component["priceType"]] = {}
-
-        period_key = self.PERIOD_ONETIME
-        if "recurringChargePeriodType" in component and "recurringChargePeriodLength" in component:
-            period_key = "{} {}".format(
-                component["recurringChargePeriodLength"], component["recurringChargePeriodType"]
-            )
+    def _is_modified(self, plan, pricing, components):
+        # The plan is only reused if neither the POP nor any of its components has changed
+        versions = [pricing.get("lastUpdate")] + [component.get("lastUpdate") for component in components]
+        cached_versions = [plan.last_update] + [component.pricing.get("lastUpdate") for component in plan.components]
+
+        return None in versions or versions != cached_versions
 
-        if component["priceType"].lower() == "usage":
-            period_key = self.PERIOD_MONTH
+    def get_price_plan(self, pop_id, deadline=None):
+        """
+        Returns the compiled price plan of the given productOfferingPrice. Cached plans are
+        used without accessing the catalog during PRICE_PLAN_CACHE["ttl"] seconds, then the
+        POP and its components are downloaded again and the plan is only recompiled if the
+        lastUpdate of any of them changed
+        """
+        ttl = getattr(settings, "PRICE_PLAN_CACHE", {}).get("ttl", 300)
+        now = time.monotonic()
 
-        if period_key not in aggregated[component["priceType"]]:
-            aggregated[component["priceType"]][period_key] = {"value": Decimal("0")}
+        cached = PRICE_PLAN_CACHE.get(pop_id)
+        if cached is not None and now - cached["checked"] < ttl:
+            return cached["plan"]
 
-        component_value = Decimal(str(component["price"]["value"]))
-        if component["priceType"] == "usage" and len(usage) > 0:
-            component_value = self._process_usage_value(component, usage)
+        pricing = self.download_pricing(pop_id)
 
-        if tail_value is None:
-            aggregated[component["priceType"]][period_key]["value"] += component_value
+        # If the price is a bundle download the components in parallel
+        if pricing["isBundle"]:
+            components = fetch_all(
+                [partial(self.download_pricing, pop["id"]) for pop in pricing["bundledPopRelationship"]],
+                deadline,
+            )
         else:
-            tailored_price = component_value * tail_value
-            aggregated[component["priceType"]][period_key]["value"] += tailored_price
-
-    def _proccess_price_component_indv(self, component, spec_chars, indv: list, usage):
-        tail_value = None
-        if "prodSpecCharValueUse" in component:
-            conditions = {}
-            logger.debug(f"prodSpecCharValueUse:{component['prodSpecCharValueUse']}")
-
-            for val in component["prodSpecCharValueUse"]:
-                value = None
-                # CHECK
-                if "productSpecCharacteristicValue" in val and len(val["productSpecCharacteristicValue"]) > 0:
-                    if val["productSpecCharacteristicValue"][0].get("value") != None:
-                        logger.debug("normal")
-                        value = {
-                            "name": "normal",
-                            "value": val["productSpecCharacteristicValue"][0]["value"]}
-                    elif val["productSpecCharacteristicValue"][0].get("valueFrom") != None and val["productSpecCharacteristicValue"][0].get("valueTo") !=None:
-                        logger.debug("tailored")
-                        value = {
-                            "name": "tailored",
-                            "valueFrom": val["productSpecCharacteristicValue"][0]["valueFrom"],
-                            "valueTo": val["productSpecCharacteristicValue"][0]["valueTo"]
-                            }
-
-                conditions[val["name"].lower()] = value
-
-            if value == None: # invalid price component, every price component should have value or (valueFrom, valueTo)
-                return
-
-            found = 0
-            for spec_char in spec_chars:
-                if spec_char["name"].lower() in conditions:
-                    condition = conditions[spec_char["name"].lower()]
-                    if condition["name"] == "tailored" and spec_char["value"] >= condition["valueFrom"] and spec_char["value"] <= condition["valueTo"]: # integer numbers
-                        logger.debug("found tailored")
-                        found += 1
-                        tail_value = Decimal(str(spec_char["value"]))
-                        continue
-
-                    if condition["name"] == "normal" and str(condition["value"]) == str(spec_char["value"]):
-                        logger.debug("found normal")
-                        found += 1
-
-            if len(conditions) != found:
-                # The component is not processed
-                return
+            components = [pricing]
 
-        # keys: price, period and priceType
-        indv_price = {}
+        if cached is not None and not self._is_modified(cached["plan"], pricing, components):
+            plan = cached["plan"]
+        else:
+            plan = PricePlan(pricing, components)
 
-        period_key = self.PERIOD_ONETIME
-        if "recurringChargePeriodType" in component and "recurringChargePeriodLength" in component:
-            period_key = "{} {}".format(
-                component["recurringChargePeriodLength"], component["recurringChargePeriodType"]
-            )
+        size = len(json.dumps([plan.pricing] + [component.pricing for component in plan.components], default=str))
+        PRICE_PLAN_CACHE.set(pop_id, {"plan": plan, "checked": now}, size=size)
 
-        if component["priceType"].lower() == "usage":
-            period_key = self.PERIOD_MONTH
+        logger.debug(f"Price plan cache: {PRICE_PLAN_CACHE.stats()}")
+        return plan
 
-        indv_price["priceType"] = component["priceType"]
-        indv_price["period"] = period_key
+    def _process_usage_value(self, component, usage_index):
+        if component.usage_spec_id is None:
+            return Decimal("0")
 
-        component_value = Decimal(str(component["price"]["value"]))
-        if component["priceType"] == "usage" and len(usage) > 0:
-            component_value = self._process_usage_value(component, usage)
+        return usage_index.get_total(component.usage_spec_id, component.unit) * component.price
 
-        if tail_value is None:
-            indv_price["price"] = component_value
-        else:
-            tailored_price = component_value * tail_value
-            indv_price["price"] = tailored_price
-        indv_price["description"] = component["description"] if "description" in component else "empty description"
-        indv_price["name"] = component["name"] if "name" in component else "empty name"
-        indv.append(indv_price)
+    def _get_component_value(self, component, tail_value, usage_index):
+        component_value = component.price
+        if component.price_type == "usage" and not usage_index.empty:
+            component_value = self._process_usage_value(component, usage_index)
+
+        if tail_value is not None:
+            component_value = component_value * tail_value
+
+        return component_value
+
+    def _process_price_component(self, component, tail_value, aggregated, usage_index):
+        if component.price_type not in aggregated:
+            aggregated[component.price_type] = {}
+
+        if component.period not in aggregated[component.price_type]:
+            aggregated[component.price_type][component.period] = {"value": Decimal("0")}
+
+        aggregated[component.price_type][component.period]["value"] += self._get_component_value(
+            component, tail_value, usage_index
+        )
+
+    def _proccess_price_component_indv(self, component, tail_value, indv: list, usage_index):
+        # keys: price, period and priceType
+        indv.append(
+            {
+                "priceType": component.price_type,
+                "period": component.period,
+                "price": self._get_component_value(component, tail_value, usage_index),
+                "description": component.description,
+                "name": component.name,
+            }
+        )
 
     def _get_party_char(self, party_id):
         # Check if the party is an individual or an organization
@@ -210,7 +146,7 @@ class PriceEngine:
             raise ValueError(f"Invalid user type: {user_type}")
         try:
             party_url = get_service_url("party", f"/{user_type}/{party_id}")
-            response = requests.get(party_url)
+            response = http_client.get(party_url)
             response.raise_for_status()
             result = response.json()
             return result["partyCharacteristic"],  user_type
@@ -218,7 +154,7 @@ class PriceEngine:
             logger.error(f"Error in process_price_component: {type(e).__name__}: {str(e)}")
             raise ValueError("Error fetching party information")
 
-    def _get_customer_seller(self, related_party):
+    def _get_customer_seller(self, related_party, deadline=None):
         customer_country = None
         seller_country = None
         customer_type = None
@@ -226,9 +162,10 @@ class PriceEngine:
         customer_id = None
         seller_id = None
 
-        for party_ref in related_party:
+        parties = fetch_all([partial(self._get_party_char, party_ref["id"]) for party_ref in related_party], deadline)
+
+        for party_ref, (party_chars, user_type) in zip(related_party, parties):
             party_id = party_ref["id"]
-            party_chars, user_type = self._get_party_char(party_id)
             country = None
 
             for char in party_chars:
@@ -257,41 +194,14 @@ class PriceEngine:
             or (customer_country is not None and seller_country is not None and customer_country != seller_country)
         ):
             return 0
-        date_now = datetime.now().date().isoformat()
-        customer_country = (
-            customer_country if customer_country.lower() != "gr" else "EL"
-        )  # Greece in fiscal contexts uses EL as country code
-        args = {"memberStates": {"isoCode": customer_country}, "situationOn": date_now}
-
-        try:
-            client = Client(wsdl=WSDL_URL, settings=Settings())
-
-            # Change endpoint manually (if the WSDL points to HTTP instead of HTTPS)
-            client.service._binding_options["address"] = ENDPOINT_URL
-        except Exception as e:
-            logger.error(f"Failed to load WSDL from EU service: {e}")
-            raise
 
-        # Send the request
-        try:
-            response = client.service.retrieveVatRates(**args)
-            results = response.vatRateResults
-            standard = list(filter(lambda item: "type" in item and item["type"].lower() == "standard", results))
-            if len(standard) == 1:
-                return standard[0]["rate"]["value"]
-            else:
-                for vat in standard:
-                    if vat["comment"] is None:
-                        return vat["rate"]["value"]
-            raise ValueError("Standard VAT rate unavailable for the selected country.")
-        except ValueError as e:
-            logger.error("Error calling the service: %s", str(e))
-            raise
+        # Rates are read from the local VAT table, refreshed by the refresh_vat_rates command
+        return VAT_RATES.get_rate(customer_country)
 
     # def _get_dft_bill_acc(self, party_id):
     #     try:
     #         billing_acc_url = get_service_url("account", f"/billingAccount?relatedParty.id={party_id}")
-    #         response = requests.get(billing_acc_url)
+    #         response = http_client.get(billing_acc_url)
     #         response.raise_for_status()
     #         result = response.json()
     #         for bill_acc in result:
@@ -305,8 +215,8 @@ class PriceEngine:
     #         raise ValueError("Error searching for preferred biling address")
 
 
-    def _calculate_taxes(self, related_party, selected_bill_acc=None):
-        customer, seller = self._get_customer_seller(related_party)
+    def _calculate_taxes(self, related_party, selected_bill_acc=None, deadline=None):
+        customer, seller = self._get_customer_seller(related_party, deadline=deadline)
 
         customer_country: str | None = customer["country"]
         customer_type: str = customer["type"]
@@ -325,54 +235,92 @@ class PriceEngine:
         else: # customer_type is an organization, checked in a previuos method
             return self._search_ue_taxes(related_party, customer_country, seller_country)
 
-    def calculate_prices(self, data: dict, usage=[], preview=True):
-        aggregated = {}
-        indv = []
-        logger.debug("calculate prices")
+    def _has_price(self, item):
+        return "itemTotalPrice" in item and len(item["itemTotalPrice"]) > 0
+
+    def _get_related_party(self, data, item):
+        if "relatedParty" in data:
+            return data["relatedParty"]
 
-        item = data["productOrderItem"][0]
-        # 1) Download the POP
-        if "itemTotalPrice" not in item or len(item["itemTotalPrice"]) == 0:
-            # The item has no price, it is free
-            return []
+        return item["product"]["relatedParty"]
 
-        pop_id = item["itemTotalPrice"][0]["productOfferingPrice"]["id"] # always 1 (price plan)
+    def _get_party_key(self, related_party):
+        return tuple((party_ref["id"], party_ref.get("role", "").lower()) for party_ref in related_party)
 
-        pricing = self.download_pricing(pop_id)
+    def _calculate_items_prices(self, data, items, usage, preview):
+        # Items without price are free
+        priced_items = [item for item in items if self._has_price(item)]
 
-        # If the price is a bundle download the components
-        to_process = []
-        if pricing["isBundle"]:
-            to_process = [self.download_pricing(pop["id"]) for pop in pricing["bundledPopRelationship"]]
-        else:
-            to_process = [pricing]
+        # Price plans and taxes are only downloaded once per order, even if
+        # several items share them, and all of them are fetched in parallel
+        pop_ids = []
+        parties = {}
+        for item in priced_items:
+            pop_id = item["itemTotalPrice"][0]["productOfferingPrice"]["id"]  # always 1 (price plan)
+            if pop_id not in pop_ids:
+                pop_ids.append(pop_id)
+
+            related_party = self._get_related_party(data, item)
+            parties.setdefault(self._get_party_key(related_party), related_party)
+
+        deadline = get_deadline()
+        bill_acc = data.get("billingAccount", {}).get("resolved", None)
+
+        fetched = fetch_all(
+            [partial(self.get_price_plan, pop_id, deadline=deadline) for pop_id in pop_ids]
+            + [
+                partial(self._calculate_taxes, related_party, bill_acc, deadline=deadline)
+                for related_party in parties.values()
+            ],
+            deadline,
+        )
+
+        plans = dict(zip(pop_ids, fetched[: len(pop_ids)]))
+        taxes = dict(zip(parties.keys(), fetched[len(pop_ids) :]))
+
+        # Usage records are indexed once and shared by all the usage components
+        usage_index = UsageIndex(usage)
+
+        result = []
+        for item in items:
+            if not self._has_price(item):
+                result.append([])
+                continue
+
+            result.append(
+                self._calculate_item_prices(
+                    item,
+                    plans[item["itemTotalPrice"][0]["productOfferingPrice"]["id"]],
+                    taxes[self._get_party_key(self._get_related_party(data, item))],
+                    usage_index,
+                    preview,
+                )
+            )
+
+        return result
+
+    def _calculate_item_prices(self, item, plan, tax, usage_index, preview):
+        aggregated = {}
+        indv = []
 
         spec_chars = []
         if "product" in item and "productCharacteristic" in item["product"]:
             spec_chars = item["product"]["productCharacteristic"]
 
-        for component in to_process:
+        # If a characteristic has been defined check if the component have to be applied
+        # If the charactristic is tailored apply the value
+        for component, tail_value in plan.get_applicable_components(spec_chars):
             if preview is True:
-                self._process_price_component(component, spec_chars, aggregated, usage)
+                self._process_price_component(component, tail_value, aggregated, usage_index)
             else:
-                self._proccess_price_component_indv(component, spec_chars, indv, usage)
-
-        # If the POP is not a bundle check the pricing
-        # If the bundle is a pop download the models
+                self._proccess_price_component_indv(component, tail_value, indv, usage_index)
 
-        # If a characteristic has been defined check if the component have to be applied
-        # If the charactristic is tailored apply the value
         logger.debug(f"aggregation: {aggregated}")
 
         result = []
-        parties = None
-        if "relatedParty" in data:
-            parties = data["relatedParty"]
-        else:
-            parties = item["product"]["relatedParty"]
         tax = Decimal(
-            repr(self._calculate_taxes(parties, data.get("billingAccount",{}).get("resolved", None)))
-        )  # Needs to repr() first because Decimal(20.1) returns 20.10000000000000142108547152020037174224853515625
+            str(tax)
+        )  # Needs to str() first because Decimal(20.1) returns 20.10000000000000142108547152020037174224853515625
         if preview is True:
             for priceType in aggregated.keys():
                 for period in aggregated[priceType].keys():
@@ -384,6 +332,38 @@ class PriceEngine:
                 result.append(self._build_price_result(priceComp["priceType"], priceComp["period"], Decimal(priceComp["price"]), tax, name=priceComp["name"], description=priceComp.get("description")))
         return result
 
+    def calculate_prices(self, data: dict, usage=[], preview=True):
+        """
+        Calculates the prices of the first item of the order
+        """
+        logger.debug("calculate prices")
+        return self._calculate_items_prices(data, data["productOrderItem"][:1], usage, preview)[0]
+
+    def calculate_order_prices(self, data: dict, usage=[], preview=True):
+        """
+        Calculates the prices of all the items of the order, returning the prices
+        of every item together with the order totals by price type, period and tax
+        """
+        logger.debug("calculate order prices")
+        items = data["productOrderItem"]
+        items_prices = self._calculate_items_prices(data, items, usage, preview)
+
+        totals = {}
+        for prices in items_prices:
+            for price in prices:
+                key = (price["priceType"], price["recurringChargePeriod"], price["price"]["taxRate"])
+                totals[key] = totals.get(key, Decimal("0")) + Decimal(price["price"]["dutyFreeAmount"]["value"])
+
+        return {
+            "orderTotalPrice": [
+                self._build_price_result(price_type, period, duty_free, Decimal(tax_rate))
+                for (price_type, period, tax_rate), duty_free in totals.items()
+            ],
+            "productOrderItem": [
+                {"id": item.get("id"), "itemTotalPrice": prices} for item, prices in zip(items, items_prices)
+            ],
+        }
+
     def _build_price_result(self, price_type, period, duty_free: Decimal, tax_rate: Decimal, name = None, description = None):
       return {
           **({"name": name} if name else {}),
@@ -23,7 +23,7 @@ import requests
 from decimal import Decimal
 from django.test import TestCase
 from parameterized import parameterized
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 
 from wstore.charging_engine.charging import billing_client
 
@@ -203,12 +203,12 @@ class BillingClientTestCase(TestCase):
 
         client = billing_client.BillingClient()
         client._session = MagicMock()
-        billing_client.requests = MagicMock()
-        billing_client.requests.patch.return_value = mock_response
+        billing_client.http_client = MagicMock()
+        billing_client.http_client.patch.return_value = mock_response
 
         client.set_customer_bill("settled", "bill-123")
 
-        call_kwargs = billing_client.requests.patch.call_args
+        call_kwargs = billing_client.http_client.patch.call_args
         self.assertEqual(call_kwargs[0][0], "http://billing/customerBill/bill-123")
         self.assertEqual(call_kwargs[1]["json"], {"state": "settled"})
         mock_response.raise_for_status.assert_called_once()
@@ -220,9 +220,8 @@ class BillingClientTestCase(TestCase):
         mock_response.raise_for_status.side_effect = requests.exceptions.HTTPError("500")
 
         client = billing_client.BillingClient()
-        billing_client.requests = MagicMock()
-        billing_client.requests.patch.return_value = mock_response
-        billing_client.requests.exceptions.HTTPError = requests.exceptions.HTTPError
+        billing_client.http_client = MagicMock()
+        billing_client.http_client.patch.return_value = mock_response
 
         with self.assertRaises(requests.exceptions.HTTPError):
             client.set_customer_bill("settled", "bill-123")
@@ -232,7 +231,7 @@ class BillingClientTestCase(TestCase):
         ("percentage_decimal", "21", "0.21"),
         ("already_decimal", "0.21", "0.21"),
     ])
-    @patch("wstore.charging_engine.charging.billing_client.requests.post")
+    @patch("wstore.charging_engine.charging.billing_client.http_client.post")
     @patch("wstore.charging_engine.charging.billing_client.get_service_url")
     def test_create_customer_rate_normalizes_tax_rate(self, name, input_tax_rate, expected_decimal_rate, mock_get_service_url, mock_post):
         mock_get_service_url.return_value = "http://billing.test/appliedCustomerBillingRate"
@@ -261,3 +260,173 @@ class BillingClientTestCase(TestCase):
 
         sent_body = mock_post.call_args.kwargs["json"]
         self.assertEqual(sent_body["appliedTax"][0]["taxRate"], Decimal(expected_decimal_rate))
+
+    def _build_acbr_model(self, name):
+        return {
+            "name": name,
+            "description": name + " description",
+            "appliedBillingRateType": "one time",
+            "appliedTax": [{"taxRate": "21", "taxAmount": {"unit": "EUR", "value": "2.10"}}],
+            "taxIncludedAmount": {"unit": "EUR", "value": "12.10"},
+            "taxExcludedAmount": {"unit": "EUR", "value": "10.00"},
+            "billingAccount": {"id": "ba-1"},
+        }
+
+    def _mock_billing_api(self, failing=None, error_status=400):
+        # Billing API stub that creates the rates with their name as id and fails for the given one
+        billing_client.http_client = MagicMock()
+
+        def post(url, json=None, **kwargs):
+            response = MagicMock()
+            if json["name"] == f"INITIAL PAYMENT - {failing}":
+                response.status_code = error_status
+                response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+            else:
+                response.json.return_value = {"id": json["name"].split(" - ")[1]}
+            return response
+
+        billing_client.http_client.post.side_effect = post
+
+    @patch("wstore.charging_engine.charging.billing_client.get_operator_party_roles", MagicMock(return_value=[]))
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_create_batch_customer_rates(self):
+        self._mock_billing_api()
+        models = [self._build_acbr_model(name) for name in ["rate-1", "rate-2", "rate-3"]] + [
+            {"appliedBillingRateType": "recurring"}
+        ]
+
+        client = billing_client.BillingClient()
+        created, recurring = client.create_batch_customer_rates(models, None, {"id": "product-1"})
+
+        self.assertEqual([{"id": "rate-1"}, {"id": "rate-2"}, {"id": "rate-3"}], created)
+        self.assertTrue(recurring)
+
+        # Every rate is sent with its own idempotency key
+        keys = {
+            post_call[1]["headers"][billing_client.IDEMPOTENCY_HEADER]
+            for post_call in billing_client.http_client.post.call_args_list
+        }
+        self.assertEqual(3, len(keys))
+
+    @patch("wstore.charging_engine.charging.billing_client.get_operator_party_roles", MagicMock(return_value=[]))
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_create_batch_customer_rates_rollback(self):
+        self._mock_billing_api(failing="rate-2")
+        models = [self._build_acbr_model(name) for name in ["rate-1", "rate-2", "rate-3"]]
+
+        client = billing_client.BillingClient()
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.create_batch_customer_rates(models, None, {"id": "product-1"})
+
+        # The rates already created are removed
+        self.assertEqual(
+            {"appliedCustomerBillingRate/rate-1", "appliedCustomerBillingRate/rate-3"},
+            {delete_call[0][0] for delete_call in billing_client.http_client.delete.call_args_list},
+        )
+
+    @patch("wstore.charging_engine.charging.billing_client.get_operator_party_roles", MagicMock(return_value=[]))
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_create_customer_rate_retry(self):
+        billing_client.http_client = MagicMock()
+
+        billing_client.http_client.post.side_effect = [
+            requests.exceptions.ConnectTimeout(),
+            requests.exceptions.ConnectTimeout(),
+            MagicMock(**{"json.return_value": {"id": "rate-1"}}),
+        ]
+
+        client = billing_client.BillingClient()
+        result = client.create_customer_rate(
+            "rate-1", "", "one time", "EUR", "21", "2.10", "12.10", "10.00", {"id": "ba-1"}, "product-1", party=None
+        )
+
+        self.assertEqual({"id": "rate-1"}, result)
+
+        # Retries reuse the same idempotency key
+        keys = {
+            post_call[1]["headers"][billing_client.IDEMPOTENCY_HEADER]
+            for post_call in billing_client.http_client.post.call_args_list
+        }
+        self.assertEqual(3, billing_client.http_client.post.call_count)
+        self.assertEqual(1, len(keys))
+
+    def _server_error(self):
+        response = MagicMock(status_code=503)
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+        return response
+
+    @parameterized.expand(
+        [
+            ("connection_error", requests.exceptions.ConnectionError()),
+            ("read_timeout", requests.exceptions.ReadTimeout()),
+            ("server_error", None),
+        ]
+    )
+    @patch("wstore.charging_engine.charging.billing_client.get_operator_party_roles", MagicMock(return_value=[]))
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_create_customer_rate_not_retried(self, name, error):
+        billing_client.http_client = MagicMock()
+        billing_client.http_client.post.side_effect = [
+            error if error is not None else self._server_error(),
+            MagicMock(**{"json.return_value": {"id": "rate-1"}}),
+        ]
+
+        client = billing_client.BillingClient()
+        with self.assertRaises(requests.exceptions.RequestException):
+            client.create_customer_rate(
+                "rate-1", "", "one time", "EUR", "21", "2.10", "12.10", "10.00", {"id": "ba-1"}, "product-1", party=None
+            )
+
+        # The request may have been processed, so it is not sent again
+        self.assertEqual(1, billing_client.http_client.post.call_count)
+
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_update_acbr_retry(self):
+        billing_client.http_client = MagicMock()
+        billing_client.http_client.patch.side_effect = [
+            requests.exceptions.ConnectionError(),
+            self._server_error(),
+            MagicMock(),
+        ]
+
+        client = billing_client.BillingClient()
+        client.set_acbrs_cb([{"id": "acbr-1"}], "bill-1")
+
+        self.assertEqual(3, billing_client.http_client.patch.call_count)
+
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_set_acbrs_cb_rollback(self):
+        billing_client.http_client = MagicMock()
+
+        def patch_rate(url, json=None, **kwargs):
+            response = MagicMock()
+            if url.endswith("acbr-2") and json["isBilled"]:
+                response.status_code = 400
+                response.raise_for_status.side_effect = requests.exceptions.HTTPError(response=response)
+            return response
+
+        billing_client.http_client.patch.side_effect = patch_rate
+
+        client = billing_client.BillingClient()
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.set_acbrs_cb([{"id": "acbr-1"}, {"id": "acbr-2"}], "bill-1")
+
+        # The rates already updated are set as not billed again
+        billing_client.http_client.patch.assert_any_call(
+            "appliedCustomerBillingRate/acbr-1", json={"isBilled": False, "bill": None}, verify=ANY
+        )
+        self.assertEqual(3, billing_client.http_client.patch.call_count)
+
+    @patch("wstore.charging_engine.charging.billing_client.get_service_url", lambda api, path: path)
+    def test_create_customer_bill_rollback(self):
+        billing_client.http_client = MagicMock()
+        billing_client.http_client.post.return_value.json.return_value = {"id": "bill-1"}
+
+        client = billing_client.BillingClient()
+        client.set_acbrs_cb = MagicMock(side_effect=requests.exceptions.HTTPError())
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.create_customer_bill([{"id": "acbr-1"}], {"taxIncludedAmount": {"unit": "EUR"}})
+
+        # The bill is not left without rates
+        billing_client.http_client.delete.assert_called_once_with("customerBill/bill-1", verify=ANY)
@@ -21,8 +21,9 @@
 import uuid
 
 from django.test import TestCase
+from django.test.utils import override_settings
 from parameterized import parameterized
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 
 from wstore.charging_engine.engines.engine import Engine
 
@@ -44,14 +45,14 @@ class EngineTestCase(TestCase):
         ("second_item_found", "2", {"id": "2", "name": "item-2"}),
         ("item_not_found", "3", None),
     ])
-    def test_get_item(self, name, item_id, expected_result):
+    def test_index_items(self, name, item_id, expected_result):
         engine = Engine(MagicMock())
 
-        result = engine._get_item(item_id, RAW_ORDER)
+        result = engine._index_items(RAW_ORDER).get(item_id)
 
         self.assertEqual(result, expected_result)
 
-    def test_get_item_returns_first_match(self):
+    def test_index_items_keeps_first_match(self):
         raw_order = {
             "productOrderItem": [
                 {"id": "1", "value": "a"},
@@ -60,9 +61,9 @@ class EngineTestCase(TestCase):
         }
         engine = Engine(MagicMock())
 
-        result = engine._get_item("1", raw_order)
+        result = engine._index_items(raw_order)
 
-        self.assertEqual(result, {"id": "1", "value": "a"})
+        self.assertEqual(result, {"1": {"id": "1", "value": "a"}})
 
     def test_resolve_charging_initial(self):
         engine = Engine(MagicMock())
@@ -270,3 +271,118 @@ class EngineTestCase(TestCase):
 
         with self.assertRaises(ValueError):
             engine.process_initial_charging(RAW_ORDER)
+
+    def _build_engine_with_contracts(self):
+        contracts = []
+        for item_id in ["1", "2"]:
+            contract = MagicMock()
+            contract.item_id = item_id
+            contract.product_id = "old-product"
+            contracts.append(contract)
+
+        order = MagicMock()
+        order.order_id = "order-1"
+        order.contracts = contracts
+
+        return Engine(order), order, contracts
+
+    def _execute_billing(self, item, raw_order):
+        return (
+            [{"name": "rate-" + item["id"]}],
+            {"some": "cb"},
+            {"id": "product-" + item["id"], "productPrice": [], "productCharacteristic": []},
+        )
+
+    @patch("wstore.charging_engine.engines.engine.PaymentClient")
+    @patch("wstore.charging_engine.engines.engine.InventoryClient")
+    @patch("wstore.charging_engine.engines.engine.BillingClient")
+    def test_process_initial_charging_multiple_contracts(self, billing_client, inventory_client, payment_client):
+        engine, order, contracts = self._build_engine_with_contracts()
+        engine.execute_billing = MagicMock(side_effect=self._execute_billing)
+
+        inventory_client.return_value.create_product.side_effect = lambda product: {
+            "id": product["id"],
+            "relatedParty": [],
+        }
+        billing_client.return_value.create_batch_customer_rates.side_effect = lambda models, party, product, message: (
+            [{"id": "acbr-" + product["id"]}],
+            False,
+        )
+        billing_client.return_value.create_customer_bill.side_effect = lambda acbrs, cb: {
+            "id": "bill-" + acbrs[0]["id"],
+        }
+
+        engine.process_initial_charging(RAW_ORDER)
+
+        # Every contract gets the values of its own item
+        self.assertEqual(["product-1", "product-2"], [contract.product_id for contract in contracts])
+        self.assertEqual([["acbr-product-1"], ["acbr-product-2"]], [contract.applied_rates for contract in contracts])
+        self.assertEqual(
+            [("1", "bill-acbr-product-1"), ("2", "bill-acbr-product-2")],
+            [(transaction["item"], transaction["billId"]) for transaction in order.pending_payment["transactions"]],
+        )
+        order.save.assert_called_once_with()
+
+    # Contracts are processed in order, so the failing one is always reached
+    @override_settings(CONCURRENT_FETCH={"max_workers": 1})
+    @patch("wstore.charging_engine.engines.engine.InventoryClient")
+    @patch("wstore.charging_engine.engines.engine.BillingClient")
+    def test_process_initial_charging_rollback(self, billing_client, inventory_client):
+        engine, order, contracts = self._build_engine_with_contracts()
+        engine.execute_billing = MagicMock(side_effect=self._execute_billing)
+
+        inventory_client.return_value.create_product.side_effect = lambda product: {
+            "id": product["id"],
+            "relatedParty": [],
+        }
+        billing_client.return_value.create_batch_customer_rates.side_effect = lambda models, party, product, message: (
+            [{"id": "acbr-" + product["id"]}],
+            False,
+        )
+
+        def create_customer_bill(acbrs, cb):
+            if acbrs[0]["id"] == "acbr-product-2":
+                raise ValueError("Error creating bill")
+            return {"id": "bill-" + acbrs[0]["id"]}
+
+        billing_client.return_value.create_customer_bill.side_effect = create_customer_bill
+
+        with self.assertRaises(ValueError):
+            engine.process_initial_charging(RAW_ORDER)
+
+        # Contracts are left untouched and the created resources removed
+        self.assertEqual(["old-product", "old-product"], [contract.product_id for contract in contracts])
+        billing_client.return_value.delete_customer_bill.assert_called_once_with("bill-acbr-product-1")
+        billing_client.return_value.delete_customer_rates.assert_called_once_with(
+            [{"id": "acbr-product-1"}, {"id": "acbr-product-2"}]
+        )
+        self.assertEqual(
+            {"product-1", "product-2"},
+            {patch_call[0][0] for patch_call in inventory_client.return_value.patch_product.call_args_list},
+        )
+        inventory_client.return_value.patch_product.assert_called_with(ANY, {"status": "terminated"})
+        order.save.assert_not_called()
+
+    @override_settings(CONCURRENT_FETCH={"max_workers": 1})
+    @patch("wstore.charging_engine.engines.engine.InventoryClient")
+    @patch("wstore.charging_engine.engines.engine.BillingClient")
+    def test_process_initial_charging_rollback_internal_bill(self, billing_client, inventory_client):
+        engine, order, contracts = self._build_engine_with_contracts()
+        engine.execute_billing = MagicMock(side_effect=self._execute_billing)
+
+        inventory_client.return_value.create_product.side_effect = lambda product: {
+            "id": product["id"],
+            "relatedParty": [],
+        }
+        billing_client.return_value.create_batch_customer_rates.side_effect = [
+            ([{"id": "acbr-product-1"}], False),
+            ValueError("Error creating rates"),
+        ]
+        billing_client.return_value.create_customer_bill.return_value = {}
+
+        with self.assertRaises(ValueError):
+            engine.process_initial_charging(RAW_ORDER)
+
+        # Bills generated locally do not exist in the billing API
+        billing_client.return_value.delete_customer_bill.assert_not_called()
+        billing_client.return_value.delete_customer_rates.assert_called_once_with([{"id": "acbr-product-1"}])
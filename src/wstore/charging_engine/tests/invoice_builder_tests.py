@@ -18,12 +18,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from importlib import reload
+
 from bson.objectid import ObjectId
 from django.test import TestCase
 from mock import MagicMock
 from parameterized import parameterized
 
-from wstore.charging_engine import invoice_builder
+from wstore.charging_engine import invoice_builder, invoice_renderer
 
 TEMPLATE = "<html></html>"
 USERNAME = "test-user"
@@ -288,22 +290,12 @@ class InvoiceBuilderTestCase(TestCase):
         invoice_builder.settings.BASEDIR = BASEDIR
         invoice_builder.settings.MEDIA_URL = MEDIA_URL
 
-        invoice_builder.codecs = MagicMock()
-        self._file_handler = MagicMock()
-        invoice_builder.codecs.open.return_value = self._file_handler
-
-        self._old_exists = invoice_builder.os.path.exists
-        invoice_builder.os.path.exists = MagicMock()
-
-        invoice_builder.os.path.exists.side_effect = [True, True, False]
-        invoice_builder.os.listdir = MagicMock()
-        invoice_builder.os.listdir.return_value = ["file1.pdf", "file1.html"]
-        invoice_builder.os.remove = MagicMock()
-
-        invoice_builder.subprocess = MagicMock()
+        invoice_builder.enqueue_invoice = MagicMock()
+        invoice_builder.uuid4 = MagicMock()
+        invoice_builder.uuid4.return_value.hex = "abcd"
 
     def tearDown(self):
-        invoice_builder.os.path.exists = self._old_exists
+        reload(invoice_builder)
 
     @parameterized.expand(
         [
@@ -343,11 +335,9 @@ class InvoiceBuilderTestCase(TestCase):
         invoice_path = builder.generate_invoice(self._contract, transaction, concept)
 
         # Validate Path
-        invoice_name = "{}_{}_{}_2.pdf".format(self._order.pk, self._contract.item_id, TIMESTAMP.split()[0])
+        invoice_name = "{}_{}_{}_abcd.pdf".format(self._order.pk, self._contract.item_id, TIMESTAMP.split()[0])
 
         exp_path = MEDIA_URL + "bills/" + invoice_name
-        html_path = BILL_ROOT + "/" + invoice_name.replace("_2.pdf", ".html")
-
         self.assertEquals(exp_path, invoice_path)
 
         # Validate calls
@@ -357,13 +347,93 @@ class InvoiceBuilderTestCase(TestCase):
         invoice_builder.Context.assert_called_once_with(exp_context)
         self._template.render.assert_called_once_with(invoice_builder.Context())
 
-        invoice_builder.codecs.open.assert_called_once_with(html_path, "wb", "utf-8")
+        invoice_builder.enqueue_invoice.assert_called_once_with(TEMPLATE, invoice_name)
+
+
+class InvoiceRendererTestCase(TestCase):
+    tags = ("invoices",)
+
+    def setUp(self):
+        self._collection = MagicMock()
+        invoice_renderer.get_database_connection = MagicMock(return_value={"wstore_invoice_job": self._collection})
+
+        self._job = {"_id": "job1", "name": "invoice.pdf", "html": TEMPLATE, "attempts": 0}
+        self._collection.find_one_and_update.return_value = self._job
+
+        invoice_renderer.settings = MagicMock(BILL_ROOT=BILL_ROOT, BASEDIR=BASEDIR, INVOICE_RENDERER={})
+
+        invoice_renderer.os = MagicMock()
+        invoice_renderer.os.path.join.side_effect = lambda *parts: "/".join(parts)
+        invoice_renderer.os.path.exists.return_value = True
+
+        invoice_renderer.tempfile = MagicMock()
+        invoice_renderer.tempfile.mkdtemp.return_value = BILL_ROOT + "/.scratch/invoice_1"
+        invoice_renderer.shutil = MagicMock()
+        invoice_renderer.subprocess = MagicMock()
+
+        invoice_renderer.codecs = MagicMock()
+        self._file_handler = MagicMock()
+        invoice_renderer.codecs.open.return_value.__enter__.return_value = self._file_handler
+
+    def tearDown(self):
+        reload(invoice_renderer)
+
+    def test_is_invoice_pending(self):
+        self._collection.find_one.side_effect = [self._job, None]
+
+        self.assertTrue(invoice_renderer.is_invoice_pending("invoice.pdf"))
+        self.assertFalse(invoice_renderer.is_invoice_pending("invoice.pdf"))
+
+        self._collection.find_one.assert_called_with({"name": "invoice.pdf", "state": {"$ne": invoice_renderer.FAILED}})
+
+    def test_enqueue_invoice(self):
+        invoice_renderer.enqueue_invoice(TEMPLATE, "invoice.pdf")
+
+        job = self._collection.insert_one.call_args[0][0]
+        self.assertEquals("invoice.pdf", job["name"])
+        self.assertEquals(TEMPLATE, job["html"])
+        self.assertEquals("pending", job["state"])
+        self.assertEquals(0, job["attempts"])
+
+    def test_process_job(self):
+        renderer = invoice_renderer.InvoiceRenderer()
+        self.assertTrue(renderer.process_job())
+
+        scratch = BILL_ROOT + "/.scratch/invoice_1"
+        invoice_renderer.os.makedirs.assert_called_once_with(BILL_ROOT + "/.scratch", exist_ok=True)
+        invoice_renderer.tempfile.mkdtemp.assert_called_once_with(prefix="invoice_", dir=BILL_ROOT + "/.scratch")
+
+        invoice_renderer.codecs.open.assert_called_once_with(scratch + "/invoice.html", "wb", "utf-8")
         self._file_handler.write.assert_called_once_with(TEMPLATE)
-        self._file_handler.close.assert_called_once_with()
 
-        invoice_builder.subprocess.call.assert_called_once_with(
-            [BASEDIR + "/create_invoice.sh", html_path, BILL_ROOT + "/" + invoice_name]
+        invoice_renderer.subprocess.run.assert_called_once_with(
+            [BASEDIR + "/create_invoice.sh", scratch + "/invoice.html", scratch + "/invoice.pdf"], timeout=120
         )
+        invoice_renderer.os.replace.assert_called_once_with(scratch + "/invoice.pdf", BILL_ROOT + "/invoice.pdf")
+        invoice_renderer.shutil.rmtree.assert_called_once_with(scratch, ignore_errors=True)
+
+        self._collection.delete_one.assert_called_once_with({"_id": "job1"})
+
+    def test_process_job_empty(self):
+        self._collection.find_one_and_update.return_value = None
+
+        renderer = invoice_renderer.InvoiceRenderer()
+        self.assertFalse(renderer.process_job())
+        self.assertEquals(0, invoice_renderer.subprocess.run.call_count)
+
+    @parameterized.expand([("retry", 0, "pending"), ("give_up", 4, "failed")])
+    def test_process_job_error(self, name, attempts, exp_state):
+        self._job["attempts"] = attempts
+        invoice_renderer.os.path.exists.return_value = False
+
+        renderer = invoice_renderer.InvoiceRenderer()
+        self.assertTrue(renderer.process_job())
+
+        self.assertEquals(0, invoice_renderer.os.replace.call_count)
+        invoice_renderer.shutil.rmtree.assert_called_once_with(BILL_ROOT + "/.scratch/invoice_1", ignore_errors=True)
+        self.assertEquals(0, self._collection.delete_one.call_count)
 
-        invoice_builder.os.listdir.assert_called_once_with(BILL_ROOT)
-        invoice_builder.os.remove.assert_called_once_with(BILL_ROOT + "/file1.html")
+        update = self._collection.update_one.call_args[0][1]["$set"]
+        self.assertEquals(attempts + 1, update["attempts"])
+        self.assertEquals(exp_state, update["state"])
+        self.assertEquals(exp_state == "pending", "next_attempt" in update)
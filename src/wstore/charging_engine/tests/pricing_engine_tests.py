@@ -18,12 +18,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import datetime
+from decimal import Decimal
+
 from django.test import TestCase
 from django.test.utils import override_settings
 
 from parameterized import parameterized
-from mock import MagicMock, patch
+from mock import ANY, MagicMock, patch
 
 from wstore.charging_engine import pricing_engine
 
@@ -265,6 +266,19 @@ RESULT_USAGE_POP = [
     }
 ]
 
+RESULT_USAGE_POP_ACCUMULATED = [
+    {
+        "priceType": "usage",
+        "recurringChargePeriod": "month",
+        "price": {
+            "taxRate": "0",
+            "dutyFreeAmount": {"unit": "EUR", "value": "5.25"},
+            "taxIncludedAmount": {"unit": "EUR", "value": "5.25"},
+        },
+        "priceAlteration": [],
+    }
+]
+
 RESULT_MULTIPLE_USAGE_POP = [
     {
         "priceType": "usage",
@@ -369,6 +383,21 @@ USAGE_1 = [
     }
 ]
 
+USAGE_2 = [
+    {
+        "usageSpecification": {"id": "urn:ngsi-ld:usageSpecification:1"},
+        "usageCharacteristic": [{"name": "ram_gb", "value": 4}, {"name": "cpu", "value": 2}],
+    },
+    {
+        "usageSpecification": {"id": "urn:ngsi-ld:usageSpecification:2"},
+        "usageCharacteristic": [{"name": "ram_gb", "value": 100}],
+    },
+    {
+        "usageSpecification": {"id": "urn:ngsi-ld:usageSpecification:1"},
+        "usageCharacteristic": [{"name": "ram_gb", "value": 6.5}],
+    },
+]
+
 OFFPARTY = [
     {
         "id": "urn:ngsi-ld:organization:mocked",
@@ -429,52 +458,6 @@ OFFPARTY_ONLY_CUSTOMER = [
 ]
 OFFPARTY_EMPTY = []
 
-ST_VAT = {
-    "memberState": "ES",
-    "type": "STANDARD",
-    "rate": {"type": "DEFAULT", "value": 21.0},
-    "situationOn": datetime.date(2025, 7, 1),
-    "cnCodes": None,
-    "cpaCodes": None,
-    "category": None,
-    "comment": None,
-}
-
-ST_VAT_DECIMAL = {
-    "memberState": "ES",
-    "type": "STANDARD",
-    "rate": {"type": "DEFAULT", "value": 20.2},
-    "situationOn": datetime.date(2025, 7, 1),
-    "cnCodes": None,
-    "cpaCodes": None,
-    "category": None,
-    "comment": None,
-}
-
-ST_VAT_SCND = {
-    "memberState": "ES",
-    "type": "STANDARD",
-    "rate": {"type": "DEFAULT", "value": 7.0},
-    "situationOn": datetime.date(2025, 7, 1),
-    "cnCodes": None,
-    "cpaCodes": None,
-    "category": None,
-    "comment": "VAT - Canary Islands - ",
-}
-
-RD_VAT = {
-    "memberState": "ES",
-    "type": "REDUCED",
-    "rate": {"type": "REDUCED_RATE", "value": 10.0},
-    "situationOn": datetime.date(2025, 7, 1),
-    "cnCodes": None,
-    "cpaCodes": None,
-    "category": {"identifier": "mock id", "description": "mock description"},
-    "comment": "mock comment",
-}
-
-NOW = datetime.date(2024, 1, 1)
-
 
 @override_settings(
     ADMIN_ROLE="provider",
@@ -485,85 +468,44 @@ class ChargingEngineTestCase(TestCase):
     tags = ("ordering", "billing", "pricing")
     maxDiff = None
 
-    def _mock_simple_pop(self):
-        pricing_engine.requests = MagicMock()
-        pricing_engine.requests.get.return_value.json.return_value = SIMPLE_POP
+    def setUp(self):
+        pricing_engine.PRICE_PLAN_CACHE.clear()
 
-    def _mock_multiple_pop(self):
-        pricing_engine.requests = MagicMock()
-        plan_call = MagicMock()
-        plan_call.json.return_value = MULTIPLE_POP
+    def _mock_pops(self, plan, components=[]):
+        # Bundled components are downloaded in parallel, so responses are selected by URL
+        responses = {pop["id"]: component for pop, component in zip(plan.get("bundledPopRelationship", []), components)}
 
-        onetime_call = MagicMock()
-        onetime_call.json.return_value = SIMPLE_POP
+        def get(url, **kwargs):
+            response = MagicMock()
+            response.json.return_value = responses.get(url.rsplit("/", 1)[-1], plan)
+            return response
 
-        recurring_call = MagicMock()
-        recurring_call.json.return_value = RECURRING_POP
+        pricing_engine.http_client = MagicMock()
+        pricing_engine.http_client.get.side_effect = get
 
-        tailored_call = MagicMock()
-        tailored_call.json.return_value = TAILORED_POP
+    def _mock_simple_pop(self):
+        self._mock_pops(SIMPLE_POP)
 
-        pricing_engine.requests.get.side_effect = [plan_call, onetime_call, recurring_call, tailored_call]
+    def _mock_multiple_pop(self):
+        self._mock_pops(MULTIPLE_POP, [SIMPLE_POP, RECURRING_POP, TAILORED_POP])
 
     def _mock_multiple_filter_pop(self):
-        pricing_engine.requests = MagicMock()
-        plan_call = MagicMock()
-        plan_call.json.return_value = MULTIPLE_POP_FILTER
-
-        filter_call1 = MagicMock()
-        filter_call1.json.return_value = FILTER_POP_1
-
-        filter_call2 = MagicMock()
-        filter_call2.json.return_value = FILTER_POP_2
-
-        pricing_engine.requests.get.side_effect = [plan_call, filter_call1, filter_call2]
+        self._mock_pops(MULTIPLE_POP_FILTER, [FILTER_POP_1, FILTER_POP_2])
 
     def _mock_usage_pop(self):
-        pricing_engine.requests = MagicMock()
-        pricing_engine.requests.get.return_value.json.return_value = USAGE_POP
+        self._mock_pops(USAGE_POP)
 
     def _mock_multiple_usage_pop(self):
-        pricing_engine.requests = MagicMock()
-        plan_call = MagicMock()
-        plan_call.json.return_value = MULTIPLE_POP_FILTER
-
-        usage_call1 = MagicMock()
-        usage_call1.json.return_value = USAGE_TAILORED_POP
-
-        usage_call2 = MagicMock()
-        usage_call2.json.return_value = SIMPLE_POP
-
-        pricing_engine.requests.get.side_effect = [plan_call, usage_call1, usage_call2]
+        self._mock_pops(MULTIPLE_POP_FILTER, [USAGE_TAILORED_POP, SIMPLE_POP])
 
     def _mock_multiple_onetime_pop(self):
-        pricing_engine.requests = MagicMock()
-        plan_call = MagicMock()
-        plan_call.json.return_value = MULTIPLE_POP_SAME_TYPE
-
-        onetime_call1 = MagicMock()
-        onetime_call1.json.return_value = SIMPLE_POP
-
-        onetime_call2 = MagicMock()
-        onetime_call2.json.return_value = SIMPLE_POP_2
-
-        pricing_engine.requests.get.side_effect = [plan_call, onetime_call1, onetime_call2]
+        self._mock_pops(MULTIPLE_POP_SAME_TYPE, [SIMPLE_POP, SIMPLE_POP_2])
 
     def _mock_simple_pop_no_name(self):
-        pricing_engine.requests = MagicMock()
-        pricing_engine.requests.get.return_value.json.return_value = SIMPLE_POP_NO_NAME
+        self._mock_pops(SIMPLE_POP_NO_NAME)
 
     def _mock_multiple_usage_same_type_pop(self):
-        pricing_engine.requests = MagicMock()
-        plan_call = MagicMock()
-        plan_call.json.return_value = MULTIPLE_POP_USAGE_SAME_TYPE
-
-        usage_call1 = MagicMock()
-        usage_call1.json.return_value = USAGE_POP
-
-        usage_call2 = MagicMock()
-        usage_call2.json.return_value = USAGE_POP_2
-
-        pricing_engine.requests.get.side_effect = [plan_call, usage_call1, usage_call2]
+        self._mock_pops(MULTIPLE_POP_USAGE_SAME_TYPE, [USAGE_POP, USAGE_POP_2])
 
     @parameterized.expand(
         [
@@ -578,6 +520,7 @@ class ChargingEngineTestCase(TestCase):
             ("multiple_component_options", DATA_WITH_OPTIONS, _mock_multiple_pop, RESULT_MULTIPLE_POP, 0),
             ("multiple_component_filter", DATA_WITH_OPTIONS, _mock_multiple_filter_pop, RESULT_FILTER_POP, 0),
             ("single_component_usage", BASE_DATA, _mock_usage_pop, RESULT_USAGE_POP, 0, USAGE_1),
+            ("single_component_usage_accumulated", BASE_DATA, _mock_usage_pop, RESULT_USAGE_POP_ACCUMULATED, 0, USAGE_2),
             (
                 "multiple_component_usage_tailored",
                 DATA_WITH_OPTIONS,
@@ -601,6 +544,133 @@ class ChargingEngineTestCase(TestCase):
 
         self.assertEquals(result, expected_result)
 
+    def test_calculate_prices_cached_plan(self):
+        self._mock_multiple_pop()
+
+        to_test = pricing_engine.PriceEngine()
+        to_test._calculate_taxes = MagicMock(return_value=0)
+
+        to_test.calculate_prices(DATA_WITH_OPTIONS)
+        result = to_test.calculate_prices(DATA_WITH_OPTIONS)
+
+        self.assertEquals(result, RESULT_MULTIPLE_POP)
+        self.assertEquals(4, pricing_engine.http_client.get.call_count)
+        self.assertEquals(1, pricing_engine.PRICE_PLAN_CACHE.hits)
+
+    def test_calculate_order_prices(self):
+        self._mock_simple_pop()
+
+        to_test = pricing_engine.PriceEngine()
+        to_test._calculate_taxes = MagicMock(return_value=20.0)
+
+        item = BASE_DATA["productOrderItem"][0]
+        data = {
+            "productOrderItem": [dict(item, id="1"), dict(item, id="2"), {"id": "3", "product": {}}],
+            "relatedParty": [],
+            "billingAccount": {"resolved": {}},
+        }
+
+        result = to_test.calculate_order_prices(data)
+
+        self.assertEquals(
+            {
+                "orderTotalPrice": [
+                    {
+                        "priceType": "one time",
+                        "recurringChargePeriod": "onetime",
+                        "price": {
+                            "taxRate": "20.0",
+                            "dutyFreeAmount": {"unit": "EUR", "value": "20.0"},
+                            "taxIncludedAmount": {"unit": "EUR", "value": "24.00"},
+                        },
+                        "priceAlteration": [],
+                    }
+                ],
+                "productOrderItem": [
+                    {"id": "1", "itemTotalPrice": RESULT_SIMPLE_POP},
+                    {"id": "2", "itemTotalPrice": RESULT_SIMPLE_POP},
+                    {"id": "3", "itemTotalPrice": []},
+                ],
+            },
+            result,
+        )
+
+        # Shared price plans and parties are only processed once
+        self.assertEquals(1, pricing_engine.http_client.get.call_count)
+        to_test._calculate_taxes.assert_called_once_with([], {}, deadline=ANY)
+
+    @parameterized.expand(
+        [
+            ("parallel", 8),
+            ("sequential", 1),
+        ]
+    )
+    def test_calculate_prices_fetch_workers(self, name, max_workers):
+        self._mock_multiple_pop()
+
+        to_test = pricing_engine.PriceEngine()
+        to_test._calculate_taxes = MagicMock(return_value=0)
+
+        with override_settings(CONCURRENT_FETCH={"max_workers": max_workers}):
+            result = to_test.calculate_prices(DATA_WITH_OPTIONS)
+
+        self.assertEquals(result, RESULT_MULTIPLE_POP)
+        self.assertEquals(4, pricing_engine.http_client.get.call_count)
+        to_test._calculate_taxes.assert_called_once_with(
+            [], {}, deadline=ANY
+        )
+
+    @parameterized.expand(
+        [
+            ("not_modified", "2024-01-01T00:00:00Z", 1),
+            ("modified", "2024-02-01T00:00:00Z", 2),
+        ]
+    )
+    @override_settings(PRICE_PLAN_CACHE={"ttl": 0})
+    def test_get_price_plan_revalidation(self, name, last_update, compiled):
+        to_test = pricing_engine.PriceEngine()
+        to_test.download_pricing = MagicMock(
+            side_effect=[
+                dict(SIMPLE_POP, lastUpdate="2024-01-01T00:00:00Z"),
+                dict(SIMPLE_POP, lastUpdate=last_update),
+            ]
+        )
+
+        first = to_test.get_price_plan("urn:ngsi-ld:productOfferingPrice:1")
+        second = to_test.get_price_plan("urn:ngsi-ld:productOfferingPrice:1")
+
+        self.assertEquals(2, to_test.download_pricing.call_count)
+        self.assertEquals(compiled, len({id(first), id(second)}))
+
+    @parameterized.expand(
+        [
+            ("not_modified", "2024-01-01T00:00:00Z", 1),
+            ("component_modified", "2024-02-01T00:00:00Z", 2),
+            ("component_without_last_update", None, 2),
+        ]
+    )
+    @override_settings(PRICE_PLAN_CACHE={"ttl": 0}, CONCURRENT_FETCH={"max_workers": 1})
+    def test_get_price_plan_revalidation_bundle(self, name, last_update, compiled):
+        bundle = {
+            "isBundle": True,
+            "lastUpdate": "2024-01-01T00:00:00Z",
+            "bundledPopRelationship": [{"id": "urn:ngsi-ld:productOfferingPrice:2"}],
+        }
+        component = dict(SIMPLE_POP, lastUpdate=last_update)
+
+        to_test = pricing_engine.PriceEngine()
+        to_test.download_pricing = MagicMock(
+            side_effect=[bundle, dict(SIMPLE_POP, lastUpdate="2024-01-01T00:00:00Z"), bundle, component]
+        )
+
+        first = to_test.get_price_plan("urn:ngsi-ld:productOfferingPrice:1")
+        second = to_test.get_price_plan("urn:ngsi-ld:productOfferingPrice:1")
+
+        # The components are checked even if the bundle has not changed
+        self.assertEquals(4, to_test.download_pricing.call_count)
+        self.assertEquals(compiled, len({id(first), id(second)}))
+        self.assertEquals(component, second.components[0].pricing)
+
     CUSTOMER_ROLE = "customer"
     PROVIDER_ROLE = "provider"
     ORG = "organization"
@@ -629,6 +699,7 @@ class ChargingEngineTestCase(TestCase):
             ("offering_party_empty", OFFPARTY_EMPTY, ("ES", ORG), ("ES", ORG), None, None),
         ]
     )
+    @override_settings(CONCURRENT_FETCH={"max_workers": 1})
     def test_get_customer_seller(self, _name, related_party, customer_call, seller_call, expected_customer, expected_provider):
         engine = pricing_engine.PriceEngine()
 
@@ -682,7 +753,7 @@ class ChargingEngineTestCase(TestCase):
         engine = pricing_engine.PriceEngine()
 
         with patch("wstore.charging_engine.pricing_engine.get_service_url") as mock_get_service_url, patch(
-            "wstore.charging_engine.pricing_engine.requests.get"
+            "wstore.charging_engine.pricing_engine.http_client.get"
         ) as mock_requests_get:
             mock_get_service_url.return_value = fake_url
 
@@ -706,50 +777,34 @@ class ChargingEngineTestCase(TestCase):
 
     @parameterized.expand(
         [
-            (
-                "same_country",
-                ("ES", "ES"),
-                [ST_VAT, ST_VAT_SCND, RD_VAT],
-                21.0,
-                {"memberStates": {"isoCode": "ES"}, "situationOn": NOW},
-                None,
-            ),
-            ("+different_country", ("ES", "DE"), [], 0, None, None),
-            ("no_country", (None, "DE"), [], 0, None, None),
-            (
-                "error_no_st_vat",
-                ("DE", "DE"),
-                [RD_VAT],
-                0,
-                {"memberStates": {"isoCode": "DE"}, "situationOn": NOW},
-                ValueError,
-            ),
+            ("same_country", ("ES", "ES"), Decimal("21.0"), "ES"),
+            ("+different_country", ("ES", "DE"), 0, None),
+            ("no_country", (None, "DE"), 0, None),
         ]
     )
-    def test_search_ue_taxes(
-        self, name, tuple_countries, vat_results, expected_result, ret_vat_params, expected_exception
-    ):
+    def test_search_ue_taxes(self, name, tuple_countries, expected_result, rate_country):
         engine = pricing_engine.PriceEngine()
 
-        pricing_engine.datetime = MagicMock()
-        pricing_engine.datetime.now.return_value.date.return_value.isoformat.return_value = NOW
-
-        pricing_engine.Client = MagicMock()
-        mockRetrieveVat = pricing_engine.Client.return_value.service.retrieveVatRates
-        if not expected_exception:
-            mockRetrieveVat.return_value.vatRateResults = vat_results
-        else:
-            mockRetrieveVat.side_effects = expected_exception
+        pricing_engine.VAT_RATES = MagicMock()
+        pricing_engine.VAT_RATES.get_rate.return_value = Decimal("21.0")
 
         customer_country, seller_country = tuple_countries
-        if expected_exception:
-            with self.assertRaises(expected_exception):
-                engine._search_ue_taxes(OFFPARTY, customer_country, seller_country)
+        result = engine._search_ue_taxes(OFFPARTY, customer_country, seller_country)
+
+        self.assertEquals(result, expected_result)
+        if rate_country is not None:
+            pricing_engine.VAT_RATES.get_rate.assert_called_once_with(rate_country)
         else:
-            result = engine._search_ue_taxes(OFFPARTY, customer_country, seller_country)
-            if ret_vat_params:
-                mockRetrieveVat.assert_called_once_with(**ret_vat_params)
-            self.assertEquals(result, expected_result)
+            pricing_engine.VAT_RATES.get_rate.assert_not_called()
+
+    def test_search_ue_taxes_unavailable(self):
+        engine = pricing_engine.PriceEngine()
+
+        pricing_engine.VAT_RATES = MagicMock()
+        pricing_engine.VAT_RATES.get_rate.side_effect = ValueError("Standard VAT rate unavailable")
+
+        with self.assertRaises(ValueError):
+            engine._search_ue_taxes(OFFPARTY, "DE", "DE")
 
     @parameterized.expand([
         (
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import MagicMock, call
+from parameterized import parameterized
+
+from wstore.charging_engine import vat_rates
+from wstore.charging_engine.models import VatRate
+
+ST_VAT = {
+    "memberState": "ES",
+    "type": "STANDARD",
+    "rate": {"type": "DEFAULT", "value": 21.0},
+    "situationOn": datetime.date(2025, 7, 1),
+    "cnCodes": None,
+    "cpaCodes": None,
+    "category": None,
+    "comment": None,
+}
+
+ST_VAT_SCND = {
+    "memberState": "ES",
+    "type": "STANDARD",
+    "rate": {"type": "DEFAULT", "value": 7.0},
+    "situationOn": datetime.date(2025, 7, 1),
+    "cnCodes": None,
+    "cpaCodes": None,
+    "category": None,
+    "comment": "VAT - Canary Islands - ",
+}
+
+RD_VAT = {
+    "memberState": "ES",
+    "type": "REDUCED",
+    "rate": {"type": "REDUCED_RATE", "value": 10.0},
+    "situationOn": datetime.date(2025, 7, 1),
+    "cnCodes": None,
+    "cpaCodes": None,
+    "category": {"identifier": "mock id", "description": "mock description"},
+    "comment": "mock comment",
+}
+
+
+def _build_rate(country, valid_from, rate, updated_at=datetime.datetime(2025, 7, 1)):
+    vat_rate = MagicMock()
+    vat_rate.country = country
+    vat_rate.category = "standard"
+    vat_rate.valid_from = valid_from
+    vat_rate.rate = rate
+    vat_rate.updated_at = updated_at
+    return vat_rate
+
+
+class VatRatesTestCase(TestCase):
+    tags = ("pricing", "vat")
+
+    def setUp(self):
+        vat_rates.VatRate = MagicMock()
+        vat_rates.VAT_RATES = vat_rates.VatRateTable()
+
+        vat_rates.Client = MagicMock()
+        self._retrieve_vat = vat_rates.Client.return_value.service.retrieveVatRates
+
+    @parameterized.expand(
+        [
+            ("single_standard", [ST_VAT, RD_VAT], ["ES"]),
+            ("several_standard", [ST_VAT_SCND, ST_VAT, RD_VAT], ["ES"]),
+            ("no_standard", [RD_VAT], []),
+        ]
+    )
+    def test_refresh_vat_rates(self, name, results, expected):
+        self._retrieve_vat.return_value.vatRateResults = results
+
+        updated = vat_rates.refresh_vat_rates(["ES"])
+
+        self.assertEquals(expected, updated)
+        self.assertEquals(1, self._retrieve_vat.call_count)
+        self.assertEquals({"isoCode": "ES"}, self._retrieve_vat.call_args[1]["memberStates"])
+
+        if len(expected) > 0:
+            update_call = vat_rates.VatRate.objects.update_or_create.call_args
+            self.assertEquals("ES", update_call[1]["country"])
+            self.assertEquals("standard", update_call[1]["category"])
+            self.assertEquals(datetime.date(2025, 7, 1), update_call[1]["valid_from"].date())
+            self.assertEquals("21.0", update_call[1]["defaults"]["rate"])
+        else:
+            vat_rates.VatRate.objects.update_or_create.assert_not_called()
+
+    def test_refresh_vat_rates_model_values(self):
+        saved = []
+
+        def save_rate(defaults, **kwargs):
+            # Prepare the values of the real model as done when saving it
+            vat_rate = VatRate(**kwargs, **defaults)
+            saved.append(
+                {
+                    field.attname: field.get_db_prep_save(getattr(vat_rate, field.attname), connection)
+                    for field in VatRate._meta.concrete_fields
+                }
+            )
+            return vat_rate, True
+
+        vat_rates.VatRate.objects.update_or_create.side_effect = save_rate
+        self._retrieve_vat.return_value.vatRateResults = [ST_VAT]
+
+        self.assertEquals(["ES"], vat_rates.refresh_vat_rates(["ES"]))
+
+        self.assertEquals(1, len(saved))
+        self.assertEquals(datetime.datetime(2025, 7, 1), saved[0]["valid_from"])
+        self.assertIsNone(saved[0]["updated_at"].tzinfo)
+        self.assertEquals("21.0", saved[0]["rate"])
+
+    def test_refresh_vat_rates_service_error(self):
+        self._retrieve_vat.side_effect = [Exception("Service unavailable"), MagicMock(vatRateResults=[ST_VAT])]
+
+        updated = vat_rates.refresh_vat_rates(["DE", "ES"])
+
+        self.assertEquals(["ES"], updated)
+
+    @parameterized.expand(
+        [
+            ("current", "ES", datetime.date(2025, 8, 1), Decimal("21.0")),
+            ("previous", "ES", datetime.date(2024, 8, 1), Decimal("20.0")),
+            ("before_first", "ES", datetime.date(2020, 1, 1), Decimal("20.0")),
+            ("greece", "gr", datetime.date(2025, 8, 1), Decimal("24.0")),
+        ]
+    )
+    def test_get_rate(self, name, country, date, expected):
+        vat_rates.VatRate.objects.all.return_value = [
+            _build_rate("ES", datetime.datetime(2025, 7, 1), "21.0"),
+            _build_rate("EL", datetime.datetime(2025, 7, 1), "24.0"),
+            _build_rate("ES", datetime.datetime(2024, 1, 1), "20.0"),
+        ]
+
+        self.assertEquals(expected, vat_rates.VAT_RATES.get_rate(country, date=date))
+        self.assertEquals(expected, vat_rates.VAT_RATES.get_rate(country, date=date))
+
+        # The table is only loaded once
+        vat_rates.VatRate.objects.all.assert_called_once_with()
+
+    def test_get_rate_unavailable(self):
+        vat_rates.VatRate.objects.all.return_value = []
+
+        with self.assertRaises(ValueError):
+            vat_rates.VAT_RATES.get_rate("ES")
+
+    @override_settings(VAT_RATES={"reload_interval": 0})
+    def test_get_rate_reload_error(self):
+        vat_rates.VatRate.objects.all.side_effect = [
+            [_build_rate("ES", datetime.datetime(2024, 1, 1), "21.0")],
+            Exception("Error"),
+        ]
+
+        vat_rates.VAT_RATES.get_rate("ES")
+
+        # Previous rates are used if the table cannot be reloaded
+        self.assertEquals(Decimal("21.0"), vat_rates.VAT_RATES.get_rate("ES"))
+        self.assertEquals([call(), call()], vat_rates.VatRate.objects.all.call_args_list)
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal
+from logging import getLogger
+
+from django.conf import settings
+from zeep import Client, Settings
+
+from wstore.charging_engine.models import VatRate
+
+WSDL_URL = "https://ec.europa.eu/taxation_customs/tedb/ws/VatRetrievalService.wsdl"
+ENDPOINT_URL = "https://ec.europa.eu/taxation_customs/tedb/ws/"
+
+STANDARD = "standard"
+
+# ISO codes used by the EU VAT retrieval service
+EU_MEMBER_STATES = "AT BE BG CY CZ DE DK EE EL ES FI FR HR HU IE IT LT LU LV MT NL PL PT RO SE SI SK".split()
+
+logger = getLogger("wstore.default_logger")
+
+
+def get_vat_country_code(country):
+    # Greece in fiscal contexts uses EL as country code
+    return country.upper() if country.lower() != "gr" else "EL"
+
+
+def _select_standard_rate(results):
+    standard = [item for item in results if "type" in item and item["type"].lower() == STANDARD]
+
+    if len(standard) == 1:
+        return standard[0]
+
+    # Several standard rates are returned for countries with special
+    # territories, the general one is the one without comment
+    for vat in standard:
+        if vat["comment"] is None:
+            return vat
+
+    return None
+
+
+def refresh_vat_rates(countries=None):
+    """
+    Downloads the current standard VAT rates from the EU VAT retrieval service
+    and stores them in the database. Returns the list of countries updated
+    """
+    client = Client(wsdl=WSDL_URL, settings=Settings())
+
+    # Change endpoint manually (if the WSDL points to HTTP instead of HTTPS)
+    client.service._binding_options["address"] = ENDPOINT_URL
+
+    today = datetime.utcnow().date()
+    updated = []
+
+    for country in countries or EU_MEMBER_STATES:
+        try:
+            response = client.service.retrieveVatRates(memberStates={"isoCode": country}, situationOn=today.isoformat())
+            vat = _select_standard_rate(response.vatRateResults)
+        except Exception as e:
+            logger.error(f"Error retrieving VAT rates of {country}: {e}")
+            continue
+
+        if vat is None:
+            logger.error(f"Standard VAT rate unavailable for {country}")
+            continue
+
+        situation_on = vat["situationOn"] or today
+        valid_from = datetime(situation_on.year, situation_on.month, situation_on.day)
+
+        VatRate.objects.update_or_create(
+            country=country,
+            category=STANDARD,
+            valid_from=valid_from,
+            defaults={"rate": str(vat["rate"]["value"]), "updated_at": datetime.utcnow()},
+        )
+        updated.append(country)
+
+    VAT_RATES.invalidate()
+    return updated
+
+
+class VatRateTable:
+    """
+    In-memory copy of the stored VAT rates, reloaded from the database
+    periodically so refreshes made by other processes are picked up
+    """
+
+    def __init__(self):
+        self._rates = None
+        self._loaded = 0
+        self._last_update = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._rates = None
+
+    def _load(self):
+        rates = {}
+        last_update = None
+
+        for vat_rate in VatRate.objects.all():
+            rates.setdefault((vat_rate.country, vat_rate.category), []).append(
+                (vat_rate.valid_from.date(), Decimal(vat_rate.rate))
+            )
+
+            if last_update is None or vat_rate.updated_at > last_update:
+                last_update = vat_rate.updated_at
+
+        for key in rates:
+            rates[key].sort(key=lambda rate: rate[0])
+
+        self._rates = {
+            key: ([rate[0] for rate in values], [rate[1] for rate in values]) for key, values in rates.items()
+        }
+        self._last_update = last_update
+        self._loaded = time.monotonic()
+
+    def _get_rates(self):
+        options = getattr(settings, "VAT_RATES", {})
+
+        if self._rates is None or time.monotonic() - self._loaded > options.get("reload_interval", 600):
+            with self._lock:
+                try:
+                    self._load()
+                except Exception as e:
+                    if self._rates is None:
+                        raise
+
+                    # Keep serving the rates already in memory
+                    logger.error(f"Error reloading VAT rates: {e}")
+                    self._loaded = time.monotonic()
+
+            max_age = options.get("max_age", 7 * 24 * 3600)
+            if self._last_update is not None and (datetime.utcnow() - self._last_update).total_seconds() > max_age:
+                logger.warning("Stored VAT rates are stale, run the refresh_vat_rates command")
+
+        return self._rates
+
+    def get_rate(self, country, category=STANDARD, date=None):
+        """
+        Returns the VAT rate of the given country valid at the given date (today by default)
+        """
+        if date is None:
+            date = datetime.utcnow().date()
+
+        valid_from, rates = self._get_rates().get((get_vat_country_code(country), category), ([], []))
+        if len(rates) == 0:
+            raise ValueError(f"{category.capitalize()} VAT rate unavailable for the selected country.")
+
+        position = bisect_right(valid_from, date)
+        if position == 0:
+            # All the stored rates start later, use the closest one
+            logger.warning(f"No VAT rate of {country} valid at {date}, using the one from {valid_from[0]}")
+            position = 1
+
+        return rates[position - 1]
+
+
+VAT_RATES = VatRateTable()
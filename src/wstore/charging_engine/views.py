@@ -416,7 +416,7 @@ class PaymentPreview(Resource):
                 usage = data["usage"]
 
             price_engine = PriceEngine()
-            response = {"orderTotalPrice": price_engine.calculate_prices(order, usage=usage)}
+            response = price_engine.calculate_order_prices(order, usage=usage)
         except Exception as e:
             return build_response(request, 400, f"Invalid order format: {e}")
 
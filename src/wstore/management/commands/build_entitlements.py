@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from django.core.management.base import BaseCommand
+
+from wstore.asset_manager.entitlements import ENTITLEMENT_COLLECTION, build_entitlements
+from wstore.store_commons.database import get_database_connection
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild the entitlements even if they already exist")
+
+    def handle(self, *args, **options):
+        """
+        Creates the index of assets acquired by each organization from the existing orders
+        """
+        db = get_database_connection()
+
+        if not options["force"] and db[ENTITLEMENT_COLLECTION].find_one({}, {"_id": 1}) is not None:
+            self.stdout.write("Entitlements already created, use --force to rebuild them\n")
+            return
+
+        processed = build_entitlements()
+        self.stdout.write(f"Entitlements created for {processed} contracts\n")
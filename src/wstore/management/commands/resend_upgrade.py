@@ -19,12 +19,15 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from datetime import datetime, timedelta
+
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
-from wstore.asset_manager.inventory_upgrader import InventoryUpgrader
+from wstore.asset_manager.inventory_upgrader import CHECKPOINT_COLLECTION, InventoryUpgrader
 from wstore.asset_manager.models import Resource
 from wstore.models import Context
-from wstore.store_commons.database import DocumentLock
+from wstore.store_commons.database import DocumentLock, get_database_connection
 
 
 class Command(BaseCommand):
@@ -75,3 +78,31 @@ class Command(BaseCommand):
 
         # Release Context object
         lock.unlock_document()
+
+        # Resume the upgrades interrupted before completion. This is done once the context
+        # is released, as the resumed upgrades save their own failed products
+        self._resume_interrupted()
+
+    def _resume_interrupted(self):
+        resume_after = getattr(settings, "INVENTORY_UPGRADER", {}).get("resume_after", 600)
+        limit = datetime.utcnow() - timedelta(seconds=resume_after)
+
+        checkpoints = get_database_connection()[CHECKPOINT_COLLECTION]
+        while True:
+            # Claim a stale checkpoint refreshing its update date, so it is not resumed by other
+            # runs. The resumed upgrade takes its ownership, stopping the interrupted one if alive
+            checkpoint = checkpoints.find_one_and_update(
+                {"updated_at": {"$lt": limit}}, {"$set": {"updated_at": datetime.utcnow()}}, {"_id": 1}
+            )
+
+            if checkpoint is None:
+                break
+
+            try:
+                asset = Resource.objects.get(pk=checkpoint["_id"])
+            except Resource.DoesNotExist:
+                checkpoints.delete_one({"_id": checkpoint["_id"]})
+                continue
+
+            self.stdout.write(f"Resuming the upgrade of the inventory products of asset {asset.pk}\n")
+            InventoryUpgrader(asset).run()
@@ -176,6 +176,12 @@ class ResendUpgradeTestCase(TestCase):
 
         resend_upgrade.Resource = MagicMock()
 
+        self._checkpoints = MagicMock()
+        self._checkpoints.find_one_and_update.return_value = None
+        resend_upgrade.get_database_connection = MagicMock(
+            return_value={resend_upgrade.CHECKPOINT_COLLECTION: self._checkpoints}
+        )
+
     def _check_context_calls(self):
         resend_upgrade.Context.objects.all.assert_called_once_with()
         resend_upgrade.Context.objects.get.assert_called_once_with(pk=self._ctx_pk)
@@ -247,6 +253,24 @@ class ResendUpgradeTestCase(TestCase):
         self._lock_inst.wait_document.assert_called_once_with()
         self._lock_inst.unlock_document.assert_called_once_with()
 
+    def test_resend_upgrades_resume_interrupted(self):
+        self._ctx_inst.failed_upgrades = []
+        self._checkpoints.find_one_and_update.side_effect = [{"_id": "1"}, None]
+
+        asset = MagicMock(pk="1")
+        resend_upgrade.Resource.objects.get.return_value = asset
+
+        call_command("resend_upgrade")
+
+        # Checkpoints are claimed one by one before being resumed
+        self.assertEquals(
+            [call({"updated_at": {"$lt": ANY}}, {"$set": {"updated_at": ANY}}, {"_id": 1})] * 2,
+            self._checkpoints.find_one_and_update.call_args_list,
+        )
+        resend_upgrade.Resource.objects.get.assert_called_once_with(pk="1")
+        resend_upgrade.InventoryUpgrader.assert_called_once_with(asset)
+        self._upg_inst.run.assert_called_once_with()
+
     def test_pending_upgrades_no_context(self):
         resend_upgrade.Context.objects.all.return_value = []
 
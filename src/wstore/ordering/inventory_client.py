@@ -30,6 +30,7 @@ from urllib.parse import urljoin, urlparse
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
+from wstore.store_commons import http_client
 from wstore.store_commons.utils.url import get_service_url
 from wstore.store_commons.utils.party import get_operator_party_roles, normalize_party_ref
 from wstore.ordering.models import PendingTermination
@@ -51,7 +52,7 @@ class InventoryClient:
     def get_hubs(self):
         url = get_service_url("inventory", "/hub")
 
-        r = requests.get(url)
+        r = http_client.get(url)
         r.raise_for_status()
         return r.json()
 
@@ -69,7 +70,7 @@ class InventoryClient:
             callback = {"callback": callback_url}
 
             url = get_service_url("inventory", "/hub")
-            r = requests.post(url, json=callback)
+            r = http_client.post(url, json=callback)
 
             if r.status_code != 201 and r.status_code != 409:
                 msg = "It hasn't been possible to create inventory subscription, "
@@ -80,7 +81,7 @@ class InventoryClient:
     def get_product(self, product_id):
         url = get_service_url("inventory", "/product/" + str(product_id))
 
-        r = requests.get(url)
+        r = http_client.get(url)
         r.raise_for_status()
 
         return r.json()
@@ -112,7 +113,7 @@ class InventoryClient:
 
         url = get_service_url("inventory", "/product" + qs[:-1])
 
-        r = requests.get(url)
+        r = http_client.get(url)
         r.raise_for_status()
 
         return r.json()
@@ -127,7 +128,7 @@ class InventoryClient:
         url = get_service_url("inventory", "/product/" + str(product_id))
 
         try:
-            response = requests.patch(url, json=patch_body)
+            response = http_client.patch(url, json=patch_body)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             raise
@@ -195,13 +196,13 @@ class InventoryClient:
         try:
             for resource_id in resource_ids:
                 resource_url = get_service_url("resource_inventory", "/resource/" + str(resource_id))
-                response = requests.patch(resource_url, json={"resourceStatus": "suspended"}, verify=settings.VERIFY_REQUESTS)
+                response = http_client.patch(resource_url, json={"resourceStatus": "suspended"}, verify=settings.VERIFY_REQUESTS)
                 response.raise_for_status()
                 patched_resources.append(resource_id)
 
             for service_id in service_ids:
                 service_url = get_service_url("service_inventory", "/service/" + str(service_id))
-                response = requests.patch(service_url, json={"state": "terminated"}, verify=settings.VERIFY_REQUESTS)
+                response = http_client.patch(service_url, json={"state": "terminated"}, verify=settings.VERIFY_REQUESTS)
                 response.raise_for_status()
                 patched_services.append(service_id)
 
@@ -214,18 +215,18 @@ class InventoryClient:
             # Roll back every resource/service already moved to its termination state
             for resource_id in patched_resources:
                 resource_url = get_service_url("resource_inventory", "/resource/" + str(resource_id))
-                requests.patch(resource_url, json={"resourceStatus": "reserved"}, verify=settings.VERIFY_REQUESTS)
+                http_client.patch(resource_url, json={"resourceStatus": "reserved"}, verify=settings.VERIFY_REQUESTS)
 
             for service_id in patched_services:
                 service_url = get_service_url("service_inventory", "/service/" + str(service_id))
-                requests.patch(service_url, json={"state": "reserved"}, verify=settings.VERIFY_REQUESTS)
+                http_client.patch(service_url, json={"state": "reserved"}, verify=settings.VERIFY_REQUESTS)
 
             raise InventoryError(f"TMF api error - {e}")
 
     def create_product(self, product):
         url = get_service_url("inventory", "/product")
 
-        response = requests.post(url, json=product)
+        response = http_client.post(url, json=product)
         response.raise_for_status()
 
         return response.json()
@@ -233,7 +234,7 @@ class InventoryClient:
     ####
     def download_spec(self, catalog_endpoint, spec_path, spec_id):
         spec_url = get_service_url(catalog_endpoint, f"{spec_path}/{spec_id}")
-        resp = requests.get(spec_url, verify=settings.VERIFY_REQUESTS)
+        resp = http_client.get(spec_url, verify=settings.VERIFY_REQUESTS)
         return resp.json()
 
     def build_inventory_char(self, spec_char, value_field):
@@ -277,7 +278,7 @@ class InventoryClient:
 
         resource_url = get_service_url("resource_inventory", "/resource")
 
-        inv_response = requests.post(resource_url, json=resource, verify=settings.VERIFY_REQUESTS)
+        inv_response = http_client.post(resource_url, json=resource, verify=settings.VERIFY_REQUESTS)
         inv_resource = inv_response.json()
 
         return inv_resource["id"]
@@ -302,7 +303,7 @@ class InventoryClient:
             service["description"] = service_spec["description"]
 
         resource_url = get_service_url("service_inventory", "/service")
-        inv_response = requests.post(resource_url, json=service, verify=settings.VERIFY_REQUESTS)
+        inv_response = http_client.post(resource_url, json=service, verify=settings.VERIFY_REQUESTS)
         inv_service = inv_response.json()
         return inv_service["id"]
 
@@ -318,7 +319,7 @@ class InventoryClient:
     def get_price_component(self, price_id):
         price_url = get_service_url("catalog", "/productOfferingPrice/{}".format(price_id))
 
-        resp = requests.get(price_url, verify=settings.VERIFY_REQUESTS)
+        resp = http_client.get(price_url, verify=settings.VERIFY_REQUESTS)
         price = resp.json()
 
         return price
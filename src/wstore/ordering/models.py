@@ -255,6 +255,28 @@ class Order(models.Model):
 
         return result.modified_count > 0
 
+    def update_contract_usage(self, product_id, correlation_number, new_correlation_number, last_usage):
+        # The usage state is only updated if it has not been modified concurrently
+        db = get_database_connection()
+        result = db.wstore_order.update_one(
+            {
+                "_id": self._id,
+                "contracts": {
+                    "$elemMatch": {
+                        "product_id": product_id,
+                        "correlation_number": correlation_number
+                    }
+                }
+            },
+            {
+                "$set": {
+                    "contracts.$.correlation_number": new_correlation_number,
+                    "contracts.$.last_usage": last_usage
+                }
+            }
+        )
+        return result.modified_count > 0
+
     @classmethod
     def get_by_customer_bill_id(_, bill_id):
         db = get_database_connection()
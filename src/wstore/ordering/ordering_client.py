@@ -27,6 +27,7 @@ import requests
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 
+from wstore.store_commons import http_client
 from wstore.store_commons.utils.url import get_service_url
 
 
@@ -48,7 +49,7 @@ class OrderingClient:
         callback = {"callback": urljoin(site, "charging/api/orderManagement/orders")}
 
         url = get_service_url("ordering", "/productOrdering/v2/hub")
-        r = requests.post(url, callback)
+        r = http_client.post(url, callback)
 
         if r.status_code != 200 and r.status_code != 409:
             msg = "It hasn't been possible to create ordering subscription, "
@@ -60,7 +61,7 @@ class OrderingClient:
         path = "/productOrder/" + str(order_id)
 
         url = get_service_url("ordering", path)
-        r = requests.get(url)
+        r = http_client.get(url)
         r.raise_for_status()
 
         return r.json()
@@ -85,13 +86,13 @@ class OrderingClient:
         # Get the order first to avoid losing the order items
 
         try:
-            resp1 = requests.get(url)
+            resp1 = http_client.get(url)
             resp1.raise_for_status()
             prev_order = resp1.json()
 
             patch["productOrderItem"] = prev_order["productOrderItem"]
 
-            response = requests.patch(url, json=patch)
+            response = http_client.patch(url, json=patch)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.error("Error Updating order state: " + str(e))
@@ -129,7 +130,7 @@ class OrderingClient:
         url = get_service_url("ordering", path)
         try:
             logger.info("---PATCH BODY--- : %s", patch)
-            response = requests.patch(url, json=patch)
+            response = http_client.patch(url, json=patch)
             response.raise_for_status()
         except requests.exceptions.HTTPError as e:
             logger.error("Error Updating order items: " + str(e))
@@ -26,7 +26,6 @@ from decimal import Decimal
 from logging import getLogger
 from urllib.parse import urlparse
 
-import requests
 from bson import ObjectId
 from django.conf import settings
 
@@ -38,6 +37,7 @@ from wstore.ordering.errors import OrderingError
 from wstore.ordering.inventory_client import InventoryClient
 from wstore.ordering.models import Contract, Offering, Order
 from wstore.ordering.ordering_client import OrderingClient
+from wstore.store_commons import http_client
 from wstore.store_commons.rollback import rollback
 from wstore.store_commons.utils.url import get_service_url
 from wstore.store_commons.database import get_database_connection
@@ -52,7 +52,7 @@ class OrderingManager:
         self.ordering_client = OrderingClient()
 
     def _download(self, url, element, item_id):
-        r = requests.get(url, verify=settings.VERIFY_REQUESTS)
+        r = http_client.get(url, verify=settings.VERIFY_REQUESTS)
 
         if r.status_code != 200:
             logger.error(f"The {element} specified in order item {item_id} does not exist")
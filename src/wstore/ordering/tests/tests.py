@@ -80,10 +80,10 @@ class OrderingManagementTestCase(TestCase):
         ordering_management.ChargingEngine.return_value = self._charging_inst
 
         # Mock requests
-        ordering_management.requests = MagicMock()
+        ordering_management.http_client = MagicMock()
         self._response = MagicMock()
         self._response.status_code = 200
-        ordering_management.requests.get.return_value = self._response
+        ordering_management.http_client.get.return_value = self._response
 
         # Mock organization model
         self._org_inst = MagicMock()
@@ -262,7 +262,7 @@ class OrderingManagementTestCase(TestCase):
                 result.status_code = 404
             return result
 
-        ordering_management.requests.get = get
+        ordering_management.http_client.get = get
 
     def _already_owned(self):
         self._offering_inst.pk = "61004aba5e05acc115f022f0"
@@ -480,7 +480,7 @@ class OrderingManagementTestCase(TestCase):
             ordering_management.OrderingClient().update_items_state.assert_called_once()
 
             # Check offering and product downloads
-            self.assertEquals(2, ordering_management.requests.get.call_count)
+            self.assertEquals(2, ordering_management.http_client.get.call_count)
 
             self.assertEquals(
                 [
@@ -493,7 +493,7 @@ class OrderingManagementTestCase(TestCase):
                         verify=True,
                     ),
                 ],
-                ordering_management.requests.get.call_args_list,
+                ordering_management.http_client.get.call_args_list,
             )
 
             self._billing_instance.get_billing_account.assert_called_once_with(BILLING_ACCOUNT["id"])
@@ -548,7 +548,7 @@ class OrderingManagementTestCase(TestCase):
         self.assertEquals([
             call("http://catalog.com/productOffering/20", verify=True),
         ],
-            ordering_management.requests.get.call_args_list,
+            ordering_management.http_client.get.call_args_list,
         )
 
         self._billing_instance.get_billing_account.assert_called_once_with(BILLING_ACCOUNT["id"])
@@ -704,13 +704,13 @@ class OrderingClientTestCase(TestCase):
         ordering_client.settings.LOCAL_SITE = "http://testdomain.com"
 
         # Mock requests
-        ordering_client.requests = MagicMock()
+        ordering_client.http_client = MagicMock()
         self._response = MagicMock()
         self._response.status_code = 200
         self._response.json.return_value = {"id": "1"}
-        ordering_client.requests.post.return_value = self._response
-        ordering_client.requests.patch.return_value = self._response
-        ordering_client.requests.get.return_value = self._response
+        ordering_client.http_client.post.return_value = self._response
+        ordering_client.http_client.patch.return_value = self._response
+        ordering_client.http_client.get.return_value = self._response
 
     def test_ordering_subscription(self):
         client = ordering_client.OrderingClient()
@@ -718,7 +718,7 @@ class OrderingClientTestCase(TestCase):
         client.create_ordering_subscription()
 
         # Check calls
-        ordering_client.requests.post.assert_called_once_with(
+        ordering_client.http_client.post.assert_called_once_with(
             "http://localhost:8080/productOrdering/v2/hub",
             {"callback": "http://testdomain.com/charging/api/orderManagement/orders"},
         )
@@ -776,7 +776,7 @@ class OrderingClientTestCase(TestCase):
 
         self.assertEquals(
             [call("http://localhost:8080/productOrder/20", json=expected)],
-            ordering_client.requests.patch.call_args_list,
+            ordering_client.http_client.patch.call_args_list,
         )
 
         self.assertEquals([call()], self._response.raise_for_status.call_args_list)
@@ -794,16 +794,16 @@ class OrderingClientTestCase(TestCase):
 
         patch_req = MagicMock()
 
-        ordering_client.requests.get.return_value = get_req
-        ordering_client.requests.patch.return_value = patch_req
+        ordering_client.http_client.get.return_value = get_req
+        ordering_client.http_client.patch.return_value = patch_req
 
         client.update_state(order, new_state)
 
-        ordering_client.requests.get.assert_called_once_with(
+        ordering_client.http_client.get.assert_called_once_with(
             "http://localhost:8080/productOrder/" + order["id"],
         )
 
-        ordering_client.requests.patch.assert_called_once_with(
+        ordering_client.http_client.patch.assert_called_once_with(
             "http://localhost:8080/productOrder/" + order["id"],
             json={"state": new_state, "productOrderItem": []},
         )
@@ -818,7 +818,7 @@ class OrderingClientTestCase(TestCase):
 
         self.assertEquals({"id": "1"}, response)
 
-        ordering_client.requests.get.assert_called_once_with(
+        ordering_client.http_client.get.assert_called_once_with(
             "http://localhost:8080/productOrder/1"
         )
         self._response.raise_for_status.assert_called_once_with()
@@ -975,11 +975,11 @@ class InventoryClientTestCase(TestCase):
             }
     def setUp(self):
         # Mock requests
-        inventory_client.requests = MagicMock()
+        inventory_client.http_client = MagicMock()
         self.response = MagicMock()
         self.response.status_code = 201
-        inventory_client.requests.post.return_value = self.response
-        inventory_client.requests.get.return_value = self.response
+        inventory_client.http_client.post.return_value = self.response
+        inventory_client.http_client.get.return_value = self.response
 
         inventory_client.settings.LOCAL_SITE = "http://localhost:8004/"
 
@@ -1013,17 +1013,17 @@ class InventoryClientTestCase(TestCase):
         client = inventory_client.InventoryClient()
         client.create_inventory_subscription()
 
-        inventory_client.requests.get.assert_called_once_with(
+        inventory_client.http_client.get.assert_called_once_with(
             "http://localhost:8080/hub"
         )
 
         if created:
-            inventory_client.requests.post.assert_called_once_with(
+            inventory_client.http_client.post.assert_called_once_with(
                 "http://localhost:8080/hub",
                 json={"callback": "http://localhost:8004/charging/api/orderManagement/products"},
             )
         else:
-            self.assertEquals(0, inventory_client.requests.post.call_count)
+            self.assertEquals(0, inventory_client.http_client.post.call_count)
 
     def test_create_subscription_error(self):
         self.response.json.return_value = []
@@ -1046,64 +1046,64 @@ class InventoryClientTestCase(TestCase):
         client = inventory_client.InventoryClient()
         client.activate_product("1")
 
-        inventory_client.requests.patch.assert_called_once_with(
+        inventory_client.http_client.patch.assert_called_once_with(
             "http://localhost:8080/product/1",
             json={"status": "active", "startDate": "2016-01-22T04:10:25.176751Z"},
         )
-        inventory_client.requests.patch().raise_for_status.assert_called_once_with()
+        inventory_client.http_client.patch().raise_for_status.assert_called_once_with()
 
     def test_suspend_product(self):
         client = inventory_client.InventoryClient()
         client.suspend_product("1")
 
-        inventory_client.requests.patch.assert_called_once_with(
+        inventory_client.http_client.patch.assert_called_once_with(
             "http://localhost:8080/product/1",
             json={"status": "suspended"},
         )
-        inventory_client.requests.patch().raise_for_status.assert_called_once_with()
+        inventory_client.http_client.patch().raise_for_status.assert_called_once_with()
 
     def test_terminate_product(self):
         client = inventory_client.InventoryClient()
         client.terminate_product("1")
 
-        inventory_client.requests.patch.assert_called_once_with(
+        inventory_client.http_client.patch.assert_called_once_with(
             "http://localhost:8080/product/1",
             json={
                 "status": "terminated",
                 "terminationDate": "2016-01-22T04:10:25.176751Z",
             },
         )
-        inventory_client.requests.patch().raise_for_status.assert_called_once_with()
+        inventory_client.http_client.patch().raise_for_status.assert_called_once_with()
 
     def test_terminate_product_with_resource_and_service(self):
-        inventory_client.requests.get.return_value.json.return_value = {
+        inventory_client.http_client.get.return_value.json.return_value = {
             "realizingResource": [{"id": "res-1"}],
             "realizingService": [{"id": "svc-1"}],
         }
         client = inventory_client.InventoryClient()
         client.terminate_product("1")
 
-        calls = inventory_client.requests.patch.call_args_list
+        calls = inventory_client.http_client.patch.call_args_list
         self.assertEqual(len(calls), 3)
         self.assertEqual(calls[0], call("http://localhost:9090/resourceInventory/resource/res-1", json={"resourceStatus": "suspended"}, verify=True))
         self.assertEqual(calls[1], call("http://localhost:7070/serviceInventory/service/svc-1", json={"state": "terminated"}, verify=True))
         self.assertEqual(calls[2][0][0], "http://localhost:8080/product/1")
 
     def test_terminate_product_rollback(self):
-        inventory_client.requests.get.return_value.json.return_value = {
+        inventory_client.http_client.get.return_value.json.return_value = {
             "realizingResource": [{"id": "res-1"}],
             "realizingService": [{"id": "svc-1"}],
         }
         ok_response = MagicMock()
         fail_response = MagicMock()
         fail_response.raise_for_status.side_effect = Exception("api error")
-        inventory_client.requests.patch.side_effect = [ok_response, ok_response, fail_response, ok_response, ok_response]
+        inventory_client.http_client.patch.side_effect = [ok_response, ok_response, fail_response, ok_response, ok_response]
 
         client = inventory_client.InventoryClient()
         with self.assertRaises(inventory_client.InventoryError):
             client.terminate_product("1")
 
-        calls = inventory_client.requests.patch.call_args_list
+        calls = inventory_client.http_client.patch.call_args_list
         self.assertEqual(len(calls), 5)
         self.assertEqual(calls[3], call("http://localhost:9090/resourceInventory/resource/res-1", json={"resourceStatus": "reserved"}, verify=True))
         self.assertEqual(calls[4], call("http://localhost:7070/serviceInventory/service/svc-1", json={"state": "reserved"}, verify=True))
@@ -1112,22 +1112,22 @@ class InventoryClientTestCase(TestCase):
         client = inventory_client.InventoryClient()
         client.get_product("1")
 
-        inventory_client.requests.get.assert_called_once_with(
+        inventory_client.http_client.get.assert_called_once_with(
             "http://localhost:8080/product/1"
         )
-        inventory_client.requests.get().raise_for_status.assert_called_once_with()
+        inventory_client.http_client.get().raise_for_status.assert_called_once_with()
 
     @parameterized.expand([("all", {}, ""), ("filtered", {"id": "1,2,3"}, "?id=1,2,3")])
     def test_get_products(self, name, query, qs):
         client = inventory_client.InventoryClient()
         products = client.get_products(query=query)
 
-        inventory_client.requests.get.assert_called_once_with(
+        inventory_client.http_client.get.assert_called_once_with(
             "http://localhost:8080/product" + qs
         )
-        inventory_client.requests.get().raise_for_status.assert_called_once_with()
+        inventory_client.http_client.get().raise_for_status.assert_called_once_with()
 
-        self.assertEquals(inventory_client.requests.get().json(), products)
+        self.assertEquals(inventory_client.http_client.get().json(), products)
     
     @parameterized.expand([("32", [{'id': 'party:1', 'role': 'Seller'}], {
         "name": "resource",
@@ -1172,7 +1172,7 @@ class InventoryClientTestCase(TestCase):
             
             }, verify = inventory_client.settings.VERIFY_REQUESTS)]
         client.build_inventory_char.assert_called_once()
-        inventory_client.requests.post.assert_has_calls(expected_calls_post, any_order=True)
+        inventory_client.http_client.post.assert_has_calls(expected_calls_post, any_order=True)
 
         
     @parameterized.expand([("32", [{'id': 'party:1', 'role': 'Seller'}], {
@@ -1217,7 +1217,7 @@ class InventoryClientTestCase(TestCase):
             
             }, verify = inventory_client.settings.VERIFY_REQUESTS)]
         client.build_inventory_char.assert_called_once()
-        inventory_client.requests.post.assert_has_calls(expected_calls_post, any_order=True)
+        inventory_client.http_client.post.assert_has_calls(expected_calls_post, any_order=True)
 
 
 class NotifyItemCompletedTestCase(TestCase):
@@ -1265,10 +1265,10 @@ class NotifyItemCompletedTestCase(TestCase):
         ordering_management.BillingClient.return_value = self._billing_client_inst
 
         # Mock requests
-        ordering_management.requests = MagicMock()
+        ordering_management.http_client = MagicMock()
         self._response = MagicMock()
         self._response.status_code = 200
-        ordering_management.requests.get.return_value = self._response
+        ordering_management.http_client.get.return_value = self._response
 
     def _offering_automatic(self):
         return {
@@ -1392,7 +1392,7 @@ class NotifyItemCompletedTestCase(TestCase):
         )
 
         # Verify offering was fetched
-        ordering_management.requests.get.assert_called_once()
+        ordering_management.http_client.get.assert_called_once()
 
         if should_process:
             # Verify inventory product was created
@@ -25,8 +25,9 @@ from logging import getLogger
 from threading import Thread
 
 from django.core.exceptions import ValidationError
+from django.db.utils import DatabaseError
+from pymongo.errors import BulkWriteError
 from wstore.ordering.models import Offering
-from wstore.models import Organization
 from wstore.models import Context
 from wstore.rss.models import CDR
 from wstore.store_commons.database import get_database_connection
@@ -51,20 +52,28 @@ class CDRManager:
             "referenceCode": f"{order.order_id} {contract.item_id}",
         }
 
-    def _generate_cdr_part(self, part, event, description):
+    def _allocate_correlation_numbers(self, count):
         # Create connection for raw database access
         db = get_database_connection()
 
-        # Take and increment the correlation number using
-        # the mongoDB atomic access in order to avoid race
-        # problems
-        corr_number = db.wstore_organization.find_and_modify(
-            query={"_id": self._offering.owner_organization.pk},
-            update={"$inc": {"correlation_number": 1}},
+        # Reserve a contiguous range of correlation numbers for all the CDRs
+        # with a single atomic increment, in order to avoid race problems
+        first = db.wstore_organization.find_one_and_update(
+            {"_id": self._offering.owner_organization.pk},
+            {"$inc": {"correlation_number": count}},
         )["correlation_number"]
 
+        return range(first, first + count)
+
+    def _set_correlation_numbers(self, cdrs):
+        if len(cdrs) == 0:
+            return
+
+        for cdr, corr_number in zip(cdrs, self._allocate_correlation_numbers(len(cdrs))):
+            cdr["correlationNumber"] = str(corr_number)
+
+    def _generate_cdr_part(self, part, event, description):
         cdr_part = {
-            "correlationNumber": str(corr_number),
             "chargedAmount": Decimal(part["value"]),
             "chargedTaxAmount": Decimal(part["value"]) - Decimal(part["duty_free"]),
             "event": event,
@@ -108,6 +117,8 @@ class CDRManager:
                     description = f"Fee per {part['model']['unit']}, Consumption: {use}"
                 cdrs.append(self._generate_cdr_part(use_part, "Pay per use event", description))
 
+        self._set_correlation_numbers(cdrs)
+
         # Send the created CDRs to the Revenue Sharing System
         r = CDRRegistrationThread(cdrs)
         r.start()
@@ -124,6 +135,7 @@ class CDRManager:
 
         description = f"Refund event: {price} {self._cdr_info['currency']}"
         cdrs = [self._generate_cdr_part(aggregated_part, "Refund event", description)]
+        self._set_correlation_numbers(cdrs)
 
         # Send the created CDRs to the Revenue Sharing System
         r = CDRRegistrationThread(cdrs)
@@ -139,26 +151,49 @@ class CDRRegistrationThread(Thread):
         register_cdr(self.cdr_info)
 
 
-def register_cdr(self, cdr_info):
+def _get_failed_indexes(error, total):
+    # The bulk insert is unordered (insert_many(ordered=False) in djongo), so
+    # any of the documents may have failed, not only the ones after the first error
+    while error is not None:
+        if isinstance(error, BulkWriteError):
+            return sorted({write_error["index"] for write_error in error.details.get("writeErrors", [])})
+
+        error = error.__cause__ or error.__context__
+
+    # The result of the insert is unknown
+    return list(range(total))
+
+
+def register_cdr(cdr_info):
+    """
+    Validates the given CDRs and saves the valid ones with a single bulk
+    insert. Returns the CDRs that could not be registered with the reason
+    """
     failed_cdrs = []
+    cdrs = []
+
     for cdr_record in cdr_info:
         try:
             cdr = CDR(**cdr_record)
             cdr.full_clean()
-            cdr.save()
-
+            cdrs.append((cdr_record, cdr))
         except ValidationError as e:
-            logger.error(f"Couldnt register CDR. \n{e}")
-            failed_cdrs.append(cdr_record)
-
-    db = get_database_connection()
-    # Restore correlation numbers
-    for cdr in failed_cdrs:
-        org = Organization.objects.get(name=cdr["provider"])
-        db.wstore_organization.find_and_modify(query={"_id": org.pk}, update={"$inc": {"correlation_number": -1}})[
-            "correlation_number"
-        ]
-
-    context = Context.objects.all()[0]
-    context.failed_cdrs.extend(failed_cdrs)
-    context.save()
+            logger.error(f"Couldnt register CDR {cdr_record.get('correlationNumber')}. \n{e}")
+            failed_cdrs.append((cdr_record, str(e)))
+
+    if len(cdrs) > 0:
+        try:
+            # A single batch, so the indexes of the write errors refer to the cdrs list
+            CDR.objects.bulk_create([cdr for _, cdr in cdrs], batch_size=len(cdrs))
+        except DatabaseError as e:
+            for index in _get_failed_indexes(e, len(cdrs)):
+                cdr_record = cdrs[index][0]
+                logger.error(f"Couldnt register CDR {cdr_record.get('correlationNumber')}. \n{e}")
+                failed_cdrs.append((cdr_record, str(e)))
+
+    if len(failed_cdrs) > 0:
+        context = Context.objects.all()[0]
+        context.failed_cdrs.extend([cdr_record for cdr_record, _ in failed_cdrs])
+        context.save()
+
+    return failed_cdrs
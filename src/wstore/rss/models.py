@@ -128,6 +128,9 @@ class CDR(models.Model):
     currency = models.CharField(max_length=100)
     customerId = models.CharField(max_length=100)
     providerId = models.CharField(max_length=100)
+    # Id of the settlement run processing the CDR
+    settlementRun = models.CharField(max_length=32, blank=True, default="")
+    settlementClaimedAt = models.DateTimeField(null=True, blank=True, default=None)
 
     def save(self, *args, **kwargs):
         self.full_clean()
@@ -1,8 +1,12 @@
 from threading import Thread
+from uuid import uuid4
+
+from django.conf import settings
+
 from wstore.rss.models import RSSModel, CDR, SettlementReport
-from decimal import Decimal
 from wstore.rss.algorithms.rss_algorithm import RSS_ALGORITHMS
-from datetime import datetime as dt
+from wstore.store_commons.database import get_database_connection
+from datetime import datetime as dt, timedelta
 
 
 class SettlementThread(Thread):
@@ -11,33 +15,98 @@ class SettlementThread(Thread):
         self.providerId = providerId
         self.productClass = productClass
 
+    def _get_totals(self, cdrs, run_id):
+        # Totals are computed by MongoDB, so CDRs are never loaded in memory.
+        # Amounts are stored as Decimal128, so the sums are exact
+        return cdrs.aggregate(
+            [
+                {"$match": {"settlementRun": run_id}},
+                {
+                    "$group": {
+                        "_id": "$currency",
+                        "value": {
+                            "$sum": {
+                                "$cond": [
+                                    {"$eq": ["$transactionType", CDR.TransactionTypes.CHARGE.value]},
+                                    "$chargedAmount",
+                                    {"$multiply": ["$chargedAmount", -1]},
+                                ]
+                            }
+                        },
+                    }
+                },
+            ],
+            allowDiskUse=True,
+        )
+
     def run(self):
         model = RSSModel.objects.get(providerId=self.providerId, productClass=self.productClass)
-        transactions = (
-            CDR.objects.select_for_update()
-            .filter(providerId=self.providerId, productClass=self.productClass)
-            .exclude(state=CDR.TransactionStates.SETTLED)
+        cdrs = get_database_connection()[CDR._meta.db_table]
+
+        # Claim the CDRs to be settled with a single update, tagging them with the
+        # id of the run so only the claimed ones are aggregated and settled. CDRs
+        # being processed by a concurrent run are not claimed again, unless they were
+        # claimed long ago by a run that stopped
+        run_id = uuid4().hex
+        now = dt.utcnow()
+        stale = now - timedelta(seconds=getattr(settings, "SETTLEMENT", {}).get("claim_timeout", 3600))
+
+        claimed = cdrs.update_many(
+            {
+                "providerId": self.providerId,
+                "productClass": self.productClass,
+                "$or": [
+                    {"state": {"$nin": [CDR.TransactionStates.SETTLED.value, CDR.TransactionStates.PROCESSING.value]}},
+                    {
+                        # CDRs claimed before the claim date was stored are also taken
+                        "state": CDR.TransactionStates.PROCESSING.value,
+                        "settlementClaimedAt": {"$not": {"$gte": stale}},
+                    },
+                ],
+            },
+            {
+                "$set": {
+                    "state": CDR.TransactionStates.PROCESSING.value,
+                    "settlementRun": run_id,
+                    "settlementClaimedAt": now,
+                }
+            },
         )
 
-        if not transactions:
+        if claimed.matched_count == 0:
             return 0
 
-        transactions.update(state=CDR.TransactionStates.PROCESSING)
-        currency = transactions[0].currency
-        value = Decimal("0")
-        for cdr in transactions:
-            if cdr.transactionType == CDR.TransactionTypes.CHARGE:
-                value += cdr.chargedAmount
-            else:
-                value -= cdr.chargedAmount
-
-        algorithm = RSS_ALGORITHMS[model.algorithmType]
-        revenue_share = algorithm.calculate_revenue_share(model, value)
-
-        SettlementReport(
-            **{k: v for k, v in revenue_share.items() if k in SettlementReport.field_names()},
-            timestamp=dt.now(),
-            currency=currency,
-        ).save()
-
-        return transactions.update(state=CDR.TransactionStates.SETTLED)
+        settled = 0
+        try:
+            algorithm = RSS_ALGORITHMS[model.algorithmType]
+
+            # A report is generated for each currency. The CDRs of a currency are settled
+            # as soon as its report is saved, so a failure only releases the ones not reported
+            for total in list(self._get_totals(cdrs, run_id)):
+                revenue_share = algorithm.calculate_revenue_share(model, total["value"].to_decimal())
+
+                SettlementReport(
+                    **{k: v for k, v in revenue_share.items() if k in SettlementReport.field_names()},
+                    timestamp=dt.now(),
+                    currency=total["_id"],
+                ).save()
+
+                settled += cdrs.update_many(
+                    {"settlementRun": run_id, "currency": total["_id"]},
+                    {"$set": {"state": CDR.TransactionStates.SETTLED.value}},
+                ).modified_count
+        except Exception:
+            # Release the claim so the CDRs can be settled by a later run
+            cdrs.update_many(
+                {"settlementRun": run_id, "state": CDR.TransactionStates.PROCESSING.value},
+                {
+                    "$set": {
+                        "state": CDR.TransactionStates.RECORDED.value,
+                        "settlementRun": "",
+                        "settlementClaimedAt": None,
+                    }
+                },
+            )
+            raise
+
+        return settled
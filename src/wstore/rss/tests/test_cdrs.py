@@ -1,6 +1,8 @@
 from wstore.rss import cdr_manager
 from wstore.rss.models import CDR
-from mock import MagicMock
+from django.db.utils import DatabaseError
+from mock import MagicMock, patch
+from pymongo.errors import BulkWriteError
 from django.test import TestCase
 from parameterized import parameterized
 from decimal import Decimal
@@ -72,10 +74,7 @@ class CDRGenerationTestCase(TestCase):
         cdr_manager.get_database_connection = MagicMock()
         cdr_manager.get_database_connection.return_value = self._conn
 
-        self._conn.wstore_organization.find_and_modify.side_effect = [
-            {"correlation_number": 1},
-            {"correlation_number": 2},
-        ]
+        self._conn.wstore_organization.find_one_and_update.return_value = {"correlation_number": 1}
 
         self._order = MagicMock()
         self._order.order_id = "1"
@@ -168,9 +167,9 @@ class CDRGenerationTestCase(TestCase):
         cdr_m.generate_cdr(applied_parts, "2015-10-21 06:13:26.661650")
 
         # Validate calls
-        self._conn.wstore_organization.find_and_modify.assert_called_once_with(
-            query={"_id": "61004aba5e05acc115f022f0"},
-            update={"$inc": {"correlation_number": 1}},
+        self._conn.wstore_organization.find_one_and_update.assert_called_once_with(
+            {"_id": "61004aba5e05acc115f022f0"},
+            {"$inc": {"correlation_number": 1}},
         )
 
         cdr_manager.CDRRegistrationThread.assert_called_once_with(exp_cdrs)
@@ -201,10 +200,103 @@ class CDRGenerationTestCase(TestCase):
         cdr_m.refund_cdrs(Decimal("10"), Decimal("8"), "2015-10-21 06:13:26.661650")
 
         # Validate calls
-        self._conn.wstore_organization.find_and_modify.assert_called_once_with(
-            query={"_id": "61004aba5e05acc115f022f0"},
-            update={"$inc": {"correlation_number": 1}},
+        self._conn.wstore_organization.find_one_and_update.assert_called_once_with(
+            {"_id": "61004aba5e05acc115f022f0"},
+            {"$inc": {"correlation_number": 1}},
         )
 
         cdr_manager.CDRRegistrationThread.assert_called_once_with(exp_cdr)
         cdr_manager.CDRRegistrationThread().start.assert_called_once()
+
+    def test_cdr_generation_correlation_range(self):
+        self._conn.wstore_organization.find_one_and_update.return_value = {"correlation_number": 7}
+        part = {"value": Decimal("12"), "unit": "one time", "duty_free": Decimal("10")}
+
+        cdr_m = cdr_manager.CDRManager(self._order, self._contract)
+        cdr_m.generate_cdr({"single_payment": [part, part], "subscription": [dict(part, unit="monthly")]}, "2015-10-21")
+
+        # A single range is reserved for all the CDRs
+        self._conn.wstore_organization.find_one_and_update.assert_called_once_with(
+            {"_id": "61004aba5e05acc115f022f0"},
+            {"$inc": {"correlation_number": 3}},
+        )
+        cdrs = cdr_manager.CDRRegistrationThread.call_args[0][0]
+        self.assertEquals(["7", "8", "9"], [cdr["correlationNumber"] for cdr in cdrs])
+
+
+class CDRRegistrationTestCase(TestCase):
+    tags = ("cdr",)
+
+    def setUp(self):
+        cdr_manager.Context = MagicMock()
+        self._context = cdr_manager.Context.objects.all.return_value.__getitem__.return_value
+        self._context.failed_cdrs = []
+
+    def _build_records(self):
+        return [dict(INITIAL_EXP[0], correlationNumber=str(i)) for i in range(4)]
+
+    @patch.object(CDR, "objects")
+    def test_register_cdr(self, objects):
+        records = self._build_records()
+        records[1]["chargedAmount"] = "invalid"
+
+        failed = cdr_manager.register_cdr(records)
+
+        # Valid CDRs are saved with a single insert
+        objects.bulk_create.assert_called_once()
+        self.assertEquals(["0", "2", "3"], [cdr.correlationNumber for cdr in objects.bulk_create.call_args[0][0]])
+        self.assertEquals([records[1]], [record for record, _ in failed])
+        self.assertEquals([records[1]], self._context.failed_cdrs)
+
+    def _bulk_error(self, details):
+        try:
+            raise BulkWriteError(details)
+        except BulkWriteError as e:
+            error = DatabaseError("Bulk insert failed")
+            error.__cause__ = e
+
+        return error
+
+    @patch.object(CDR, "objects")
+    def test_register_cdr_partial_insert(self, objects):
+        records = self._build_records()
+
+        # Unordered insert, the documents after a failing one are still written
+        objects.bulk_create.side_effect = self._bulk_error(
+            {"nInserted": 2, "writeErrors": [{"index": 3}, {"index": 1}]}
+        )
+
+        failed = cdr_manager.register_cdr(records)
+
+        # Only the CDRs with a write error are reported
+        self.assertEquals(["1", "3"], [record["correlationNumber"] for record, _ in failed])
+        self.assertEquals([records[1], records[3]], self._context.failed_cdrs)
+        self._context.save.assert_called_once_with()
+
+    @patch.object(CDR, "objects")
+    def test_register_cdr_partial_insert_after_invalid(self, objects):
+        records = self._build_records()
+        records[0]["chargedAmount"] = "invalid"
+
+        # Write error indexes refer to the inserted CDRs, not to the received ones
+        objects.bulk_create.side_effect = self._bulk_error({"nInserted": 2, "writeErrors": [{"index": 0}]})
+
+        failed = cdr_manager.register_cdr(records)
+
+        self.assertEquals(["0", "1"], [record["correlationNumber"] for record, _ in failed])
+
+    @patch.object(CDR, "objects")
+    def test_register_cdr_unknown_insert_error(self, objects):
+        records = self._build_records()
+        objects.bulk_create.side_effect = DatabaseError("Connection lost")
+
+        failed = cdr_manager.register_cdr(records)
+
+        self.assertEquals(records, [record for record, _ in failed])
+
+    @patch.object(CDR, "objects")
+    def test_register_cdr_no_failures(self, objects):
+        failed = cdr_manager.register_cdr(self._build_records())
+
+        self.assertEquals([], failed)
+        cdr_manager.Context.objects.all.assert_not_called()
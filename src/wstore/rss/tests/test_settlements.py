@@ -2,16 +2,19 @@
 # from importlib import reload
 
 # from django.conf import settings
-from django.test import TestCase
-from mock import MagicMock, ANY
+from django.test import TestCase, override_settings
+from mock import MagicMock, ANY, call
 from parameterized import parameterized
 
 # import wstore.store_commons.utils.http as http_utils
 # import wstore.rss.views as rss_views
 import wstore.rss.models as rss_models
 import wstore.rss.settlement as rss_settlement
+from datetime import timedelta
 from decimal import Decimal
 
+from bson.decimal128 import Decimal128
+
 # from django.test.client import Client
 # from json import dumps, loads
 # from django.core.exceptions import ObjectDoesNotExist
@@ -177,25 +180,37 @@ class SettlementsTestCase(TestCase):
 
     def setUp(self):
         rss_models.RSSModel.objects = MagicMock()
-        rss_models.CDR.objects = MagicMock()
+        rss_settlement.get_database_connection = MagicMock()
         rss_settlement.SettlementReport = MagicMock()
         rss_settlement.SettlementReport.field_names.return_value = rss_models.SettlementReport.field_names()
         TestCase.setUp(self)
 
+    def _mock_cdrs(self, transactions):
+        cdrs = rss_settlement.get_database_connection.return_value.__getitem__.return_value
+
+        def update_many(query, update):
+            # The CDRs are settled by currency
+            count = len([t for t in transactions if query.get("currency", t["currency"]) == t["currency"]])
+            return MagicMock(matched_count=count, modified_count=count)
+
+        cdrs.update_many.side_effect = update_many
+
+        # Result of the aggregation pipeline
+        totals = {}
+        for t in transactions:
+            value = t["chargedAmount"] if t["transactionType"] == "C" else -t["chargedAmount"]
+            totals[t["currency"]] = totals.get(t["currency"], Decimal("0")) + value
+
+        cdrs.aggregate.return_value = [
+            {"_id": currency, "value": Decimal128(value)} for currency, value in totals.items()
+        ]
+        return cdrs
+
     @parameterized.expand([test.values() for test in TESTS])
     def test_launch_settlement(self, name, transactions, model, expected):
         # Setup
         rss_models.RSSModel.objects.get.return_value = rss_models.RSSModel(**model)
-        mock_transactions = MagicMock(name="mock_transactions")
-        mock_cdr_list = [rss_models.CDR(**t) for t in transactions]
-        mock_transactions.list = mock_cdr_list
-        mock_transactions.__len__.return_value = len(mock_cdr_list)
-        mock_transactions.__bool__.return_value = len(mock_cdr_list) > 0
-        mock_transactions.__iter__.return_value = mock_cdr_list.__iter__()
-        mock_transactions.__getitem__ = lambda self, x: mock_cdr_list[x]
-        mock_transactions.update.return_value = len(mock_cdr_list)
-
-        rss_models.CDR.objects.select_for_update().filter().exclude.return_value = mock_transactions
+        cdrs = self._mock_cdrs(transactions)
 
         # Test
         settlement_thread = rss_settlement.SettlementThread(model["providerId"], model["productClass"])
@@ -203,6 +218,95 @@ class SettlementsTestCase(TestCase):
         returns = settlement_thread.run()
 
         self.assertEquals(returns, expected["return"])
+        rss_settlement.get_database_connection.return_value.__getitem__.assert_called_once_with("wstore_cdr")
+
+        claim_filter, claim_update = cdrs.update_many.call_args_list[0][0]
+        self.assertEquals(
+            {
+                "providerId": model["providerId"],
+                "productClass": model["productClass"],
+                "$or": [
+                    {"state": {"$nin": ["S", "P"]}},
+                    {"state": "P", "settlementClaimedAt": {"$not": {"$gte": ANY}}},
+                ],
+            },
+            claim_filter,
+        )
+        run_id = claim_update["$set"]["settlementRun"]
+
         if returns:
-            self.assertEquals(len(mock_transactions.update.mock_calls), 2)
+            self.assertEquals(len(cdrs.update_many.mock_calls), 2)
+            cdrs.update_many.assert_called_with({"settlementRun": run_id, "currency": "EUR"}, {"$set": {"state": "S"}})
+            self.assertEquals(run_id, cdrs.aggregate.call_args[0][0][0]["$match"]["settlementRun"])
             rss_settlement.SettlementReport.assert_called_once_with(**expected["settlement"], timestamp=ANY)
+        else:
+            cdrs.aggregate.assert_not_called()
+            rss_settlement.SettlementReport.assert_not_called()
+
+    def test_launch_settlement_currencies(self):
+        rss_models.RSSModel.objects.get.return_value = rss_models.RSSModel(**MODELS["basic"])
+        self._mock_cdrs([TRANSACTIONS[0], dict(TRANSACTIONS[1], currency="USD")])
+
+        returns = rss_settlement.SettlementThread("p1", "pc1").run()
+
+        # A report is generated per currency
+        self.assertEquals(2, returns)
+        self.assertEquals(
+            [("EUR", Decimal("70.0000")), ("USD", Decimal("35.0000"))],
+            [
+                (report_call[1]["currency"], report_call[1]["providerTotal"])
+                for report_call in rss_settlement.SettlementReport.call_args_list
+            ],
+        )
+
+    def test_launch_settlement_error_releases_claim(self):
+        rss_models.RSSModel.objects.get.return_value = rss_models.RSSModel(**MODELS["basic"])
+        cdrs = self._mock_cdrs([TRANSACTIONS[0]])
+        rss_settlement.SettlementReport.return_value.save.side_effect = Exception("Database error")
+
+        with self.assertRaises(Exception):
+            rss_settlement.SettlementThread("p1", "pc1").run()
+
+        # The claimed CDRs are recorded again, so a later run can settle them
+        run_id = cdrs.update_many.call_args_list[0][0][1]["$set"]["settlementRun"]
+        self.assertEquals(2, len(cdrs.update_many.mock_calls))
+        cdrs.update_many.assert_called_with(
+            {"settlementRun": run_id, "state": "P"},
+            {"$set": {"state": "R", "settlementRun": "", "settlementClaimedAt": None}},
+        )
+
+    def test_launch_settlement_error_keeps_reported_currencies(self):
+        rss_models.RSSModel.objects.get.return_value = rss_models.RSSModel(**MODELS["basic"])
+        cdrs = self._mock_cdrs([TRANSACTIONS[0], dict(TRANSACTIONS[1], currency="USD")])
+        rss_settlement.SettlementReport.return_value.save.side_effect = [None, Exception("Database error")]
+
+        with self.assertRaises(Exception):
+            rss_settlement.SettlementThread("p1", "pc1").run()
+
+        # The CDRs of the reported currency are settled, only the remaining ones are released
+        run_id = cdrs.update_many.call_args_list[0][0][1]["$set"]["settlementRun"]
+        self.assertEquals(
+            [
+                call({"settlementRun": run_id, "currency": "EUR"}, {"$set": {"state": "S"}}),
+                call(
+                    {"settlementRun": run_id, "state": "P"},
+                    {"$set": {"state": "R", "settlementRun": "", "settlementClaimedAt": None}},
+                ),
+            ],
+            cdrs.update_many.call_args_list[1:],
+        )
+
+    @override_settings(SETTLEMENT={"claim_timeout": 60})
+    def test_launch_settlement_stale_claim(self):
+        rss_models.RSSModel.objects.get.return_value = rss_models.RSSModel(**MODELS["basic"])
+        cdrs = self._mock_cdrs([TRANSACTIONS[0]])
+
+        rss_settlement.SettlementThread("p1", "pc1").run()
+
+        # The CDRs claimed by a run that stopped before the timeout are claimed again
+        claim_filter, claim_update = cdrs.update_many.call_args_list[0][0]
+        claimed_at = claim_update["$set"]["settlementClaimedAt"]
+        stale = claim_filter["$or"][1]["settlementClaimedAt"]["$not"]["$gte"]
+
+        self.assertEquals(timedelta(seconds=60), claimed_at - stale)
+        self.assertEquals("P", claim_update["$set"]["state"])
@@ -20,6 +20,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import atexit
+import os
+import threading
 from logging import getLogger
 
 from django.conf import settings
@@ -27,69 +30,83 @@ from pymongo import MongoClient
 
 logger = getLogger("wstore.default_logger")
 
+# A single MongoClient (and hence a single connection pool) is shared by
+# every thread of the process. MongoClient is not fork safe, so the pid that
+# created the client is tracked and a new one is built lazily in the child
+# the first time a connection is requested after a fork.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
 
-def get_database_connection():
+
+def _get_client_args(database_info):
+    client_info = database_info.get("CLIENT", {})
+    db_name = database_info["NAME"]
+
+    args = [client_info.get("host", "localhost")]
+    if "port" in client_info:
+        args.append(int(client_info["port"]))
+
+    kwargs = {}
+    if "username" in client_info:
+        kwargs["username"] = client_info["username"]
+        kwargs["password"] = client_info["password"]
+        kwargs["authSource"] = db_name
+
+        if "authMechanism" in client_info:
+            kwargs["authMechanism"] = client_info["authMechanism"]
+
+    # Pool size, timeouts and read/write concerns
+    kwargs.update(getattr(settings, "MONGO_CLIENT_OPTIONS", {}))
+    return args, kwargs
+
+
+def get_mongo_client():
     """
-    Gets a raw database connection to MongoDB
+    Gets the MongoClient of the current process, creating it if needed
     """
-    logger.debug("Getting connection to MongoDB")
+    global _client, _client_pid
 
-    # Get database info from settings
-    database_info = settings.DATABASES["default"]
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
 
-    # Create database connection
-    client = None
-    if 'CLIENT' in database_info:
-        client_info = database_info['CLIENT']
-        db_name = database_info['NAME']
-        auth_mech = {}
-        if "authMechanism" in client_info:
-            auth_mech["authMechanism"] = client_info["authMechanism"]
-
-        if "host" in client_info and "port" in client_info and "username" in client_info:
-            client = MongoClient(
-                client_info['host'],
-                int(client_info['port']),
-                username=client_info['username'],
-                password=client_info['password'],
-                authSource=db_name,
-                **auth_mech)
-
-        elif "host" in client_info and "port" in client_info and "username" not in client_info:
-            client = MongoClient(client_info["host"], int(client_info["port"]))
-
-        elif "host" in client_info and "port" not in client_info and "username" in client_info:
-            client = MongoClient(
-                client_info['host'],
-                username=client_info['username'],
-                password=client_info['password'],
-                authSource=db_name,
-                **auth_mech)
-
-        elif "host" in client_info and "port" not in client_info and "username" not in client_info:
-            client = MongoClient(client_info["host"])
-
-        elif "host" not in client_info and "port" in client_info and "username" in client_info:
-            client = MongoClient(
-                'localhost',
-                int(client_info['port']),
-                username=client_info['username'],
-                password=client_info['password'],
-                authSource=db_name,
-                **auth_mech)
-
-        elif "host" not in client_info and "port" in client_info and "username" not in client_info:
-            client = MongoClient("localhost", int(client_info["port"]), **auth_mech)
-
-        else:
-            client = MongoClient(**auth_mech)
-    else:
-        client = MongoClient()
-
-    db = client[db_name]
-
-    logger.info(f"Connected to MongoDB: {db_name} OK")
-    return db
+    with _client_lock:
+        if _client is None or _client_pid != pid:
+            # The client inherited from the parent process (if any) must not
+            # be used nor closed here, as its sockets are shared with the parent
+            args, kwargs = _get_client_args(settings.DATABASES["default"])
+            _client = MongoClient(*args, connect=False, **kwargs)
+            _client_pid = pid
+
+            logger.info(f"Created MongoDB client for process {pid}")
+
+    return _client
+
+
+def close_database_connection():
+    """
+    Closes the MongoClient of the current process, releasing its connection pool
+    """
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+            logger.info("Closed MongoDB client")
+
+        _client = None
+        _client_pid = None
+
+
+atexit.register(close_database_connection)
+
+
+def get_database_connection():
+    """
+    Gets a raw database connection to MongoDB
+    """
+    return get_mongo_client()[settings.DATABASES["default"]["NAME"]]
 
 
 class DocumentLock:
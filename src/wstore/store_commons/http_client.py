@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import os
+import threading
+from logging import getLogger
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from wstore.store_commons.utils.url import get_api_urls
+
+logger = getLogger("wstore.default_logger")
+
+DEFAULT_SESSION = "default"
+
+# One keep-alive session (and hence one connection pool) is kept per TMForum
+# API and process. As with the MongoDB client, sessions created before a fork
+# are discarded in the child, since their sockets are shared with the parent.
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+
+class TMFSession(requests.Session):
+    """
+    Session that applies the configured connect/read timeouts to every
+    request that does not provide its own
+    """
+
+    def __init__(self, timeout):
+        super().__init__()
+        self._timeout = timeout
+        self.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self._timeout)
+        return super().request(method, url, **kwargs)
+
+
+def _build_session():
+    options = getattr(settings, "HTTP_CLIENT_OPTIONS", {})
+
+    session = TMFSession((options.get("connect_timeout", 10), options.get("read_timeout", 60)))
+    adapter = HTTPAdapter(
+        pool_connections=options.get("pool_connections", 10),
+        pool_maxsize=options.get("pool_maxsize", 10),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_api_name(url):
+    """
+    Returns the name of the TMForum API serving the given URL, or the
+    default session name when the URL does not belong to any of them
+    """
+    api_name = DEFAULT_SESSION
+    api_len = 0
+
+    for api, api_url in get_api_urls().items():
+        # Longest prefix wins, as several APIs may share the same host
+        if len(api_url) > api_len and (url == api_url or url.startswith(api_url + "/")):
+            api_name = api
+            api_len = len(api_url)
+
+    return api_name
+
+
+def get_session(api=DEFAULT_SESSION):
+    """
+    Gets the pooled session of the current process used for the given API
+    """
+    global _sessions, _sessions_pid
+
+    pid = os.getpid()
+    if _sessions_pid != pid:
+        with _sessions_lock:
+            if _sessions_pid != pid:
+                _sessions = {}
+                _sessions_pid = pid
+
+    session = _sessions.get(api)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(api)
+            if session is None:
+                session = _build_session()
+                _sessions[api] = session
+
+                logger.debug(f"Created HTTP session for {api} API")
+
+    return session
+
+
+def close_sessions():
+    global _sessions
+
+    with _sessions_lock:
+        if _sessions_pid == os.getpid():
+            for session in _sessions.values():
+                session.close()
+
+        _sessions = {}
+
+
+atexit.register(close_sessions)
+
+
+def request(method, url, **kwargs):
+    return get_session(get_api_name(url)).request(method, url, **kwargs)
+
+
+def get(url, params=None, **kwargs):
+    return request("get", url, params=params, **kwargs)
+
+
+def post(url, data=None, json=None, **kwargs):
+    return request("post", url, data=data, json=json, **kwargs)
+
+
+def put(url, data=None, **kwargs):
+    return request("put", url, data=data, **kwargs)
+
+
+def patch(url, data=None, **kwargs):
+    return request("patch", url, data=data, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("delete", url, **kwargs)
@@ -19,19 +19,43 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
 from logging import getLogger
 
+from django.conf import settings
 from django.utils.functional import SimpleLazyObject
 
+from wstore.store_commons.utils.cache import LRUCache
+
 
 logger = getLogger("wstore.default_logger")
 
+
+def _get_identity_cache():
+    return LRUCache(getattr(settings, "IDENTITY_CACHE", {}).get("max_entries", 10000))
+
+
+# Organizations already stored with the attributes of a set of headers, keyed
+# by the header fingerprint, so repeat callers do not cause any write
+IDENTITY_CACHE = _get_identity_cache()
+
+
+def _update_fields(instance, values):
+    # Sets the given attributes, returning whether any of them has changed
+    changed = False
+    for field, value in values.items():
+        if getattr(instance, field) != value:
+            setattr(instance, field, value)
+            changed = True
+
+    return changed
+
+
 class AuthenticationMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def _get_api_user(self, request):
-        from django.conf import settings
         from django.contrib.auth.models import AnonymousUser
         from wstore.models import Organization, User
 
@@ -72,11 +96,16 @@ class AuthenticationMiddleware:
         except:
             user = User.objects.create(username=user_id)
 
+        profile = user.userprofile
+        user_changed = False
+        profile_changed = False
+
         if actor_id == user_id:
             # Update user info
-            user.email = email
-            user.userprofile.complete_name = display_name
-            user.is_staff = settings.ADMIN_ROLE.lower() in roles
+            user_changed = _update_fields(user, {"email": email, "is_staff": settings.ADMIN_ROLE.lower() in roles})
+            profile_changed = _update_fields(profile, {"complete_name": display_name})
+
+        if user_changed:
             user.save()
 
         user_roles = []
@@ -87,25 +116,44 @@ class AuthenticationMiddleware:
         if settings.CUSTOMER_ROLE.lower() in roles:
             user_roles.append("customer")
 
-        # Get or create current organization
-        try:
-            org = Organization.objects.get(name=actor_id)
-        except:
-            org = Organization.objects.create(name=actor_id)
-
-        org.private = actor_id == user_id
-        org.idp = idp
-        org.issuerDid = issuerDid
-        org.actor_id = party_id
-        org.save()
-
-        user.userprofile.current_roles = user_roles
-        user.userprofile.current_organization = org
-        user.userprofile.access_token = token_info[1]
-        user.userprofile.actor_id = user_party_id
+        # Get or create current organization, unless it has been recently stored
+        # with the same attributes
+        fingerprint = (actor_id, actor_id == user_id, idp, issuerDid, party_id)
+        cached = IDENTITY_CACHE.get(fingerprint)
+
+        if cached is not None and cached[1] > time.monotonic():
+            if profile.current_organization_id != cached[0]:
+                profile.current_organization_id = cached[0]
+                profile_changed = True
+        else:
+            try:
+                org = Organization.objects.get(name=actor_id)
+            except:
+                org = Organization.objects.create(name=actor_id)
+
+            org_changed = _update_fields(
+                org, {"private": actor_id == user_id, "idp": idp, "issuerDid": issuerDid, "actor_id": party_id}
+            )
+            if org_changed:
+                org.save()
+
+            IDENTITY_CACHE.set(fingerprint, (org.pk, time.monotonic() + getattr(settings, "IDENTITY_CACHE", {}).get("ttl", 60)))
+
+            if profile.current_organization_id != org.pk:
+                profile.current_organization = org
+                profile_changed = True
+
+        profile_changed = (
+            _update_fields(
+                profile,
+                {"current_roles": user_roles, "access_token": token_info[1], "actor_id": user_party_id},
+            )
+            or profile_changed
+        )
 
         # change user.userprofile.current_organization
-        user.userprofile.save()
+        if profile_changed:
+            profile.save()
 
         logger.debug(f"Current Actor: {actor_id}")
         logger.debug(f"Current User: {user_id}")
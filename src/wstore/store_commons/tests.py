@@ -29,7 +29,7 @@ from django.test.utils import override_settings
 from mock import MagicMock, call
 from parameterized import parameterized
 
-from wstore.store_commons import database, middleware, rollback
+from wstore.store_commons import database, http_client, middleware, rollback
 from wstore.store_commons.utils.url import is_valid_url
 
 __test__ = False
@@ -69,6 +69,7 @@ class AuthenticationMiddlewareTestCase(TestCase):
         self._org_model.objects.create.return_value = self._org_instance
 
         wstore.models.Organization = self._org_model
+        middleware.IDENTITY_CACHE.clear()
 
     def tearDown(self):
         import wstore.models
@@ -232,6 +233,68 @@ class AuthenticationMiddlewareTestCase(TestCase):
         self._org_instance.save.assert_called_once_with()
         self._user_inst.userprofile.save.assert_called_once_with()
 
+    def _set_stored_identity(self):
+        # User, profile and organization already stored with the header values
+        self._user_inst.email = "user@email.com"
+        self._user_inst.is_staff = False
+        self._user_inst.userprofile.complete_name = "Test user"
+        self._user_inst.userprofile.current_organization_id = "org"
+        self._user_inst.userprofile.current_roles = ["customer"]
+        self._user_inst.userprofile.access_token = "1234567890abcdf"
+        self._user_inst.userprofile.actor_id = "urn:party:local:test-user"
+
+        self._org_instance.private = True
+        self._org_instance.idp = "local"
+        self._org_instance.issuerDid = "none"
+        self._org_instance.actor_id = "urn:party:local:test-user"
+
+    def _call_middleware(self):
+        request = MagicMock()
+        request.META = {
+            "HTTP_X_ACTOR_ID": "test-user",
+            "HTTP_X_DISPLAY_NAME": "Test user",
+            "HTTP_X_USER_ID": "test-user",
+            "HTTP_X_ROLES": "buyer",
+            "HTTP_AUTHORIZATION": "Bearer 1234567890abcdf",
+            "HTTP_X_EMAIL": "user@email.com",
+            "HTTP_X_IDP_ID": "local",
+            "HTTP_X_PARTY_ID": "urn:party:local:test-user",
+            "HTTP_X_USER_PARTY_ID": "urn:party:local:test-user",
+        }
+
+        middleware_class = middleware.AuthenticationMiddleware(lambda request: MagicMock())
+        middleware_class(request)
+        return request.user
+
+    def test_get_api_user_no_changes(self):
+        self._set_stored_identity()
+
+        self.assertEquals(self._user_inst, self._call_middleware())
+        self._org_model.objects.get.assert_called_once_with(name="test-user")
+
+        # Repeat calls use the cached organization
+        self.assertEquals(self._user_inst, self._call_middleware())
+        self._org_model.objects.get.assert_called_once_with(name="test-user")
+
+        self._user_inst.save.assert_not_called()
+        self._user_inst.userprofile.save.assert_not_called()
+        self._org_instance.save.assert_not_called()
+
+    def test_get_api_user_token_changed(self):
+        self._set_stored_identity()
+        self.assertEquals(self._user_inst, self._call_middleware())
+
+        self._user_inst.userprofile.access_token = "old"
+        self._user_inst.userprofile.current_organization_id = "other"
+        self.assertEquals(self._user_inst, self._call_middleware())
+
+        self._user_inst.save.assert_not_called()
+        self._org_instance.save.assert_not_called()
+        self._user_inst.userprofile.save.assert_called_once_with()
+
+        self.assertEquals("1234567890abcdf", self._user_inst.userprofile.access_token)
+        self.assertEquals("org", self._user_inst.userprofile.current_organization_id)
+
 
 @override_settings(BASEDIR="/base/dir")
 class RollbackTestCase(TestCase):
@@ -367,6 +430,108 @@ class RollbackTestCase(TestCase):
         rollback.downgrade_asset_pa(manager())
 
 
+@override_settings(
+    DATABASES={"default": {"NAME": "wstore_db", "CLIENT": {"host": "mongo", "port": 27017}}},
+    MONGO_CLIENT_OPTIONS={"maxPoolSize": 10},
+)
+class DatabaseConnectionTestCase(TestCase):
+    tags = ("database",)
+
+    def setUp(self):
+        self._get_database_connection = reload(database).get_database_connection
+        database.MongoClient = MagicMock()
+        database.os = MagicMock()
+        database.os.getpid.return_value = 1
+
+    def tearDown(self):
+        database.close_database_connection()
+        reload(database)
+
+    def test_client_reused(self):
+        db1 = self._get_database_connection()
+        db2 = self._get_database_connection()
+
+        database.MongoClient.assert_called_once_with("mongo", 27017, connect=False, maxPoolSize=10)
+        database.MongoClient().__getitem__.assert_called_with("wstore_db")
+        self.assertEquals(db1, db2)
+
+    @override_settings(
+        DATABASES={
+            "default": {
+                "NAME": "wstore_db",
+                "CLIENT": {"host": "mongo", "username": "user", "password": "passwd", "authMechanism": "SCRAM-SHA-1"},
+            }
+        },
+    )
+    def test_client_credentials(self):
+        self._get_database_connection()
+
+        database.MongoClient.assert_called_once_with(
+            "mongo",
+            connect=False,
+            username="user",
+            password="passwd",
+            authSource="wstore_db",
+            authMechanism="SCRAM-SHA-1",
+            maxPoolSize=10,
+        )
+
+    def test_client_recreated_after_fork(self):
+        parent = MagicMock()
+        child = MagicMock()
+        database.MongoClient.side_effect = [parent, child]
+
+        self._get_database_connection()
+        database.os.getpid.return_value = 2
+        self._get_database_connection()
+
+        self.assertEquals(2, database.MongoClient.call_count)
+        parent.close.assert_not_called()
+
+        database.close_database_connection()
+        child.close.assert_called_once_with()
+        self.assertIsNone(database._client)
+
+
+@override_settings(
+    CATALOG="http://tmf.com/catalog/",
+    INVENTORY="http://tmf.com",
+    HTTP_CLIENT_OPTIONS={"connect_timeout": 5, "read_timeout": 30},
+)
+class HTTPClientTestCase(TestCase):
+    tags = ("http-client",)
+
+    def setUp(self):
+        http_client.close_sessions()
+
+    @parameterized.expand(
+        [
+            ("catalog", "http://tmf.com/catalog/productOfferingPrice/1", "catalog"),
+            ("inventory", "http://tmf.com/product/1", "inventory"),
+            ("prefix_not_path", "http://tmf.com/catalogs/1", "inventory"),
+            ("external", "http://external.com/api", http_client.DEFAULT_SESSION),
+        ]
+    )
+    def test_get_api_name(self, name, url, expected):
+        self.assertEquals(expected, http_client.get_api_name(url))
+
+    def test_session_reused(self):
+        session = http_client.get_session("catalog")
+
+        self.assertIs(session, http_client.get_session("catalog"))
+        self.assertIsNot(session, http_client.get_session("inventory"))
+
+    def test_request_default_timeout(self):
+        session = http_client.get_session("catalog")
+        session.send = MagicMock()
+
+        http_client.get("http://tmf.com/catalog/productOfferingPrice/1")
+        http_client.post("http://tmf.com/catalog/productOfferingPrice", json={}, timeout=1)
+
+        self.assertEquals((5, 30), session.send.call_args_list[0][1]["timeout"])
+        self.assertEquals(1, session.send.call_args_list[1][1]["timeout"])
+
+
 class DocumentLockTestCase(TestCase):
     tags = ("lock",)
 
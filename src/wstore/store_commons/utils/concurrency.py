@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2025 Future Internet Consulting and Development Solutions S.L.
+
+# This file belongs to the business-charging-backend
+# of the Business API Ecosystem.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connections
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+def get_deadline(timeout=None):
+    """
+    Returns the monotonic instant at which a request started now must have
+    finished its fetches, using CONCURRENT_FETCH["deadline"] by default
+    """
+    if timeout is None:
+        timeout = getattr(settings, "CONCURRENT_FETCH", {}).get("deadline", 30)
+
+    return time.monotonic() + timeout
+
+
+def run_in_worker(call, *args):
+    """
+    Runs the given call in a worker thread, closing the database connections
+    opened by the thread once it finishes
+    """
+    try:
+        return call(*args)
+    finally:
+        # Database connections are per thread, release the ones opened by the worker
+        connections.close_all()
+
+
+def _cancel_pending(futures):
+    # Executor.shutdown(cancel_futures=True) is only available from python 3.9
+    for future in futures:
+        future.cancel()
+
+
+def fetch_all(calls, deadline=None, wait_started=False):
+    """
+    Runs the given independent calls (callables without arguments) in
+    parallel, with at most CONCURRENT_FETCH["max_workers"] at a time, and
+    returns their results in the same order. The first error raised by any
+    of the calls is propagated once the calls already started have finished
+    (pending ones are not started), and DeadlineExceeded is raised if they
+    have not finished before the deadline. If wait_started is set, the calls
+    already started are also waited for before raising DeadlineExceeded, so
+    their side effects are known by the caller
+    """
+    calls = list(calls)
+    max_workers = getattr(settings, "CONCURRENT_FETCH", {}).get("max_workers", 8)
+
+    if len(calls) == 0:
+        return []
+
+    if len(calls) == 1 or max_workers <= 1:
+        # Nothing to parallelize, avoid the thread overhead
+        results = []
+        for fetch in calls:
+            if deadline is not None and time.monotonic() > deadline:
+                raise DeadlineExceeded("Deadline exceeded waiting for remote resources")
+
+            results.append(fetch())
+
+        return results
+
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(calls)))
+    futures = []
+    try:
+        futures = [executor.submit(run_in_worker, fetch) for fetch in calls]
+        done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+
+        for future in futures:
+            if future in done and future.exception() is not None:
+                _cancel_pending(futures)
+                executor.shutdown(wait=True)
+                raise future.exception()
+
+        if len(not_done) > 0:
+            if wait_started:
+                _cancel_pending(futures)
+                executor.shutdown(wait=True)
+
+            raise DeadlineExceeded("Deadline exceeded waiting for remote resources")
+
+        return [future.result() for future in futures]
+    finally:
+        # Pending calls are not started once the result is known
+        _cancel_pending(futures)
+        executor.shutdown(wait=False)
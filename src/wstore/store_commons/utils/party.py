@@ -18,10 +18,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import requests
 from django.conf import settings
 from django.core.cache import cache
 
+from wstore.store_commons import http_client
 from wstore.store_commons.utils.url import get_service_url
 
 CACHE_KEY = "operator:party_id"
@@ -34,7 +34,7 @@ class PartyClient:
 
     def _get_party_id(self, query):
         party_url = get_service_url('party', f'/organization{query}')
-        response = requests.get(party_url)
+        response = http_client.get(party_url)
 
         party_id = None
         if response.status_code == 200:
@@ -73,7 +73,7 @@ class PartyClient:
     def get_party_ext_id(self, party_id):
         party_url = get_service_url('party', f'/organization/{party_id}')
 
-        response = requests.get(party_url)
+        response = http_client.get(party_url)
 
         party_ext_id = None
         if response.status_code == 200:
@@ -19,12 +19,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import time
+
 from django.conf import settings
 from django.test import TestCase
 from django.test.utils import override_settings
 from parameterized import parameterized
 from mock import MagicMock, call
 
+from wstore.store_commons.utils.cache import LRUCache
+from wstore.store_commons.utils.concurrency import DeadlineExceeded, fetch_all, get_deadline
 from wstore.store_commons.utils.units import ChargePeriod, CurrencyCode
 
 
@@ -121,6 +125,110 @@ class CurrencyCodeUnitsTestCase(TestCase):
 
 
 
+class LRUCacheTestCase(TestCase):
+    tags = ("cache",)
+
+    def test_get_set(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+
+        self.assertEquals(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEquals({"entries": 1, "size": 1, "hits": 1, "misses": 1, "evictions": 0, "hit_rate": 0.5}, cache.stats())
+
+    def test_evict_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEquals(1, cache.get("a"))
+        self.assertEquals(3, cache.get("c"))
+        self.assertEquals(1, cache.evictions)
+
+    def test_evict_by_size(self):
+        cache = LRUCache(10, max_size=100)
+        cache.set("a", 1, size=60)
+        cache.set("b", 2, size=30)
+        cache.set("c", 3, size=30)
+        cache.set("d", 4, size=200)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNone(cache.get("d"))
+        self.assertEquals(60, cache.stats()["size"])
+        self.assertEquals(2, cache.evictions)
+
+
+class FetchAllTestCase(TestCase):
+    tags = ("concurrency",)
+
+    def _delayed(self, value, delay):
+        def fetch():
+            time.sleep(delay)
+            return value
+
+        return fetch
+
+    @parameterized.expand([
+        ("parallel", 4),
+        ("sequential", 1),
+    ])
+    def test_fetch_all_keeps_order(self, name, max_workers):
+        with override_settings(CONCURRENT_FETCH={"max_workers": max_workers}):
+            result = fetch_all([self._delayed(1, 0.03), self._delayed(2, 0.01), self._delayed(3, 0)])
+
+        self.assertEquals([1, 2, 3], result)
+
+    def test_fetch_all_parallel(self):
+        start = time.monotonic()
+        fetch_all([self._delayed(i, 0.1) for i in range(4)])
+
+        self.assertLess(time.monotonic() - start, 0.3)
+
+    def test_fetch_all_error(self):
+        def fail():
+            raise ValueError("Error fetching")
+
+        with self.assertRaises(ValueError):
+            fetch_all([self._delayed(1, 0.05), fail])
+
+    def test_fetch_all_deadline(self):
+        with self.assertRaises(DeadlineExceeded):
+            fetch_all([self._delayed(1, 0.5), self._delayed(2, 0)], get_deadline(0.05))
+
+    def test_fetch_all_pending_not_started(self):
+        started = []
+
+        def record():
+            started.append(True)
+
+        with override_settings(CONCURRENT_FETCH={"max_workers": 2}):
+            with self.assertRaises(DeadlineExceeded):
+                fetch_all([self._delayed(1, 0.2), self._delayed(2, 0.2), record], get_deadline(0.05))
+
+        time.sleep(0.3)
+        self.assertEquals([], started)
+
+    def test_fetch_all_deadline_wait_started(self):
+        finished = []
+
+        def record():
+            time.sleep(0.2)
+            finished.append(True)
+
+        with override_settings(CONCURRENT_FETCH={"max_workers": 2}):
+            with self.assertRaises(DeadlineExceeded):
+                fetch_all([record, record, record], get_deadline(0.05), wait_started=True)
+
+        # The started calls have finished when the error is raised, the pending one is not run
+        self.assertEquals([True, True], finished)
+
+    def test_fetch_all_empty(self):
+        self.assertEquals([], fetch_all([]))
+
+
 class URLTestCase(TestCase):
     tags = ("url",)
 
@@ -177,13 +285,13 @@ class PartyTestCase(TestCase):
         self.assertTrue(party_id is None)
 
     def _test_get_operator_party_id(self, responses, calls):
-        self._party.requests = MagicMock()
-        self._party.requests.get.side_effect = responses
+        self._party.http_client = MagicMock()
+        self._party.http_client.get.side_effect = responses
 
         party_id = self._party.get_operator_party_id()
 
         self.assertEquals('urn:partyid', party_id)
-        self.assertEquals(calls, self._party.requests.get.call_args_list)
+        self.assertEquals(calls, self._party.http_client.get.call_args_list)
 
     @override_settings(
         OPERATOR_ID='VATES-123',
@@ -297,8 +405,8 @@ class PartyTestCase(TestCase):
             }]
         }
 
-        self._party.requests = MagicMock()
-        self._party.requests.get.return_value = response
+        self._party.http_client = MagicMock()
+        self._party.http_client.get.return_value = response
 
         norm = self._party.normalize_party_ref({
             'id': 'urn:individual:partyId',
@@ -315,4 +423,4 @@ class PartyTestCase(TestCase):
 
         self.assertEquals([
             call('http://myparty.com/organization/urn:individual:partyId')
-        ], self._party.requests.get.call_args_list)
\ No newline at end of file
+        ], self._party.http_client.get.call_args_list)
\ No newline at end of file
@@ -19,6 +19,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from functools import lru_cache
 from urllib.parse import quote, quote_plus, urlsplit, urlunsplit, urlparse
 
 from django.core.exceptions import ValidationError
@@ -53,30 +54,39 @@ def add_slash(url):
     return url
 
 
-def get_service_url(api, path):
-    TMF_APIS = {
-        "catalog": settings.CATALOG,
-        "party": settings.PARTY,
-        "resource_catalog": settings.RESOURCE_CATALOG,
-        "service_catalog": settings.SERVICE_CATALOG,
-        "inventory": settings.INVENTORY,
-        "resource_inventory": settings.RESOURCE_INVENTORY,
-        "service_inventory": settings.SERVICE_INVENTORY,
-        "ordering": settings.ORDERING,
-        "account": settings.ACCOUNT,
-        "billing": settings.BILLING,
-        "usage": settings.USAGE
-    }
-
-    api_url = TMF_APIS.get(api, None)
-    if api_url is None:
-        raise ValueError(f"Invalid API name: {api}")
+TMF_API_SETTINGS = {
+    "catalog": "CATALOG",
+    "party": "PARTY",
+    "resource_catalog": "RESOURCE_CATALOG",
+    "service_catalog": "SERVICE_CATALOG",
+    "inventory": "INVENTORY",
+    "resource_inventory": "RESOURCE_INVENTORY",
+    "service_inventory": "SERVICE_INVENTORY",
+    "ordering": "ORDERING",
+    "account": "ACCOUNT",
+    "billing": "BILLING",
+    "usage": "USAGE",
+}
 
+
+@lru_cache(maxsize=None)
+def _normalize_api_url(api_url):
     parsed_url = urlparse(api_url)
-    host = parsed_url.netloc
-    api_path = parsed_url.path
+    return f"{parsed_url.scheme}://{parsed_url.netloc}{parsed_url.path.rstrip('/')}"
+
 
-    if api_path.endswith('/'):
-        api_path = api_path.rstrip('/')
+def get_api_urls():
+    """
+    Returns the normalized base URL of every TMForum API. Settings are read on
+    every call, so they can be changed at runtime, but each value is parsed once
+    """
+    return {api: _normalize_api_url(getattr(settings, setting)) for api, setting in TMF_API_SETTINGS.items()}
+
+
+def get_service_url(api, path):
+    api_setting = TMF_API_SETTINGS.get(api, None)
+    if api_setting is None:
+        raise ValueError(f"Invalid API name: {api}")
 
-    return f"{parsed_url.scheme}://{host}{api_path}/{path.lstrip('/')}"
+    api_url = _normalize_api_url(getattr(settings, api_setting))
+    return f"{api_url}/{path.lstrip('/')}"
@@ -23,7 +23,9 @@ import json
 from django.test.client import RequestFactory
 from mock import call
 
-from wstore import views
+from parameterized import parameterized
+
+from wstore import apps, views
 from wstore.admin.users.tests import *
 from wstore.store_commons.tests import *
 
@@ -66,11 +68,8 @@ class ServeMediaTestCase(TestCase):
         order_inst.owner_organization = self._org
         views.Order.objects.get.return_value = order_inst
 
-        # Mock offering
-        views.Offering = MagicMock()
-        self._offering_inst = MagicMock()
-        self._offering_inst.asset = self._asset_inst
-        views.Offering.objects.get.side_effect = [MagicMock(), self._offering_inst]
+        # Mock entitlements
+        views.has_access = MagicMock(return_value=False)
 
     def _validate_res_call(self):
         views.Resource.objects.filter.assert_called_once_with(resource_path=self._resource_path)
@@ -78,43 +77,7 @@ class ServeMediaTestCase(TestCase):
 
     def _validate_off_call(self):
         self._validate_res_call()
-        self.assertEquals(
-            [
-                call(pk=ObjectId("61004aba5e05acc115f022f0")),
-                call(pk=ObjectId("61004aba5e05acc115f022f1")),
-            ],
-            views.Offering.objects.get.call_args_list,
-        )
-
-    def _validate_bundle_call(self):
-        self._validate_res_call()
-        self.assertEquals(
-            [
-                call(pk=ObjectId("61004aba5e05acc115f022f0")),
-                call(pk=ObjectId("61004aba5e05acc115f022f1")),
-                call(pk=ObjectId("61004aba5e05acc115f022f2")),
-                call(pk=ObjectId("61004aba5e05acc115f022f2")),
-                call(pk=ObjectId("61004aba5e05acc115f022f3")),
-                call(pk=ObjectId("61004aba5e05acc115f022f3")),
-            ],
-            views.Offering.objects.get.call_args_list,
-        )
-
-    def _validate_product_bundle_call(self):
-        views.Resource.objects.filter.assert_called_once_with(resource_path=self._resource_path)
-        self.assertEquals(
-            [call(pk="prodpk1"), call(pk="prodpk2")],
-            views.Resource.objects.get.call_args_list,
-        )
-        self.assertEquals(0, views.Order.objects.get.call_count)
-
-        self.assertEquals(
-            [
-                call(pk=ObjectId("61004aba5e05acc115f022f0")),
-                call(pk=ObjectId("61004aba5e05acc115f022f1")),
-            ],
-            views.Offering.objects.get.call_args_list,
-        )
+        views.has_access.assert_called_once_with(self._user.userprofile.current_organization_id, self._asset_inst.pk)
 
     def _validate_upgrading_call(self):
         self.assertEquals(
@@ -167,11 +130,7 @@ class ServeMediaTestCase(TestCase):
         views.Order.objects.get.side_effect = Exception("Not found")
 
     def _unauthorized(self):
-        self._acquired()
-        views.Offering.objects.get.side_effect = [
-            MagicMock(is_digital=False),
-            MagicMock(is_digital=True, asset=MagicMock()),
-        ]
+        self._user.userprofile.current_organization = MagicMock()
 
     def _not_loged(self):
         self._user.is_anonymous = True
@@ -181,36 +140,7 @@ class ServeMediaTestCase(TestCase):
 
     def _acquired(self):
         self._user.userprofile.current_organization = MagicMock()
-        self._user.userprofile.current_organization.acquired_offerings = [
-            "61004aba5e05acc115f022f0",
-            "61004aba5e05acc115f022f1",
-        ]
-
-    def _bundle_acquired(self):
-        self._acquired()
-        self._offering_inst = MagicMock(
-            asset=None,
-            bundled_offerings=["61004aba5e05acc115f022f2", "61004aba5e05acc115f022f3"],
-        )
-
-        views.Offering.objects.get.side_effect = [
-            MagicMock(),
-            self._offering_inst,
-            MagicMock(is_digital=True, asset=MagicMock()),
-            MagicMock(is_digital=True, asset=MagicMock()),
-            MagicMock(is_digital=True, asset=self._asset_inst),
-            MagicMock(is_digital=True, asset=self._asset_inst),
-        ]
-
-    def _product_bundle_acquired(self):
-        self._acquired()
-        self._offering_inst.asset = MagicMock(bundled_assets=["prodpk1", "prodpk2"])
-
-        views.Resource.objects.get.side_effect = [
-            self._asset_inst,
-            MagicMock(),
-            self._asset_inst,
-        ]
+        views.has_access.return_value = True
 
     def _upgrading(self):
         self._asset_inst.old_versions = [MagicMock(resource_path=self._resource_path)]
@@ -238,24 +168,6 @@ class ServeMediaTestCase(TestCase):
                 _expected_file,
                 _acquired,
             ),
-            (
-                "asset_in_bundle",
-                "assets/test_user",
-                "widget.wgt",
-                _validate_bundle_call,
-                _validate_serve,
-                _expected_file,
-                _bundle_acquired,
-            ),
-            (
-                "asset_in_product_bundle",
-                "assets/test_user",
-                "widget.wgt",
-                _validate_product_bundle_call,
-                _validate_serve,
-                _expected_file,
-                _product_bundle_acquired,
-            ),
             (
                 "public_asset",
                 "assets/test_user",
@@ -412,3 +324,19 @@ class ServeMediaTestCase(TestCase):
         response = media_view.read(self.request, path, file_name)
         call_validator(self)
         res_validator(self, response, expected)
+
+
+class ServerProcessTestCase(TestCase):
+    tags = ("apps",)
+
+    @parameterized.expand(
+        [
+            ("gunicorn", ["/usr/local/bin/gunicorn", "wsgi:application"], True),
+            ("runserver", ["manage.py", "runserver", "0.0.0.0:8006"], True),
+            ("command", ["manage.py", "refresh_vat_rates"], False),
+            ("command_path", ["/business-ecosystem-charging-backend/src/manage.py", "pending_charges_daemon"], False),
+            ("django_admin", ["/usr/local/bin/django-admin", "build_entitlements"], False),
+        ]
+    )
+    def test_is_server_process(self, name, argv, expected):
+        self.assertEquals(expected, apps.is_server_process(argv))
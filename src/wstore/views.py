@@ -21,14 +21,14 @@
 
 import os
 
-from bson.objectid import ObjectId
 from django.conf import settings
 from django.http import HttpResponse
 from django.utils.encoding import smart_str
 from django.views.static import serve
 
+from wstore.asset_manager.entitlements import has_access
 from wstore.models import Organization, Resource
-from wstore.ordering.models import Offering, Order
+from wstore.ordering.models import Order
 from wstore.store_commons.resource import Resource as API_Resource
 from wstore.store_commons.utils.http import build_response
 
@@ -82,33 +82,7 @@ class ServeMedia(API_Resource):
 
             if err_code is None and user.userprofile.current_organization != asset.provider:
                 # Check if the user has acquired the asset
-                acquired_offerings = user.userprofile.current_organization.acquired_offerings
-
-                for offering in [Offering.objects.get(pk=ObjectId(off)) for off in acquired_offerings]:
-                    # Process the offering in order to extract all the offering assets
-                    offering_assets = []
-                    if len(offering.bundled_offerings) > 0:
-                        offering_assets = [
-                            Offering.objects.get(pk=ObjectId(off)).asset
-                            for off in offering.bundled_offerings
-                            if Offering.objects.get(pk=ObjectId(off)).is_digital
-                        ]
-                    elif offering.is_digital:
-                        offering_assets = [offering.asset]
-
-                    # Process offering assets in order to expand product bundles
-                    assets = []
-                    for off_asset in offering_assets:
-                        if len(off_asset.bundled_assets) > 0:
-                            assets.extend(
-                                [Resource.objects.get(pk=bundled_pk) for bundled_pk in off_asset.bundled_assets]
-                            )
-                        else:
-                            assets.append(off_asset)
-
-                    if asset in assets:
-                        break
-                else:
+                if not has_access(user.userprofile.current_organization_id, asset.pk):
                     err_code, err_msg = (
                         403,
                         "You are not authorized to download the specified asset",